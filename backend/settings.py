@@ -128,6 +128,32 @@ DATABASES = {
     }
 }
 
+# ----------------------------
+# Cache
+# ----------------------------
+# "solar" holds data shared between the MQTT ingestor and web workers
+# (weather lookups, latest readings, today's yield, stats). Set
+# SOLAR_CACHE_URL (e.g. redis://127.0.0.1:6379/1) to use Redis; without it
+# each process gets its own LocMemCache, sized for a whole fleet, and
+# run_solar_mqtt warns at startup. SOLAR_CACHE_BACKEND / _LOCATION select
+# any other backend (e.g. .db.DatabaseCache).
+SOLAR_CACHE_URL = os.getenv("SOLAR_CACHE_URL")
+SOLAR_CACHE = {
+    "BACKEND": os.getenv("SOLAR_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+    "LOCATION": os.getenv("SOLAR_CACHE_LOCATION", "solar"),
+}
+if SOLAR_CACHE_URL:
+    SOLAR_CACHE = {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": SOLAR_CACHE_URL}
+if SOLAR_CACHE["BACKEND"].endswith("LocMemCache"):
+    SOLAR_CACHE["OPTIONS"] = {"MAX_ENTRIES": int(os.getenv("SOLAR_CACHE_MAX_ENTRIES", 100000))}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "solar": SOLAR_CACHE,
+}
+
 # ----------------------------
 # Password Validation
 # ----------------------------
@@ -282,3 +308,61 @@ SESSION_SAVE_EVERY_REQUEST = True
 WHATSAPP_API_URL = os.getenv('WHATSAPP_API_URL', 'http://127.0.0.1:4001')
 WHATSAPP_API_KEY = os.getenv('WHATSAPP_API_KEY', 'EZRUN_SECRET_2026')
 
+
+# ----------------------------
+# Solar MQTT ingest
+# ----------------------------
+SOLAR_INGEST_FLUSH_SIZE = int(os.getenv("SOLAR_INGEST_FLUSH_SIZE", 200))
+SOLAR_INGEST_FLUSH_INTERVAL = float(os.getenv("SOLAR_INGEST_FLUSH_INTERVAL", 2.0))  # seconds
+SOLAR_INGEST_MAX_BUFFER = int(os.getenv("SOLAR_INGEST_MAX_BUFFER", 10000))
+SOLAR_WEATHER_WORKERS = int(os.getenv("SOLAR_WEATHER_WORKERS", 8))
+SOLAR_WEATHER_QUEUE_SIZE = int(os.getenv("SOLAR_WEATHER_QUEUE_SIZE", 200))
+SOLAR_WEATHER_OVERFLOW = os.getenv("SOLAR_WEATHER_OVERFLOW", "failsafe")  # failsafe | drop_oldest
+SOLAR_RAIN_GRID = float(os.getenv("SOLAR_RAIN_GRID", 0.05))  # degrees
+SOLAR_RAIN_CACHE_TTL = int(os.getenv("SOLAR_RAIN_CACHE_TTL", 3600))  # seconds
+SOLAR_RAIN_BATCH_WINDOW = float(os.getenv("SOLAR_RAIN_BATCH_WINDOW", 0.3))  # seconds, 0 = no batching
+SOLAR_RAIN_BATCH_SIZE = int(os.getenv("SOLAR_RAIN_BATCH_SIZE", 100))  # locations per request
+SOLAR_WEATHER_REFRESH_INTERVAL = int(os.getenv("SOLAR_WEATHER_REFRESH_INTERVAL", 900))  # seconds, 0 = no refresher
+SOLAR_WEATHER_STALE_AFTER = int(os.getenv("SOLAR_WEATHER_STALE_AFTER", 1800))  # seconds before weather_stale
+SOLAR_WEATHER_CACHE_TTL = int(os.getenv("SOLAR_WEATHER_CACHE_TTL", 6 * 3600))  # last known value kept this long
+SOLAR_WEATHER_RAW_SAMPLE_RATE = float(os.getenv("SOLAR_WEATHER_RAW_SAMPLE_RATE", 0.01))  # share of WeatherLogs keeping raw JSON
+SOLAR_WEATHER_RAW_COMPRESS = os.getenv("SOLAR_WEATHER_RAW_COMPRESS", "True") == "True"  # zlib the kept raw JSON
+SOLAR_SPOOL_DIR = os.getenv("SOLAR_SPOOL_DIR", os.path.join(BASE_DIR, "solar_spool"))
+SOLAR_SPOOL_SEGMENT_BYTES = int(os.getenv("SOLAR_SPOOL_SEGMENT_BYTES", 8 * 1024 * 1024))
+SOLAR_INGEST_WORKERS = int(os.getenv("SOLAR_INGEST_WORKERS", 1))
+SOLAR_INGEST_PARTITION = os.getenv("SOLAR_INGEST_PARTITION", "shared")  # shared | hash
+SOLAR_INGEST_SHARE_GROUP = os.getenv("SOLAR_INGEST_SHARE_GROUP", "solar-ingest")
+SOLAR_METRICS_PORT = int(os.getenv("SOLAR_METRICS_PORT", 0))  # 0 = no /metrics endpoint
+SOLAR_METRICS_LOG_INTERVAL = int(os.getenv("SOLAR_METRICS_LOG_INTERVAL", 60))  # seconds, 0 = off
+SOLAR_INGEST_DEDUP_SIZE = int(os.getenv("SOLAR_INGEST_DEDUP_SIZE", 100000))  # recent reading keys kept
+SOLAR_LATEST_CACHE_TTL = int(os.getenv("SOLAR_LATEST_CACHE_TTL", 7 * 86400))  # seconds
+SOLAR_LATEST_FALLBACK_TTL = int(os.getenv("SOLAR_LATEST_FALLBACK_TTL", 3600))  # seconds, latest read from the DB
+SOLAR_ANOMALY_ALPHA = float(os.getenv("SOLAR_ANOMALY_ALPHA", 0.1))  # EWMA weight of each new reading
+SOLAR_ANOMALY_DROP = float(os.getenv("SOLAR_ANOMALY_DROP", 0.5))  # alert below (1 - DROP) x expected power
+SOLAR_ANOMALY_Z = float(os.getenv("SOLAR_ANOMALY_Z", 3.0))  # ... and more than Z std devs below it
+SOLAR_ANOMALY_MIN_SAMPLES = int(os.getenv("SOLAR_ANOMALY_MIN_SAMPLES", 5))  # readings per hour slot before alerting
+SOLAR_ANOMALY_MIN_POWER = float(os.getenv("SOLAR_ANOMALY_MIN_POWER", 20.0))  # W, ignore hours expected below this
+SOLAR_ANOMALY_COOLDOWN = int(os.getenv("SOLAR_ANOMALY_COOLDOWN", 6 * 3600))  # seconds between alerts of a kind
+SOLAR_ANOMALY_SILENCE = int(os.getenv("SOLAR_ANOMALY_SILENCE", 3 * 3600))  # seconds without readings, 0 = off
+SOLAR_ANOMALY_WARMUP_DAYS = int(os.getenv("SOLAR_ANOMALY_WARMUP_DAYS", 14))  # history seeding the baselines
+SOLAR_STATS_CACHE_TTL = int(os.getenv("SOLAR_STATS_CACHE_TTL", 300))  # seconds, bounds live temperature age
+SOLAR_STATS_SERIES_TTL = int(os.getenv("SOLAR_STATS_SERIES_TTL", 3600))  # closed-period series on a LocMem cache
+SOLAR_FLEET_MAX_DEVICES = int(os.getenv("SOLAR_FLEET_MAX_DEVICES", 200))  # per /stats/fleet request
+SOLAR_SERIES_MAX_POINTS = int(os.getenv("SOLAR_SERIES_MAX_POINTS", 5000))  # per /series response
+SOLAR_SERIES_MAX_DAYS = int(os.getenv("SOLAR_SERIES_MAX_DAYS", 366))  # longest /series range
+SOLAR_SOILING_WINDOW_DAYS = int(os.getenv("SOLAR_SOILING_WINDOW_DAYS", 180))  # history used for soiling estimates
+SOLAR_SOILING_RECOVERY_DAYS = int(os.getenv("SOLAR_SOILING_RECOVERY_DAYS", 3))  # days compared around each wash
+SOLAR_WASH_COST = float(os.getenv("SOLAR_WASH_COST", 10.0))  # per wash, same currency as DeviceLocation.price
+SOLAR_PEAK_SUN_HOURS = float(os.getenv("SOLAR_PEAK_SUN_HOURS", 5.0))  # kWh/m2/day, reference for performance ratio
+SOLAR_DEGRADATION_YEARS = int(os.getenv("SOLAR_DEGRADATION_YEARS", 3))  # history for the degradation trend
+SOLAR_PERFORMANCE_WORKERS = int(os.getenv("SOLAR_PERFORMANCE_WORKERS", os.cpu_count() or 1))
+SOLAR_PERFORMANCE_CHUNK_SIZE = int(os.getenv("SOLAR_PERFORMANCE_CHUNK_SIZE", 200))  # devices per worker task
+SOLAR_PARTITION_AHEAD_MONTHS = int(os.getenv("SOLAR_PARTITION_AHEAD_MONTHS", 3))  # MySQL partitions kept ready
+SOLAR_HOURLY_RETAIN_MONTHS = int(os.getenv("SOLAR_HOURLY_RETAIN_MONTHS", 0))  # 0 = keep raw readings forever
+SOLAR_RETAIN_RAW_DAYS = int(os.getenv("SOLAR_RETAIN_RAW_DAYS", 90))  # then one reading per device-hour
+SOLAR_RETAIN_HOURLY_DAYS = int(os.getenv("SOLAR_RETAIN_HOURLY_DAYS", 730))  # then rollups only
+SOLAR_RETAIN_WASH_DAYS = int(os.getenv("SOLAR_RETAIN_WASH_DAYS", 730))  # then WashCycle only
+SOLAR_RETAIN_WEATHER_DAYS = int(os.getenv("SOLAR_RETAIN_WEATHER_DAYS", 90))  # then hourly, no raw_response
+SOLAR_PURGE_WEATHER_DAYS = int(os.getenv("SOLAR_PURGE_WEATHER_DAYS", 365))  # then weather logs are deleted
+SOLAR_ARCHIVE_DIR = os.getenv("SOLAR_ARCHIVE_DIR", os.path.join(BASE_DIR, "solar_archive"))  # columnar month files
+SOLAR_COMPACT_BATCH_SIZE = int(os.getenv("SOLAR_COMPACT_BATCH_SIZE", 1000))  # rows per transaction
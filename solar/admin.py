@@ -1,6 +1,7 @@
 from django.contrib import admin
 # pyrefly: ignore [missing-import]
-from .models import SolarHourlyData, WashRecord, DeviceLocation, WeatherLog, SolarErrorLog
+from .models import SolarHourlyData, WashRecord, DeviceLocation, WeatherLog, SolarErrorLog, SolarDailyRollup, SolarMonthlyRollup, WashCycle, SoilingEstimate, PerformanceSummary
+from .services import weather_log
 
 @admin.register(SolarHourlyData)
 class SolarHourlyDataAdmin(admin.ModelAdmin):
@@ -22,10 +23,15 @@ class DeviceLocationAdmin(admin.ModelAdmin):
 
 @admin.register(WeatherLog)
 class WeatherLogAdmin(admin.ModelAdmin):
-    list_display = ('device_id', 'timestamp', 'lat', 'lon', 'temperature', 'weather_code', 'max_rain', 'skip_wash')
-    list_filter = ('device_id', 'skip_wash')
-    search_fields = ('device_id',)
-    readonly_fields = ('raw_response',)
+    list_display = ('device_id', 'kind', 'cell', 'timestamp', 'temperature', 'weather_code', 'max_rain', 'skip_wash')
+    list_filter = ('kind', 'skip_wash')
+    search_fields = ('device_id', 'cell')
+    exclude = ('raw_response', 'raw_compressed')
+    readonly_fields = ('raw_payload',)
+
+    @admin.display(description='Raw response')
+    def raw_payload(self, obj):
+        return weather_log.payload(obj)
 
 @admin.register(SolarErrorLog)
 class SolarErrorLogAdmin(admin.ModelAdmin):
@@ -37,3 +43,31 @@ class SolarErrorLogAdmin(admin.ModelAdmin):
     def short_message(self, obj):
         return obj.message[:80]
     short_message.short_description = "Message"
+
+@admin.register(SolarDailyRollup)
+class SolarDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'day', 'power_sum', 'power_count', 'power_min', 'power_max', 'last_power')
+    list_filter = ('day',)
+    search_fields = ('device_id',)
+
+@admin.register(SolarMonthlyRollup)
+class SolarMonthlyRollupAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'month', 'power_sum', 'power_count', 'power_min', 'power_max', 'last_power')
+    list_filter = ('month',)
+    search_fields = ('device_id',)
+
+@admin.register(WashCycle)
+class WashCycleAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'before_timestamp', 'after_timestamp', 'before_power', 'after_power', 'power_gain', 'gain_percent')
+    list_filter = ('device_id', 'after_timestamp')
+    search_fields = ('device_id',)
+
+@admin.register(SoilingEstimate)
+class SoilingEstimateAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'soiling_rate_percent', 'recovery_percent', 'wash_gain_percent', 'washes', 'optimal_interval_days', 'computed_at')
+    search_fields = ('device_id',)
+
+@admin.register(PerformanceSummary)
+class PerformanceSummaryAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'capacity', 'performance_ratio_30d', 'specific_yield_30d', 'yield_30d_kwh', 'degradation_percent_per_year', 'days_reported_30d', 'computed_at')
+    search_fields = ('device_id',)
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from solar.models import SolarHourlyData
+from solar.services.archive import Archive, month_start
+
+
+class Command(BaseCommand):
+    help = 'Write SolarHourlyData to the columnar per-device-month archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', action='append', dest='devices', help='Device id (repeatable, default all)')
+        parser.add_argument('--since', help='First month YYYY-MM (default: first reading)')
+        parser.add_argument('--until', help='Last month YYYY-MM (default: last finished month)')
+        parser.add_argument('--dir', default=settings.SOLAR_ARCHIVE_DIR, help='Archive directory')
+        parser.add_argument('--overwrite', action='store_true', help='Rewrite months that are already archived')
+
+    def handle(self, *args, **options):
+        archive = Archive(options['dir'])
+        devices = options['devices'] or (
+            SolarHourlyData.objects.order_by().values_list('device_id', flat=True).distinct()
+        )
+        if options['until']:
+            until = datetime.strptime(options['until'], "%Y-%m").date()
+        else:
+            # The running month is still changing
+            until = month_start(month_start(timezone.localdate()) - timedelta(days=1))
+
+        total = 0
+        for device_id in devices:
+            if options['since']:
+                since = datetime.strptime(options['since'], "%Y-%m").date()
+            else:
+                first = (
+                    SolarHourlyData.objects.filter(device_id=device_id)
+                    .order_by('timestamp').values_list('timestamp', flat=True).first()
+                )
+                if first is None:
+                    continue
+                since = month_start(timezone.localtime(first).date())
+            written = archive.write_range(device_id, since, until, overwrite=options['overwrite'])
+            rows = sum(written.values())
+            total += rows
+            if written:
+                self.stdout.write(f"{device_id}: {rows} readings in {len(written)} months")
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} readings to {archive.directory}.'))
@@ -0,0 +1,248 @@
+import json
+import queue
+import random
+import resource
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from solar.models import (
+    SolarHourlyData, WashRecord, WeatherLog, SolarAlert, SolarErrorLog, SolarDailyRollup,
+    SolarMonthlyRollup, WashCycle, SoilingEstimate, PerformanceSummary,
+)
+from solar.services import live, stats_cache
+from solar.services.ingestor import Ingestor
+from solar.services.weather import get_cache, rain_cache_key
+
+DEVICE_PREFIX = "BENCH-"
+# Every table the ingestor and its write listeners fill for a device
+BENCH_MODELS = [
+    SolarHourlyData, WashRecord, WeatherLog, SolarAlert, SolarErrorLog, SolarDailyRollup,
+    SolarMonthlyRollup, WashCycle, SoilingEstimate, PerformanceSummary,
+]
+DEFAULT_MIX = "hourly=90,before_wash=3,after_wash=3,weather=4"
+
+
+class Message:
+    """Minimal stand-in for paho's MQTTMessage."""
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeClient:
+    """Collects publishes made by the ingestor (weather responses)."""
+
+    def __init__(self):
+        self.published = 0
+        self._lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=0):
+        with self._lock:
+            self.published += 1
+
+
+class LocalBroker:
+    """
+    In-process broker stand-in: publishes go through a queue and are
+    delivered to `on_message` by a single network thread, like paho's loop.
+    """
+
+    def __init__(self, client, on_message, maxsize=10000):
+        self.client = client
+        self.on_message = on_message
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.latencies = []
+        self._thread = threading.Thread(target=self._run, name="bench-broker", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def publish(self, msg):
+        self.queue.put(msg)
+
+    def join(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            msg = self.queue.get()
+            if msg is None:
+                return
+            t0 = time.perf_counter()
+            self.on_message(self.client, None, msg)
+            self.latencies.append(time.perf_counter() - t0)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the solar MQTT ingestion handler with synthetic traffic (JSON report)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=20000, help='Messages to replay')
+        parser.add_argument('--devices', type=int, default=1000, help='Synthetic devices')
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f'Traffic mix as topic=weight pairs (default {DEFAULT_MIX})')
+        parser.add_argument('--transport', choices=('inprocess', 'broker'), default='inprocess',
+                            help='Call on_message directly or through a local broker stand-in')
+        parser.add_argument('--flush-size', type=int, default=None, help='Override SOLAR_INGEST_FLUSH_SIZE')
+        parser.add_argument('--live-weather', action='store_true',
+                            help='Let weather checks call Open-Meteo instead of pre-seeding the rain cache')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic rows afterwards')
+        parser.add_argument('--yes', action='store_true',
+                            help='Run against the configured database even when DEBUG is off')
+
+    def _traffic(self, options):
+        rnd = random.Random(options['seed'])
+        mix = []
+        for part in options['mix'].split(','):
+            kind, weight = part.split('=')
+            mix.append((kind.strip(), float(weight)))
+        kinds = [k for k, _ in mix]
+        weights = [w for _, w in mix]
+
+        devices = [
+            (f"{DEVICE_PREFIX}{i:06d}", round(rnd.uniform(8, 35), 4), round(rnd.uniform(68, 92), 4))
+            for i in range(options['devices'])
+        ]
+        for _ in range(options['messages']):
+            device_id, lat, lon = rnd.choice(devices)
+            kind = rnd.choices(kinds, weights)[0]
+            if kind == 'weather':
+                topic = f"solar/{device_id}/weather/check"
+                payload = {"lat": lat, "lon": lon, "threshold": 3}
+            else:
+                voltage = round(rnd.uniform(18.0, 38.0), 2)
+                current = round(rnd.uniform(0.5, 8.0), 2)
+                topic = f"solar/{device_id}/data/{kind}"
+                payload = {"device_id": device_id, "voltage": voltage,
+                           "current": current, "power": round(voltage * current, 2)}
+            yield Message(topic, json.dumps(payload).encode("utf-8"))
+        self.devices = devices
+
+    def _row_counts(self):
+        return {
+            "hourly": SolarHourlyData.objects.filter(device_id__startswith=DEVICE_PREFIX).count(),
+            "wash": WashRecord.objects.filter(device_id__startswith=DEVICE_PREFIX).count(),
+            "weather_log": WeatherLog.objects.filter(device_id__startswith=DEVICE_PREFIX).count(),
+        }
+
+    def _cleanup(self, seeded_rain):
+        """Delete the synthetic devices' rows and cache entries."""
+        for model in BENCH_MODELS:
+            model.objects.filter(device_id__startswith=DEVICE_PREFIX).delete()
+        today = timezone.localdate()
+        keys = []
+        for device_id, lat, lon in self.devices:
+            keys += [live.latest_key(device_id), live.today_key(device_id, today),
+                     stats_cache.version_key(device_id), stats_cache.history_key(device_id)]
+            if seeded_rain:
+                keys.append(rain_cache_key(lat, lon))
+        get_cache().delete_many(keys)
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['yes']:
+            raise CommandError(
+                f"DEBUG is off: this writes {DEVICE_PREFIX}* devices into database "
+                f"'{connection.settings_dict['NAME']}'. Point it at a test database or pass --yes."
+            )
+        messages = list(self._traffic(options))
+        weather_checks = sum(1 for m in messages if m.topic.endswith("/weather/check"))
+
+        if not options['live_weather']:
+            cache = get_cache()
+            for _, lat, lon in self.devices:
+                cache.set(rain_cache_key(lat, lon), 0.0, 3600)
+
+        # The refresher's Open-Meteo calls are not part of the ingest path
+        kwargs = {"spool": None, "weather_refresh": 0}
+        if options['flush_size']:
+            kwargs["flush_size"] = options['flush_size']
+        try:
+            report = self._run(options, messages, weather_checks, kwargs)
+        finally:
+            if not options['keep']:
+                self._cleanup(seeded_rain=not options['live_weather'])
+
+        out = json.dumps(report, indent=2, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(out + "\n")
+        self.stdout.write(out)
+
+    def _run(self, options, messages, weather_checks, kwargs):
+        ingestor = Ingestor(**kwargs).start()
+        client = FakeClient()
+        before = self._row_counts()
+
+        started = time.perf_counter()
+        if options['transport'] == 'broker':
+            broker = LocalBroker(client, ingestor.on_message).start()
+            for msg in messages:
+                broker.publish(msg)
+            broker.join()
+            latencies = broker.latencies
+        else:
+            latencies = []
+            for msg in messages:
+                t0 = time.perf_counter()
+                ingestor.on_message(client, None, msg)
+                latencies.append(time.perf_counter() - t0)
+        handled = time.perf_counter() - started
+
+        # Wait for weather replies, then flush the buffer
+        deadline = time.monotonic() + 60
+        while client.published < weather_checks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stats = ingestor.stop()
+        elapsed = time.perf_counter() - started
+
+        after = self._row_counts()
+        rows = sum(after[k] - before[k] for k in ("hourly", "wash"))
+        report = {
+            "timestamp": timezone.now().isoformat(),
+            "transport": options['transport'],
+            "database": connection.vendor,
+            "messages": len(messages),
+            "devices": options['devices'],
+            "weather_checks": weather_checks,
+            "weather_replies": client.published,
+            "elapsed_s": round(elapsed, 3),
+            "handler_s": round(handled, 3),
+            "msgs_per_s": round(len(messages) / elapsed, 1) if elapsed else 0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50) * 1000, 3),
+                "p99": round(percentile(latencies, 99) * 1000, 3),
+                "max": round(max(latencies, default=0) * 1000, 3),
+            },
+            "db_rows": rows,
+            "db_rows_per_s": round(rows / elapsed, 1) if elapsed else 0,
+            "weather_log_rows": after["weather_log"] - before["weather_log"],
+            "peak_rss_mb": peak_rss_mb(),
+            "ingestor": stats,
+        }
+        return report
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from solar.services import stats_cache
+from solar.services.archive import Archive
+from solar.services.compaction import Compactor
+
+TABLES = ("readings", "wash", "weather")
+
+
+class Command(BaseCommand):
+    help = 'Downsample and purge old SolarHourlyData, WashRecord and WeatherLog rows (safe to rerun)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--raw-days', type=int, default=settings.SOLAR_RETAIN_RAW_DAYS,
+                            help='Keep every reading this many days, then one per device-hour')
+        parser.add_argument('--hourly-days', type=int, default=settings.SOLAR_RETAIN_HOURLY_DAYS,
+                            help='Keep hourly readings this many days, then delete them')
+        parser.add_argument('--wash-days', type=int, default=settings.SOLAR_RETAIN_WASH_DAYS,
+                            help='Keep wash records this many days (WashCycle rows are kept)')
+        parser.add_argument('--weather-days', type=int, default=settings.SOLAR_RETAIN_WEATHER_DAYS,
+                            help='Keep every weather log this many days, then one per device-hour')
+        parser.add_argument('--weather-purge-days', type=int, default=settings.SOLAR_PURGE_WEATHER_DAYS,
+                            help='Delete weather logs older than this many days')
+        parser.add_argument('--batch-size', type=int, default=settings.SOLAR_COMPACT_BATCH_SIZE,
+                            help='Rows deleted or updated per transaction')
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between batches')
+        parser.add_argument('--archive', action='store_true',
+                            help='Write each month to the columnar archive before compacting it')
+        parser.add_argument('--archive-dir', default=settings.SOLAR_ARCHIVE_DIR, help='Archive directory')
+        parser.add_argument('--only', choices=TABLES, action='append', help='Limit to one table (repeatable)')
+
+    def handle(self, *args, **options):
+        if options['hourly_days'] < options['raw_days']:
+            raise CommandError('--hourly-days must not be shorter than --raw-days')
+        if options['weather_purge_days'] < options['weather_days']:
+            raise CommandError('--weather-purge-days must not be shorter than --weather-days')
+
+        compactor = Compactor(
+            raw_days=options['raw_days'],
+            hourly_days=options['hourly_days'],
+            wash_days=options['wash_days'],
+            weather_days=options['weather_days'],
+            weather_purge_days=options['weather_purge_days'],
+            batch_size=options['batch_size'],
+            pause=options['sleep'],
+            archive=Archive(options['archive_dir']) if options['archive'] else None,
+            log=self.stdout.write,
+        )
+        counts = compactor.run(tables=options['only'] or TABLES)
+        # Day views of compacted days changed
+        stats_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Compaction done: {counts}"))
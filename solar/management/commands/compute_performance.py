@@ -0,0 +1,36 @@
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from solar.services import performance
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-device performance ratio, specific yield and degradation trend (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', action='append', dest='devices', help='Device id (repeatable, default all)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day of the windows (default yesterday)')
+        parser.add_argument('--workers', type=int, default=settings.SOLAR_PERFORMANCE_WORKERS,
+                            help='Worker processes (1 = run in this process)')
+        parser.add_argument('--chunk-size', type=int, default=settings.SOLAR_PERFORMANCE_CHUNK_SIZE,
+                            help='Devices per worker task')
+        parser.add_argument('--peak-sun-hours', type=float, default=settings.SOLAR_PEAK_SUN_HOURS,
+                            help='Nominal daily insolation used as the reference yield')
+        parser.add_argument('--years', type=int, default=settings.SOLAR_DEGRADATION_YEARS,
+                            help='Years of history for the degradation trend')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        done = performance.run(
+            device_ids=options['devices'],
+            end=options['end'],
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            peak_sun_hours=options['peak_sun_hours'],
+            years=options['years'],
+            log=self.stdout.write,
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Updated {done} performance summaries in {elapsed:.2f}s.'))
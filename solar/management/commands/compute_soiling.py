@@ -0,0 +1,26 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from solar.services import soiling
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-device soiling rate, wash gain and optimal wash interval'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', action='append', dest='devices', help='Device id (repeatable, default all)')
+        parser.add_argument('--window-days', type=int, default=settings.SOLAR_SOILING_WINDOW_DAYS,
+                            help='Days of history to analyse')
+        parser.add_argument('--wash-cost', type=float, default=settings.SOLAR_WASH_COST,
+                            help='Cost of one wash, for the optimal interval')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        results = soiling.compute(
+            device_ids=options['devices'],
+            window_days=options['window_days'],
+            wash_cost=options['wash_cost'],
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Updated {len(results)} soiling estimates in {elapsed:.2f}s.'))
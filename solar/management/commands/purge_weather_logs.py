@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from solar.services.compaction import Compactor
+
+
+class Command(BaseCommand):
+    help = 'Thin out and delete old WeatherLog rows in small batches (safe to rerun)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.SOLAR_PURGE_WEATHER_DAYS,
+                            help='Delete weather logs older than this many days')
+        parser.add_argument('--collapse-days', type=int, default=settings.SOLAR_RETAIN_WEATHER_DAYS,
+                            help='Older than this, keep one row per device, kind and hour, without raw payload')
+        parser.add_argument('--batch-size', type=int, default=settings.SOLAR_COMPACT_BATCH_SIZE,
+                            help='Rows deleted or updated per transaction')
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        if options['days'] < options['collapse_days']:
+            raise CommandError('--days must not be shorter than --collapse-days')
+
+        compactor = Compactor(
+            weather_days=options['collapse_days'],
+            weather_purge_days=options['days'],
+            batch_size=options['batch_size'],
+            pause=options['sleep'],
+            log=self.stdout.write,
+        )
+        compactor.compact_weather()
+        self.stdout.write(self.style.SUCCESS(
+            f"Weather logs: {compactor.counts['weather_deleted']} deleted, "
+            f"{compactor.counts['weather_collapsed']} collapsed"))
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from solar.services import rollups, stats_cache
+
+
+class Command(BaseCommand):
+    help = 'Backfill or rebuild SolarDailyRollup / SolarMonthlyRollup from raw SolarHourlyData'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', action='append', dest='devices', help='Device id (repeatable, default all)')
+        parser.add_argument('--since', help='First local date YYYY-MM-DD (default: first reading)')
+        parser.add_argument('--until', help='Last local date YYYY-MM-DD (default: last reading)')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Days aggregated per query')
+        parser.add_argument('--include-compacted', action='store_true',
+                            help='Also rebuild days older than SOLAR_RETAIN_RAW_DAYS, whose readings '
+                                 'compact_solar_data may have averaged (their power sums would shrink)')
+
+    def handle(self, *args, **options):
+        since = datetime.strptime(options['since'], "%Y-%m-%d").date() if options['since'] else None
+        until = datetime.strptime(options['until'], "%Y-%m-%d").date() if options['until'] else None
+        if not options['include_compacted']:
+            # Rollups of collapsed days are frozen, see services/compaction.py
+            frozen_before = timezone.localdate() - timedelta(days=settings.SOLAR_RETAIN_RAW_DAYS)
+            if since is None or since < frozen_before:
+                self.stdout.write(f'Skipping days before {frozen_before} (use --include-compacted).')
+                since = frozen_before
+
+        days, months = rollups.rebuild(
+            device_ids=options['devices'],
+            start=since,
+            end=until,
+            chunk_days=options['chunk_days'],
+            log=self.stdout.write,
+        )
+        stats_cache.invalidate(options['devices'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {days} daily and {months} monthly rollups.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from solar.services import stats_cache, wash_cycles
+
+
+class Command(BaseCommand):
+    help = 'Backfill WashCycle rows by pairing stored before/after WashRecords'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', action='append', dest='devices', help='Device id (repeatable, default all)')
+
+    def handle(self, *args, **options):
+        total = wash_cycles.rebuild(device_ids=options['devices'], log=self.stdout.write)
+        stats_cache.invalidate(options['devices'], history=False)
+        self.stdout.write(self.style.SUCCESS(f'Saved {total} wash cycles.'))
@@ -0,0 +1,26 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from solar.services import current_weather
+
+
+class Command(BaseCommand):
+    help = 'Refresh the cached current weather shown by /api/solar/stats (once, or in a loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=settings.SOLAR_WEATHER_REFRESH_INTERVAL,
+                            help='Seconds before a grid cell is fetched again')
+        parser.add_argument('--loop', action='store_true', help='Keep refreshing instead of a single pass')
+        parser.add_argument('--force', action='store_true', help='Fetch every cell, fresh or not')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            started = time.monotonic()
+            refreshed = current_weather.refresh(interval=interval, force=options['force'])
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'Refreshed {refreshed} grid cells in {elapsed:.2f}s.')
+            if not options['loop']:
+                break
+            time.sleep(max(1, min(interval, 60)))
@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from solar.services.ingestor import notify_written
+from solar.services.spool import Spool
+
+
+class Command(BaseCommand):
+    help = 'Replay readings spooled to disk by run_solar_mqtt back into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spool-dir', default=settings.SOLAR_SPOOL_DIR, help='Spool directory')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per bulk insert')
+
+    def handle(self, *args, **options):
+        # run_solar_mqtt --workers N gives each worker its own worker-<i> subdirectory.
+        root = Path(options['spool_dir'])
+        dirs = [root] + sorted(p for p in root.glob('worker-*') if p.is_dir())
+        spools = [Spool(d) for d in dirs]
+        before = sum(s.pending for s in spools)
+        if not before:
+            self.stdout.write("Spool is empty.")
+            return
+
+        inserted = sum(s.replay(batch_size=options['batch_size'], on_written=notify_written) for s in spools)
+        left = sum(s.pending for s in spools)
+        if left:
+            self.stderr.write(self.style.ERROR(
+                f'Inserted {inserted} rows, {left} of {before} segments left (see log for the error).'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Inserted {inserted} rows from {before} segments.'))
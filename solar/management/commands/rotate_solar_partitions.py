@@ -0,0 +1,107 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from solar.models import SolarHourlyData
+from solar.services import partitions, stats_cache
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming monthly partitions of SolarHourlyData and drop or archive expired ones (MySQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--setup', action='store_true',
+                            help='Partition the table by month (one-off, rebuilds the table)')
+        parser.add_argument('--ahead', type=int, default=settings.SOLAR_PARTITION_AHEAD_MONTHS,
+                            help='Months of empty partitions to keep ready')
+        parser.add_argument('--retain-months', type=int, default=settings.SOLAR_HOURLY_RETAIN_MONTHS,
+                            help='Months of raw readings to keep (0 keeps everything)')
+        parser.add_argument('--archive', action='store_true',
+                            help='Move expired months into <table>_pYYYYMM tables instead of deleting them')
+        parser.add_argument('--explain', metavar='DEVICE_ID',
+                            help='Show which partitions the stats queries read for a device')
+        parser.add_argument('--dry-run', action='store_true', help='Only list what would be dropped')
+
+    def handle(self, *args, **options):
+        try:
+            partitions.check_backend()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        today = timezone.now().date()
+
+        if options['setup']:
+            try:
+                names = partitions.setup(today, ahead=options['ahead'])
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Partitioned {partitions.TABLE}: {names[0]} .. {names[-1]}"))
+
+        if options['explain']:
+            return self._explain(options['explain'])
+
+        try:
+            created = partitions.ensure_future(today, ahead=options['ahead'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        if created:
+            self.stdout.write(f"Added partitions: {', '.join(created)}")
+
+        if options['retain_months'] <= 0:
+            return
+
+        expired = partitions.expired(today, options['retain_months'])
+        if not expired:
+            self.stdout.write("No expired partitions.")
+            return
+        if options['dry_run']:
+            self.stdout.write(f"Would {'archive' if options['archive'] else 'drop'}: {', '.join(expired)}")
+            return
+
+        # Month/year views read the rollups once the raw rows are gone
+        for name in expired:
+            missing = partitions.ensure_rollups(name)
+            if missing:
+                sample = ', '.join(f"{d} {day}" for d, day in missing[:5])
+                raise CommandError(f"{name}: {len(missing)} device-days still have no rollup ({sample}); "
+                                   f"nothing dropped")
+            self.stdout.write(f"Rollups cover {name}")
+
+        if options['archive']:
+            for name in expired:
+                table = partitions.archive(name)
+                self.stdout.write(f"Archived {name} to {table}")
+        partitions.drop(expired)
+        # Rollups are kept; only day views of those months lose their data
+        stats_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Dropped partitions: {', '.join(expired)}"))
+
+    def _explain(self, device_id):
+        now = timezone.localtime()
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        month_start = day_start.replace(day=1)
+
+        queries = {
+            "day": SolarHourlyData.objects.filter(
+                device_id=device_id,
+                timestamp__range=(day_start, day_start + timedelta(days=1) - timedelta(microseconds=1)),
+            ).order_by("timestamp"),
+            "month (raw fallback)": (
+                SolarHourlyData.objects
+                .filter(device_id=device_id, timestamp__range=(month_start, now))
+                .annotate(day=TruncDay("timestamp"))
+                .values("day")
+                .annotate(daily_sum=Sum("power"))
+                .order_by("day")
+            ),
+            "latest": SolarHourlyData.objects.filter(device_id=device_id).order_by('-timestamp')[:1],
+        }
+        total = len(partitions.list_partitions())
+        for label, qs in queries.items():
+            sql, params = qs.query.sql_with_params()
+            touched = partitions.explain(sql, params)
+            self.stdout.write(f"{label}: {len(touched)}/{total} partitions ({', '.join(touched)})")
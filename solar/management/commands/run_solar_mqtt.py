@@ -1,175 +1,211 @@
-import os, json, logging, threading, requests
+import os, sys, logging, signal, subprocess, time
+import argparse
 import paho.mqtt.client as mqtt
 from django.core.management.base import BaseCommand
-from solar.models import SolarHourlyData, WashRecord, DeviceLocation, WeatherLog, SolarErrorLog
-import traceback
+from django.conf import settings
+from solar.services.ingestor import Ingestor
+from solar.services.metrics import MetricsReporter
+from solar.services.spool import Spool
+from solar.services.weather import cache_is_shared, get_cache
+from solar.services.worker_pool import OVERFLOW_POLICIES
 
 logger = logging.getLogger(__name__)
 
+PARTITION_MODES = ("shared", "hash")
+TOPICS = ("solar/+/data/#", "solar/+/weather/check")
+
+# Options forwarded from the supervisor to each worker process
+WORKER_OPTIONS = [
+    ('--flush-size', 'flush_size'),
+    ('--flush-interval', 'flush_interval'),
+    ('--max-buffer', 'max_buffer'),
+    ('--weather-workers', 'weather_workers'),
+    ('--weather-queue', 'weather_queue'),
+    ('--weather-overflow', 'weather_overflow'),
+    ('--rain-batch-window', 'rain_batch_window'),
+    ('--rain-batch-size', 'rain_batch_size'),
+    ('--workers', 'workers'),
+    ('--partition', 'partition'),
+    ('--share-group', 'share_group'),
+    ('--metrics-port', 'metrics_port'),
+    ('--metrics-interval', 'metrics_interval'),
+]
 
-def check_rain(lat, lon, threshold, device_id=None):
-    """Query Open-Meteo for precipitation. Returns True=skip wash. Fail-safe: False on error."""
-    try:
-        url = (
-            f"https://api.open-meteo.com/v1/forecast"
-            f"?latitude={lat}&longitude={lon}"
-            f"&hourly=precipitation&past_days=1&forecast_days=1"
-        )
-        r = requests.get(url, timeout=10)
-        if r.status_code != 200:
-            logger.warning(f"[Rain] API request failed with status {r.status_code}")
-            return False
-            
-        data = r.json()
-        precipitation = data.get("hourly", {}).get("precipitation", [])
-        
-        # Last 24 hrs only
-        last_24h = precipitation[:24]
-        
-        # Find max rain event
-        max_rain = max((float(v) for v in last_24h if v is not None), default=0)
-        logger.info(f"[Rain] max={max_rain}mm threshold={threshold}mm")
-        skip = max_rain >= threshold
-
-        # Save every weather/rain API response to WeatherLog
-        try:
-            WeatherLog.objects.create(
-                device_id=device_id or "unknown",
-                lat=lat,
-                lon=lon,
-                temperature=None,          # precipitation check — no temp
-                weather_code=None,         # not returned in this endpoint
-                max_rain=max_rain,
-                skip_wash=skip,
-                raw_response=data,
-            )
-        except Exception as log_err:
-            logger.warning(f"[Rain] WeatherLog save failed: {log_err}")
-
-        return skip
-    except Exception as e:
-        logger.warning(f"[Rain] API error (fail-safe wash allowed): {e}")
-        try:
-            SolarErrorLog.objects.create(
-                device_id=device_id or "unknown",
-                error_type="WEATHER_API",
-                message=str(e),
-                traceback=traceback.format_exc()
-            )
-        except:
-            pass
-        return False
+
+def subscription_topics(share_group=None):
+    """Topic filters to subscribe to; with a share group, as MQTT v5 shared subscriptions."""
+    prefix = f"$share/{share_group}/" if share_group else ""
+    return [f"{prefix}{topic}" for topic in TOPICS]
 
 
 class Command(BaseCommand):
     help = "MQTT listener: Solar data + Rain weather check"
 
+    def add_arguments(self, parser):
+        parser.add_argument('--flush-size', type=int, default=settings.SOLAR_INGEST_FLUSH_SIZE,
+                            help='Rows per bulk insert')
+        parser.add_argument('--flush-interval', type=float, default=settings.SOLAR_INGEST_FLUSH_INTERVAL,
+                            help='Max seconds a reading waits in the buffer')
+        parser.add_argument('--max-buffer', type=int, default=settings.SOLAR_INGEST_MAX_BUFFER,
+                            help='Max buffered rows before inserts block the MQTT loop')
+        parser.add_argument('--weather-workers', type=int, default=settings.SOLAR_WEATHER_WORKERS,
+                            help='Threads serving weather/check requests')
+        parser.add_argument('--weather-queue', type=int, default=settings.SOLAR_WEATHER_QUEUE_SIZE,
+                            help='Max queued weather/check requests')
+        parser.add_argument('--weather-overflow', choices=OVERFLOW_POLICIES,
+                            default=settings.SOLAR_WEATHER_OVERFLOW,
+                            help='What to do when the weather queue is full')
+        parser.add_argument('--rain-batch-window', type=float, default=settings.SOLAR_RAIN_BATCH_WINDOW,
+                            help='Seconds to collect rain checks into one request (0 disables)')
+        parser.add_argument('--rain-batch-size', type=int, default=settings.SOLAR_RAIN_BATCH_SIZE,
+                            help='Max locations per Open-Meteo request')
+        parser.add_argument('--spool-dir', default=settings.SOLAR_SPOOL_DIR,
+                            help='Directory for readings that could not be written to the DB')
+        parser.add_argument('--no-spool', action='store_true',
+                            help='Block on the DB instead of spooling to disk')
+        parser.add_argument('--workers', type=int, default=settings.SOLAR_INGEST_WORKERS,
+                            help='Number of ingest processes to run under a supervisor')
+        parser.add_argument('--partition', choices=PARTITION_MODES, default=settings.SOLAR_INGEST_PARTITION,
+                            help='shared: MQTT v5 $share subscriptions, hash: each worker keeps its own devices')
+        parser.add_argument('--share-group', default=settings.SOLAR_INGEST_SHARE_GROUP,
+                            help='Shared subscription group name')
+        parser.add_argument('--metrics-port', type=int, default=settings.SOLAR_METRICS_PORT,
+                            help='Serve Prometheus metrics on 127.0.0.1:PORT (worker i uses PORT+i, 0 disables)')
+        parser.add_argument('--metrics-interval', type=int, default=settings.SOLAR_METRICS_LOG_INTERVAL,
+                            help='Seconds between metrics summary lines (0 disables)')
+        parser.add_argument('--worker-index', type=int, default=None, help=argparse.SUPPRESS)
+
+    def _supervise(self, options):
+        """Run one child process per worker, restarting any that die."""
+        n = options['workers']
+        manage = os.path.join(settings.BASE_DIR, 'manage.py')
+        base = [sys.executable, manage, 'run_solar_mqtt']
+        for flag, key in WORKER_OPTIONS:
+            base += [flag, str(options[key])]
+        if options['no_spool']:
+            base.append('--no-spool')
+
+        stopping = False
+
+        def _stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+
+        def _spawn(i):
+            spool_dir = os.path.join(options['spool_dir'], f"worker-{i}")
+            proc = subprocess.Popen(base + ['--worker-index', str(i), '--spool-dir', spool_dir])
+            self.stdout.write(f"Started ingest worker {i} (pid {proc.pid})")
+            return {"proc": proc, "started": time.monotonic(), "backoff": 1}
+
+        children = {i: _spawn(i) for i in range(n)}
+        while not stopping:
+            time.sleep(1)
+            now = time.monotonic()
+            for i, child in list(children.items()):
+                if stopping:
+                    break
+                if child.get("restart_at"):
+                    if now >= child["restart_at"]:
+                        backoff = child["backoff"]
+                        children[i] = _spawn(i)
+                        children[i]["backoff"] = backoff
+                    continue
+                code = child["proc"].poll()
+                if code is None:
+                    continue
+                # Reset the backoff for workers that ran a while before dying
+                backoff = 1 if now - child["started"] > 60 else min(child["backoff"] * 2, 30)
+                self.stdout.write(self.style.ERROR(f"Ingest worker {i} exited rc={code}, restarting in {backoff}s"))
+                child["backoff"] = backoff
+                child["restart_at"] = now + backoff
+
+        self.stdout.write("Stopping ingest workers...")
+        for child in children.values():
+            if child["proc"].poll() is None:
+                child["proc"].send_signal(signal.SIGTERM)
+        deadline = time.monotonic() + 15
+        for child in children.values():
+            try:
+                child["proc"].wait(timeout=max(deadline - time.monotonic(), 0.1))
+            except subprocess.TimeoutExpired:
+                child["proc"].kill()
+        self.stdout.write("MQTT listener stopped.")
+
+    def _check_cache(self, workers):
+        """Warn when the "solar" cache is private to each process."""
+        if cache_is_shared():
+            return
+        msg = (f"[Cache] \"solar\" cache is {type(get_cache()).__name__}, private to each process: "
+               f"{workers} ingest worker(s) and the web workers will not share latest readings, "
+               f"today's yield or rain lookups. Set SOLAR_CACHE_URL to a Redis server.")
+        logger.warning(msg)
+        self.stdout.write(self.style.WARNING(msg))
+
     def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        worker_index = options['worker_index']
+        if worker_index is None:
+            self._check_cache(workers)
+        if workers > 1 and worker_index is None:
+            return self._supervise(options)
+
         BROKER = os.getenv("MQTT_BROKER", "mqtt.ezrun.in")
         PORT   = int(os.getenv("MQTT_PORT", 1883))
         USER   = os.getenv("MQTT_USER", "nk")
         PASS   = os.getenv("MQTT_PASS", "9898434411")
 
-        def on_connect(client, userdata, flags, rc):
+        shared = workers > 1 and options['partition'] == 'shared'
+        hashed = workers > 1 and options['partition'] == 'hash'
+        topics = subscription_topics(options['share_group'] if shared else None)
+
+        ingestor = Ingestor(
+            echo=self.stdout.write,
+            flush_size=options['flush_size'],
+            flush_interval=options['flush_interval'],
+            max_buffer=options['max_buffer'],
+            spool=None if options['no_spool'] else Spool(options['spool_dir']),
+            weather_workers=options['weather_workers'],
+            weather_queue=options['weather_queue'],
+            weather_overflow=options['weather_overflow'],
+            rain_batch_window=options['rain_batch_window'],
+            rain_batch_size=options['rain_batch_size'],
+            # A shared-subscription worker only sees part of each device's traffic
+            anomaly_silence=0 if shared else settings.SOLAR_ANOMALY_SILENCE,
+            # One refresher per box is enough; the cache is shared
+            weather_refresh=settings.SOLAR_WEATHER_REFRESH_INTERVAL if not worker_index else 0,
+            partitions=workers if hashed else 1,
+            partition_index=worker_index if hashed else None,
+        ).start()
+
+        metrics_port = options['metrics_port']
+        if metrics_port and worker_index is not None:
+            metrics_port += worker_index
+        reporter = MetricsReporter(
+            port=metrics_port,
+            interval=options['metrics_interval'],
+            echo=self.stdout.write,
+        ).start()
+
+        def on_connect(client, userdata, flags, rc, properties=None):
             if rc == 0:
                 self.stdout.write(self.style.SUCCESS("✓ MQTT Connected"))
-                client.subscribe("solar/+/data/#")
-                client.subscribe("solar/+/weather/check")
+                for topic in topics:
+                    client.subscribe(topic, qos=1)
             else:
                 self.stdout.write(self.style.ERROR(f"✗ MQTT rc={rc}"))
 
-        def weather_thread(client, device_id, payload_str):
-            def _run():
-                try:
-                    d = json.loads(payload_str)
-                    lat = float(d.get("lat", 0))
-                    lon = float(d.get("lon", 0))
-                    thr = float(d.get("threshold", 3))
-                    skip = check_rain(lat, lon, thr, device_id=device_id) if (lat or lon) else False
-                    resp = json.dumps({"skip_wash": skip})
-                    client.publish(f"solar/{device_id}/weather/response", resp, qos=1)
-                    self.stdout.write(f"{'SKIP' if skip else 'WASH'} {device_id} lat={lat} lon={lon}")
-                except Exception as e:
-                    logger.error(f"[Weather] {device_id}: {e}")
-                    try:
-                        SolarErrorLog.objects.create(
-                            device_id=device_id,
-                            error_type="WEATHER_PROCESSING",
-                            message=str(e),
-                            traceback=traceback.format_exc()
-                        )
-                    except:
-                        pass
-                    try:
-                        client.publish(f"solar/{device_id}/weather/response",
-                                       json.dumps({"skip_wash": False}), qos=1)
-                    except Exception:
-                        pass
-            threading.Thread(target=_run, daemon=True).start()
-
-        def on_message(client, userdata, msg):
-            try:
-                topic = msg.topic
-                payload = msg.payload.decode("utf-8")
-
-                if "/weather/check" in topic:
-                    parts = topic.split("/")
-                    if len(parts) >= 3:
-                        weather_thread(client, parts[1], payload)
-                    return
-
-                data = json.loads(payload)
-                device_id = data.get("device_id")
-                if not device_id:
-                    return
-                voltage = float(data.get("voltage", 0))
-                current = float(data.get("current", 0))
-                power   = float(data.get("power", 0))
-
-                if topic.endswith("/hourly"):
-                    SolarHourlyData.objects.create(
-                        device_id=device_id, voltage=voltage,
-                        current=current, power=power, energy=power)
-                    print(f"✓ Hourly {device_id} ({power}W)")
-                elif topic.endswith("/before_wash"):
-                    WashRecord.objects.create(device_id=device_id, wash_type="BEFORE",
-                        voltage=voltage, current=current, power=power)
-                elif topic.endswith("/after_wash"):
-                    WashRecord.objects.create(device_id=device_id, wash_type="AFTER",
-                        voltage=voltage, current=current, power=power)
-            except json.JSONDecodeError as e:
-                logger.error(f"Invalid JSON: {msg.payload}")
-                try:
-                    SolarErrorLog.objects.create(
-                        device_id="unknown",
-                        error_type="MQTT_JSON_PARSE",
-                        message=f"Invalid JSON: {msg.payload.decode('utf-8', errors='ignore')}",
-                        traceback=traceback.format_exc()
-                    )
-                except:
-                    pass
-            except Exception as e:
-                logger.exception(f"MQTT error: {e}")
-                try:
-                    # Attempt to extract device_id if we managed to parse the topic/json partially
-                    did = None
-                    try:
-                        did = json.loads(msg.payload.decode("utf-8")).get("device_id")
-                    except:
-                        pass
-                    SolarErrorLog.objects.create(
-                        device_id=did or "unknown",
-                        error_type="MQTT_PROCESSING",
-                        message=str(e),
-                        traceback=traceback.format_exc()
-                    )
-                except:
-                    pass
-
-        client = mqtt.Client()
+        if shared:
+            client = mqtt.Client(protocol=mqtt.MQTTv5)
+        else:
+            client = mqtt.Client()
         client.username_pw_set(USER, PASS)
         client.on_connect = on_connect
-        client.on_message = on_message
+        client.on_message = ingestor.on_message
+        # SIGTERM (supervisor or systemd) ends loop_forever and flushes below
+        signal.signal(signal.SIGTERM, lambda signum, frame: client.disconnect())
         try:
             client.connect(BROKER, PORT, 60)
             client.loop_forever()
@@ -177,3 +213,6 @@ class Command(BaseCommand):
             self.stdout.write("MQTT listener stopped.")
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"Error: {e}"))
+        finally:
+            self.stdout.write(f"Ingest stats: {ingestor.stop()}")
+            reporter.stop()
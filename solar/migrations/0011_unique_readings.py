@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-17 00:45
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicate_readings(apps, schema_editor):
+    """Keep the first row of every duplicate group so the constraints can be added."""
+    for model_name, fields in (
+        ('SolarHourlyData', ('device_id', 'timestamp')),
+        ('WashRecord', ('device_id', 'wash_type', 'timestamp')),
+    ):
+        model = apps.get_model('solar', model_name)
+        dupes = (
+            model.objects.values(*fields)
+            .annotate(n=Count('id'), keep=Min('id'))
+            .filter(n__gt=1)
+        )
+        for group in dupes.iterator():
+            keep = group.pop('keep')
+            group.pop('n')
+            model.objects.filter(**group).exclude(id=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('solar', '0010_solarerrorlog'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_readings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='solarhourlydata',
+            constraint=models.UniqueConstraint(fields=('device_id', 'timestamp'), name='solar_hourly_device_ts_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='washrecord',
+            constraint=models.UniqueConstraint(fields=('device_id', 'wash_type', 'timestamp'), name='solar_wash_device_type_ts_uniq'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.0.2 on 2026-10-17 00:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('solar', '0011_unique_readings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SolarDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(db_index=True, max_length=100)),
+                ('day', models.DateField()),
+                ('power_sum', models.FloatField(default=0)),
+                ('power_count', models.IntegerField(default=0)),
+                ('power_min', models.FloatField(blank=True, null=True)),
+                ('power_max', models.FloatField(blank=True, null=True)),
+                ('last_power', models.FloatField(blank=True, null=True)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SolarMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(db_index=True, max_length=100)),
+                ('month', models.DateField()),
+                ('power_sum', models.FloatField(default=0)),
+                ('power_count', models.IntegerField(default=0)),
+                ('power_min', models.FloatField(blank=True, null=True)),
+                ('power_max', models.FloatField(blank=True, null=True)),
+                ('last_power', models.FloatField(blank=True, null=True)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='solardailyrollup',
+            constraint=models.UniqueConstraint(fields=('device_id', 'day'), name='solar_daily_rollup_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='solarmonthlyrollup',
+            constraint=models.UniqueConstraint(fields=('device_id', 'month'), name='solar_monthly_rollup_uniq'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.2 on 2026-10-17 00:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('solar', '0012_solardailyrollup_solarmonthlyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WashCycle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(db_index=True, max_length=100)),
+                ('before_timestamp', models.DateTimeField()),
+                ('before_voltage', models.FloatField()),
+                ('before_current', models.FloatField()),
+                ('before_power', models.FloatField()),
+                ('after_timestamp', models.DateTimeField()),
+                ('after_voltage', models.FloatField()),
+                ('after_current', models.FloatField()),
+                ('after_power', models.FloatField()),
+                ('power_gain', models.FloatField()),
+                ('gain_percent', models.FloatField(blank=True, null=True)),
+                ('duration_seconds', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-after_timestamp'],
+                'indexes': [models.Index(fields=['device_id', '-after_timestamp'], name='solar_washc_device__f09aa3_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='washcycle',
+            constraint=models.UniqueConstraint(fields=('device_id', 'after_timestamp'), name='solar_wash_cycle_uniq'),
+        ),
+    ]
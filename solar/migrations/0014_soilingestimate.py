@@ -0,0 +1,33 @@
+# Generated by Django 5.0.2 on 2026-10-17 00:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('solar', '0013_washcycle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SoilingEstimate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100, unique=True)),
+                ('window_start', models.DateField()),
+                ('window_end', models.DateField()),
+                ('days_analyzed', models.IntegerField(default=0)),
+                ('washes', models.IntegerField(default=0)),
+                ('wash_gain_percent', models.FloatField(blank=True, null=True)),
+                ('recovery_percent', models.FloatField(blank=True, null=True)),
+                ('soiling_rate_percent', models.FloatField(blank=True, null=True)),
+                ('daily_yield_kwh', models.FloatField(blank=True, null=True)),
+                ('optimal_interval_days', models.FloatField(blank=True, null=True)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['device_id'],
+            },
+        ),
+    ]
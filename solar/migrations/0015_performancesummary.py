@@ -0,0 +1,38 @@
+# Generated by Django 5.0.2 on 2026-10-17 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('solar', '0014_soilingestimate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerformanceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100, unique=True)),
+                ('window_end', models.DateField()),
+                ('capacity', models.FloatField()),
+                ('days_reported_30d', models.IntegerField(default=0)),
+                ('yield_7d_kwh', models.FloatField(blank=True, null=True)),
+                ('yield_30d_kwh', models.FloatField(blank=True, null=True)),
+                ('yield_365d_kwh', models.FloatField(blank=True, null=True)),
+                ('specific_yield_7d', models.FloatField(blank=True, null=True)),
+                ('specific_yield_30d', models.FloatField(blank=True, null=True)),
+                ('specific_yield_365d', models.FloatField(blank=True, null=True)),
+                ('performance_ratio_7d', models.FloatField(blank=True, null=True)),
+                ('performance_ratio_30d', models.FloatField(blank=True, null=True)),
+                ('performance_ratio_365d', models.FloatField(blank=True, null=True)),
+                ('degradation_percent_per_year', models.FloatField(blank=True, null=True)),
+                ('degradation_months', models.IntegerField(default=0)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['device_id'],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.2 on 2026-10-17 01:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('solar', '0015_performancesummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weatherlog',
+            name='cell',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherlog',
+            name='hour',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherlog',
+            name='kind',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='weatherlog',
+            name='raw_compressed',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='weatherlog',
+            constraint=models.UniqueConstraint(fields=('kind', 'cell', 'hour'), name='solar_weather_log_cell_hour_uniq'),
+        ),
+    ]
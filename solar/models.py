@@ -14,6 +14,9 @@ class SolarHourlyData(models.Model):
         indexes = [
             models.Index(fields=['-timestamp', 'device_id']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['device_id', 'timestamp'], name='solar_hourly_device_ts_uniq'),
+        ]
         ordering = ['-timestamp']
 
     def __str__(self):
@@ -31,6 +34,9 @@ class WashRecord(models.Model):
     
     class Meta:
         ordering = ['-timestamp']
+        constraints = [
+            models.UniqueConstraint(fields=['device_id', 'wash_type', 'timestamp'], name='solar_wash_device_type_ts_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.device_id} - {self.wash_type} - {self.timestamp}"
@@ -96,13 +102,22 @@ class WeatherLog(models.Model):
     weather_code = models.IntegerField(null=True, blank=True)
     max_rain = models.FloatField(null=True, blank=True)
     skip_wash = models.BooleanField(null=True, blank=True)
-    raw_response = models.JSONField(null=True, blank=True)
+    raw_response = models.JSONField(null=True, blank=True)  # sampled, see services/weather_log.py
+    raw_compressed = models.BinaryField(null=True, blank=True)  # zlib JSON, when compression is on
+
+    # One row per lookup kind, grid cell and local hour (empty on older rows)
+    kind = models.CharField(max_length=20, blank=True, default='')  # rain | current | rain_failed | current_failed
+    cell = models.CharField(max_length=32, null=True, blank=True)
+    hour = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-timestamp']
         indexes = [
             models.Index(fields=['-timestamp', 'device_id']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'cell', 'hour'], name='solar_weather_log_cell_hour_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.device_id} - {self.temperature}°C - {self.timestamp}"
@@ -122,3 +137,124 @@ class SolarErrorLog(models.Model):
 
     def __str__(self):
         return f"[{self.error_type}] {self.device_id} - {self.timestamp}"
+
+class SolarDailyRollup(models.Model):
+    """Per-device totals for one local (TIME_ZONE) day, kept up to date by the MQTT ingestor."""
+    device_id = models.CharField(max_length=100, db_index=True)
+    day = models.DateField()
+    power_sum = models.FloatField(default=0)
+    power_count = models.IntegerField(default=0)
+    power_min = models.FloatField(null=True, blank=True)
+    power_max = models.FloatField(null=True, blank=True)
+    last_power = models.FloatField(null=True, blank=True)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['device_id', 'day'], name='solar_daily_rollup_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} - {self.day} ({self.power_sum})"
+
+class SolarMonthlyRollup(models.Model):
+    """Per-device totals for one local month (`month` is the first day), built from daily rollups."""
+    device_id = models.CharField(max_length=100, db_index=True)
+    month = models.DateField()
+    power_sum = models.FloatField(default=0)
+    power_count = models.IntegerField(default=0)
+    power_min = models.FloatField(null=True, blank=True)
+    power_max = models.FloatField(null=True, blank=True)
+    last_power = models.FloatField(null=True, blank=True)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-month']
+        constraints = [
+            models.UniqueConstraint(fields=['device_id', 'month'], name='solar_monthly_rollup_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} - {self.month:%Y-%m} ({self.power_sum})"
+
+class WashCycle(models.Model):
+    """A before_wash / after_wash pair, built by the MQTT ingestor when the after reading lands."""
+    device_id = models.CharField(max_length=100, db_index=True)
+
+    before_timestamp = models.DateTimeField()
+    before_voltage = models.FloatField()
+    before_current = models.FloatField()
+    before_power = models.FloatField()
+
+    after_timestamp = models.DateTimeField()
+    after_voltage = models.FloatField()
+    after_current = models.FloatField()
+    after_power = models.FloatField()
+
+    power_gain = models.FloatField()  # after - before, in W
+    gain_percent = models.FloatField(null=True, blank=True)
+    duration_seconds = models.FloatField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-after_timestamp']
+        indexes = [
+            models.Index(fields=['device_id', '-after_timestamp']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['device_id', 'after_timestamp'], name='solar_wash_cycle_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} - {self.after_timestamp} ({self.power_gain:+.1f}W)"
+
+class SoilingEstimate(models.Model):
+    """Per-device soiling and wash efficacy figures, recomputed by compute_soiling."""
+    device_id = models.CharField(max_length=100, unique=True)
+    window_start = models.DateField()
+    window_end = models.DateField()
+    days_analyzed = models.IntegerField(default=0)
+    washes = models.IntegerField(default=0)
+
+    wash_gain_percent = models.FloatField(null=True, blank=True)  # mean instant after/before gain
+    recovery_percent = models.FloatField(null=True, blank=True)  # mean daily-peak change around washes
+    soiling_rate_percent = models.FloatField(null=True, blank=True)  # daily-peak loss per day between washes
+    daily_yield_kwh = models.FloatField(null=True, blank=True)
+    optimal_interval_days = models.FloatField(null=True, blank=True)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['device_id']
+
+    def __str__(self):
+        return f"{self.device_id} - {self.soiling_rate_percent}%/day"
+
+class PerformanceSummary(models.Model):
+    """Per-device yield, performance ratio and degradation, recomputed nightly by compute_performance."""
+    device_id = models.CharField(max_length=100, unique=True)
+    window_end = models.DateField()  # last full local day included
+    capacity = models.FloatField()  # kWp used for the ratios
+    days_reported_30d = models.IntegerField(default=0)
+
+    yield_7d_kwh = models.FloatField(null=True, blank=True)
+    yield_30d_kwh = models.FloatField(null=True, blank=True)
+    yield_365d_kwh = models.FloatField(null=True, blank=True)
+    specific_yield_7d = models.FloatField(null=True, blank=True)  # kWh per kWp per day
+    specific_yield_30d = models.FloatField(null=True, blank=True)
+    specific_yield_365d = models.FloatField(null=True, blank=True)
+    performance_ratio_7d = models.FloatField(null=True, blank=True)  # specific yield / peak sun hours
+    performance_ratio_30d = models.FloatField(null=True, blank=True)
+    performance_ratio_365d = models.FloatField(null=True, blank=True)
+
+    degradation_percent_per_year = models.FloatField(null=True, blank=True)  # year-over-year, negative = losing output
+    degradation_months = models.IntegerField(default=0)  # month pairs behind the trend
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['device_id']
+
+    def __str__(self):
+        return f"{self.device_id} - PR {self.performance_ratio_30d}"
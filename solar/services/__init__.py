@@ -0,0 +1 @@
+# Solar Services
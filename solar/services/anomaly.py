@@ -0,0 +1,205 @@
+"""
+Streaming anomaly detection for solar readings
+==============================================
+
+The ingestor passes every hourly reading to `AnomalyDetector.observe()`.
+For each device it keeps, per local hour of day, an exponentially weighted
+mean and variance of power (24 slots, so memory per device is fixed).
+Once an hour slot has `min_samples` readings and an expected output of at
+least `min_power` W (so nights are ignored), a reading below both
+`expected * (1 - drop)` and `expected - z * std` raises a "Low output"
+alert.
+
+A background thread checks every `check_interval` seconds for devices
+that have been silent for `silence` seconds and raises "Device offline".
+The next reading from that device raises "Device back online". Only
+devices seen since this process started are watched, so a restart does
+not flag devices that died long ago.
+
+Alerts of the same kind for a device are suppressed for `cooldown`
+seconds. They are handed to `emit` (the ingestor's write buffer) as
+unsaved SolarAlert rows, so nothing on the hot path touches the database.
+`warm_up()` seeds the hour slots with one grouped query over recent
+readings at startup, so alerts work straight away instead of after
+`min_samples` days.
+
+With shared subscriptions every worker sees a random share of each
+device's readings. The averages still hold, but silence checks would
+misfire, so the command disables them in that mode.
+"""
+
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Avg, Count, F
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+
+from solar.models import SolarAlert, SolarHourlyData
+from solar.services import metrics
+
+logger = logging.getLogger(__name__)
+
+ALPHA = getattr(settings, 'SOLAR_ANOMALY_ALPHA', 0.1)
+DROP = getattr(settings, 'SOLAR_ANOMALY_DROP', 0.5)
+Z = getattr(settings, 'SOLAR_ANOMALY_Z', 3.0)
+MIN_SAMPLES = getattr(settings, 'SOLAR_ANOMALY_MIN_SAMPLES', 5)
+MIN_POWER = getattr(settings, 'SOLAR_ANOMALY_MIN_POWER', 20.0)  # W
+COOLDOWN = getattr(settings, 'SOLAR_ANOMALY_COOLDOWN', 6 * 3600)  # seconds
+SILENCE = getattr(settings, 'SOLAR_ANOMALY_SILENCE', 3 * 3600)  # seconds, 0 = off
+WARMUP_DAYS = getattr(settings, 'SOLAR_ANOMALY_WARMUP_DAYS', 14)
+
+
+class DeviceState:
+    __slots__ = ("mean", "var", "count", "last_seen", "offline", "alerted")
+
+    def __init__(self):
+        self.mean = [0.0] * 24
+        self.var = [0.0] * 24
+        self.count = [0] * 24
+        self.last_seen = None     # monotonic time of the last reading
+        self.offline = False
+        self.alerted = {}         # alert kind -> monotonic time
+
+
+class AnomalyDetector:
+    def __init__(self, emit, alpha=ALPHA, drop=DROP, z=Z, min_samples=MIN_SAMPLES,
+                 min_power=MIN_POWER, cooldown=COOLDOWN, silence=SILENCE, check_interval=60):
+        self.emit = emit
+        self.alpha = float(alpha)
+        self.drop = float(drop)
+        self.z = float(z)
+        self.min_samples = int(min_samples)
+        self.min_power = float(min_power)
+        self.cooldown = float(cooldown)
+        self.silence = float(silence)
+        self.check_interval = check_interval
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.silence > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="solar-anomaly", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "devices": len(self._devices),
+                "offline": sum(1 for s in self._devices.values() if s.offline),
+            }
+
+    def warm_up(self, days=WARMUP_DAYS, owns=None):
+        """Seed hour-of-day means/variances from the last `days` of readings."""
+        if days <= 0:
+            return 0
+        since = timezone.now() - timedelta(days=days)
+        rows = (
+            SolarHourlyData.objects
+            .filter(timestamp__gte=since)
+            .annotate(hour=ExtractHour("timestamp"))
+            .values("device_id", "hour")
+            .annotate(n=Count("id"), mean=Avg("power"), sq=Avg(F("power") * F("power")))
+        )
+        seeded = 0
+        with self._lock:
+            for row in rows:
+                if owns is not None and not owns(row["device_id"]):
+                    continue
+                state = self._devices.setdefault(row["device_id"], DeviceState())
+                h = row["hour"]
+                state.mean[h] = row["mean"]
+                state.var[h] = max(row["sq"] - row["mean"] ** 2, 0.0)
+                state.count[h] = row["n"]
+                seeded += 1
+        return seeded
+
+    def observe(self, reading):
+        """Update the device's statistics with a reading; may emit alerts."""
+        now = time.monotonic()
+        ts = timezone.localtime(reading.timestamp)
+        h = ts.hour
+        power = reading.power
+        alerts = []
+        with self._lock:
+            state = self._devices.get(reading.device_id)
+            if state is None:
+                state = self._devices[reading.device_id] = DeviceState()
+            state.last_seen = now
+            if state.offline:
+                state.offline = False
+                alerts.append(("online", "Device back online",
+                               f"{reading.device_id} is reporting again.", "success"))
+
+            mean, n = state.mean[h], state.count[h]
+            if n >= self.min_samples and mean >= self.min_power:
+                std = math.sqrt(state.var[h])
+                if power < mean * (1 - self.drop) and power < mean - self.z * std:
+                    if self._cooldown_over(state, "low_output", now):
+                        alerts.append(("low_output", "Low output",
+                                       f"{reading.device_id} produced {power:.0f} W at {ts:%H:%M}, "
+                                       f"expected about {mean:.0f} W.", "warning"))
+
+            # EWMA mean/variance for this hour of day
+            if n == 0:
+                state.mean[h], state.var[h] = float(power), 0.0
+            else:
+                diff = power - mean
+                incr = self.alpha * diff
+                state.mean[h] = mean + incr
+                state.var[h] = (1 - self.alpha) * (state.var[h] + diff * incr)
+            state.count[h] = n + 1
+
+        for kind, title, message, alert_type in alerts:
+            self._emit(reading.device_id, kind, title, message, alert_type)
+
+    def check_silence(self):
+        """Flag devices that stopped reporting. Called by the watch thread."""
+        now = time.monotonic()
+        silent = []
+        with self._lock:
+            for device_id, state in self._devices.items():
+                if state.offline or state.last_seen is None:
+                    continue
+                if now - state.last_seen >= self.silence and self._cooldown_over(state, "offline", now):
+                    state.offline = True
+                    silent.append((device_id, now - state.last_seen))
+        for device_id, seconds in silent:
+            self._emit(device_id, "offline", "Device offline",
+                       f"No readings from {device_id} for {seconds / 3600:.1f} hours.", "error")
+        return len(silent)
+
+    def _cooldown_over(self, state, kind, now):
+        last = state.alerted.get(kind)
+        if last is not None and now - last < self.cooldown:
+            return False
+        state.alerted[kind] = now
+        return True
+
+    def _emit(self, device_id, kind, title, message, alert_type):
+        metrics.ALERTS.inc(kind=kind)
+        logger.info(f"[Anomaly] {device_id}: {title}")
+        try:
+            self.emit(SolarAlert(device_id=device_id, title=title, message=message, alert_type=alert_type))
+        except Exception as e:
+            logger.error(f"[Anomaly] {device_id}: alert not queued: {e}")
+
+    def _watch(self):
+        while not self._stopped.wait(self.check_interval):
+            try:
+                self.check_silence()
+            except Exception as e:
+                logger.error(f"[Anomaly] silence check failed: {e}")
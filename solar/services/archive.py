@@ -0,0 +1,213 @@
+"""
+Columnar archive of solar readings
+==================================
+
+Long-range analytics and exports should not instantiate millions of
+SolarHourlyData objects. Readings are archived per device and local month
+as one binary file of fixed-width columns, laid out back to back:
+
+    timestamp  int64    epoch seconds (UTC), sorted
+    voltage    float64
+    current    float64
+    power      float64
+    energy     float64
+
+so column `i` of an `n` row file starts at byte `offset(i) = sum of the
+widths of the previous columns * n`. A per-device `index.json` records the
+row count and first/last timestamp of each month:
+
+    <SOLAR_ARCHIVE_DIR>/<device_id>/2025-01.bin
+    <SOLAR_ARCHIVE_DIR>/<device_id>/index.json
+
+`open_month()` memory-maps a file and returns NumPy views of each column,
+so nothing is copied or parsed until the data is touched. `load()` joins
+a range of months (this copies, once).
+
+Files are written to a temporary name and renamed, and index.json is
+replaced atomically, so readers never see a partial month. A month that is
+already archived is left alone unless `overwrite` is set. This matters to
+compaction, which archives a month before its first row is collapsed or
+deleted and must not re-archive a month it has already thinned out.
+"""
+
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from solar.models import SolarHourlyData
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = getattr(settings, 'SOLAR_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, "solar_archive"))
+
+COLUMNS = [
+    ("timestamp", np.dtype("<i8")),
+    ("voltage", np.dtype("<f8")),
+    ("current", np.dtype("<f8")),
+    ("power", np.dtype("<f8")),
+    ("energy", np.dtype("<f8")),
+]
+ROW_BYTES = sum(dtype.itemsize for _, dtype in COLUMNS)
+FORMAT_VERSION = 1
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(month):
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def month_bounds(month):
+    """Aware local datetimes [first day 00:00, next month 00:00)."""
+    start = timezone.make_aware(datetime.combine(month, datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(next_month(month), datetime.min.time()))
+    return start, end
+
+
+def month_label(month):
+    return f"{month:%Y-%m}"
+
+
+class Archive:
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+
+    # ----- layout -----
+
+    def device_dir(self, device_id):
+        # Device ids are MQTT topic segments; keep them from escaping the directory
+        safe = device_id.replace(os.sep, "_").replace("..", "_")
+        return os.path.join(self.directory, safe)
+
+    def month_path(self, device_id, month):
+        return os.path.join(self.device_dir(device_id), f"{month_label(month)}.bin")
+
+    def index(self, device_id):
+        path = os.path.join(self.device_dir(device_id), "index.json")
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"version": FORMAT_VERSION, "months": {}}
+
+    def _save_index(self, device_id, index):
+        path = os.path.join(self.device_dir(device_id), "index.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+    def months(self, device_id):
+        """Archived months of a device, oldest first."""
+        return [date.fromisoformat(f"{label}-01") for label in sorted(self.index(device_id)["months"])]
+
+    def has_month(self, device_id, month):
+        return month_label(month) in self.index(device_id)["months"]
+
+    # ----- writing -----
+
+    def write_month(self, device_id, month, overwrite=False):
+        """Archive one device-month from SolarHourlyData. Returns rows written, None if skipped."""
+        month = month_start(month)
+        index = self.index(device_id)
+        label = month_label(month)
+        if label in index["months"] and not overwrite:
+            return None
+
+        start, end = month_bounds(month)
+        rows = list(
+            SolarHourlyData.objects
+            .filter(device_id=device_id, timestamp__gte=start, timestamp__lt=end)
+            .order_by("timestamp")
+            .values_list("timestamp", "voltage", "current", "power", "energy")
+        )
+        n = len(rows)
+        if not n:
+            return 0
+
+        columns = [
+            np.fromiter((int(r[0].timestamp()) for r in rows), dtype=COLUMNS[0][1], count=n),
+        ] + [
+            np.fromiter((r[i] for r in rows), dtype=dtype, count=n)
+            for i, (_, dtype) in enumerate(COLUMNS[1:], start=1)
+        ]
+
+        os.makedirs(self.device_dir(device_id), exist_ok=True)
+        path = self.month_path(device_id, month)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            for column in columns:
+                f.write(column.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+        index["months"][label] = {
+            "rows": n,
+            "first": int(columns[0][0]),
+            "last": int(columns[0][-1]),
+            "bytes": n * ROW_BYTES,
+        }
+        self._save_index(device_id, index)
+        return n
+
+    def write_range(self, device_id, first_month, last_month, overwrite=False):
+        written = {}
+        month = month_start(first_month)
+        while month <= last_month:
+            n = self.write_month(device_id, month, overwrite=overwrite)
+            if n:
+                written[month_label(month)] = n
+            month = next_month(month)
+        return written
+
+    # ----- reading -----
+
+    def open_month(self, device_id, month):
+        """
+        Memory-mapped columns of an archived month as a dict of NumPy
+        arrays (read-only views, no copy), or None if it is not archived.
+        """
+        meta = self.index(device_id)["months"].get(month_label(month))
+        if not meta:
+            return None
+        n = meta["rows"]
+        buf = np.memmap(self.month_path(device_id, month), dtype=np.uint8, mode="r", shape=(n * ROW_BYTES,))
+        out = {}
+        offset = 0
+        for name, dtype in COLUMNS:
+            out[name] = buf[offset:offset + n * dtype.itemsize].view(dtype)
+            offset += n * dtype.itemsize
+        return out
+
+    def load(self, device_id, start=None, end=None):
+        """
+        Columns for readings in [start, end) (aware datetimes, optional)
+        across archived months, concatenated into regular arrays.
+        """
+        lo = int(start.timestamp()) if start else None
+        hi = int(end.timestamp()) if end else None
+        parts = []
+        for label, meta in sorted(self.index(device_id)["months"].items()):
+            if (lo is not None and meta["last"] < lo) or (hi is not None and meta["first"] >= hi):
+                continue
+            cols = self.open_month(device_id, date.fromisoformat(f"{label}-01"))
+            ts = cols["timestamp"]
+            i = np.searchsorted(ts, lo, side="left") if lo is not None else 0
+            j = np.searchsorted(ts, hi, side="left") if hi is not None else len(ts)
+            parts.append({name: col[i:j] for name, col in cols.items()})
+        if not parts:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+        return {name: np.concatenate([p[name] for p in parts]) for name, _ in COLUMNS}
+
+
+def to_datetimes(epoch_seconds):
+    """Epoch-second column -> datetime64[s] (UTC)."""
+    return np.asarray(epoch_seconds).astype("datetime64[s]")
@@ -0,0 +1,315 @@
+"""
+Retention and downsampling of old solar data
+============================================
+
+Old readings are only looked at as daily/monthly totals, so they are
+compacted in tiers (all ages in days, by local date):
+
+* SolarHourlyData older than `raw_days` is collapsed to one row per device
+  and local hour (averaged voltage/current/power, summed energy, stamped
+  at the start of the hour). Older than `hourly_days` it is deleted; the
+  daily/monthly rollups stay.
+* WashRecord older than `wash_days` is paired into WashCycle rows (the
+  same pairing the ingestor does) and then deleted. Records are walked per
+  device in time order, carrying each device's last record from one batch
+  to the next, and a BEFORE left last is paired with the AFTER that
+  follows it past the cutoff.
+* WeatherLog older than `weather_days` keeps only the newest row per
+  device, lookup kind and hour, without its raw payload. Older than
+  `weather_purge_days` it is deleted (purge_weather_logs runs just this
+  tier).
+
+Before a day of readings is collapsed or deleted, rollups are built for
+any (device, day) that has none yet, so totals never depend on rows that
+are about to go. Existing rollups are trusted and not recomputed, which
+keeps a run that stopped halfway through a day safe to resume.
+
+Rollups of collapsed days are frozen from then on: power_sum is a sum of
+readings, and an averaged hour no longer adds up to it (summed energy
+does). rebuild_solar_rollups therefore skips days older than
+SOLAR_RETAIN_RAW_DAYS unless given --include-compacted.
+
+With an `archive` (see services/archive.py) each local month of readings
+is written to the columnar archive before its first row is collapsed or
+deleted, and only finished months are compacted so an archived month is
+complete.
+
+Work is done one day at a time in batches of `batch_size` rows, each in its
+own short transaction, with `pause` seconds between batches so the
+ingestor's inserts are not held up. Every step is idempotent. The last
+collapsed day per table is kept in the "solar" cache so a rerun skips
+ahead; losing it only costs a rescan.
+"""
+
+import logging
+import time
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from solar.models import SolarHourlyData, SolarDailyRollup, WashRecord, WeatherLog
+from solar.services import rollups, wash_cycles
+from solar.services.archive import month_bounds, month_start
+from solar.services.rollups import day_bounds, local_day
+from solar.services.weather import get_cache
+
+logger = logging.getLogger(__name__)
+
+CURSOR_KEY = "solar:compact:{}"
+
+
+class Compactor:
+    def __init__(self, raw_days=90, hourly_days=730, wash_days=730, weather_days=90,
+                 weather_purge_days=365, batch_size=1000, pause=0.1, archive=None, log=None):
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        self.wash_days = wash_days
+        self.weather_days = weather_days
+        self.weather_purge_days = weather_purge_days
+        self.batch_size = max(1, batch_size)
+        self.pause = pause
+        self.archive = archive
+        self._archived = set()
+        self.log = log or logger.info
+        self.today = timezone.localdate()
+        self.counts = {
+            "readings_collapsed": 0,
+            "readings_deleted": 0,
+            "wash_deleted": 0,
+            "weather_collapsed": 0,
+            "weather_deleted": 0,
+        }
+
+    def cutoff(self, days):
+        """Local day before which the tier applies."""
+        return self.today - timedelta(days=days)
+
+    # ----- helpers -----
+
+    def _sleep(self):
+        if self.pause:
+            time.sleep(self.pause)
+
+    def _delete_in_batches(self, qs):
+        deleted = 0
+        while True:
+            ids = list(qs.order_by("pk").values_list("pk", flat=True)[:self.batch_size])
+            if not ids:
+                return deleted
+            deleted += qs.model.objects.filter(pk__in=ids).delete()[0]
+            self._sleep()
+
+    def _days(self, model, name, end):
+        """Local days from the first stored row (or the saved cursor) up to `end`."""
+        first = model.objects.order_by("timestamp").values_list("timestamp", flat=True).first()
+        if first is None:
+            return
+        day = local_day(first)
+        cursor = self._load_cursor(name)
+        if cursor and cursor > day:
+            day = cursor
+        while day < end:
+            yield day
+            day += timedelta(days=1)
+
+    def _load_cursor(self, name):
+        try:
+            value = get_cache().get(CURSOR_KEY.format(name))
+        except Exception:
+            return None
+        return date.fromisoformat(value) if value else None
+
+    def _save_cursor(self, name, day):
+        try:
+            get_cache().set(CURSOR_KEY.format(name), day.isoformat(), None)
+        except Exception as e:
+            logger.warning(f"[Compact] cursor save failed: {e}")
+
+    def ensure_rollups(self, day):
+        """Build missing daily rollups for `day` while its raw rows are intact."""
+        start, end = day_bounds(day)
+        devices = set(
+            SolarHourlyData.objects.filter(timestamp__gte=start, timestamp__lt=end)
+            .order_by().values_list("device_id", flat=True).distinct()
+        )
+        done = set(
+            SolarDailyRollup.objects.filter(day=day, device_id__in=devices)
+            .values_list("device_id", flat=True)
+        )
+        missing = {(device_id, day) for device_id in devices - done}
+        if missing:
+            rollups.refresh_days(missing)
+
+    def archive_month(self, day):
+        """
+        Archive the month containing `day` for every device before any of
+        its rows change. False if the month is not over yet.
+        """
+        if self.archive is None:
+            return True
+        month = month_start(day)
+        if month in self._archived:
+            return True
+        if month >= month_start(self.today):
+            return False
+        start, end = month_bounds(month)
+        devices = (
+            SolarHourlyData.objects.filter(timestamp__gte=start, timestamp__lt=end)
+            .order_by().values_list("device_id", flat=True).distinct()
+        )
+        written = 0
+        for device_id in devices:
+            written += self.archive.write_month(device_id, month) or 0
+        if written:
+            self.log(f"archived {month:%Y-%m}: {written} readings")
+        self._archived.add(month)
+        return True
+
+    # ----- readings -----
+
+    def compact_readings(self):
+        delete_before = self.cutoff(self.hourly_days)
+        while True:
+            first = SolarHourlyData.objects.order_by("timestamp").values_list("timestamp", flat=True).first()
+            if first is None or local_day(first) >= delete_before:
+                break
+            day = local_day(first)
+            if not self.archive_month(day):
+                break
+            self.ensure_rollups(day)
+            start, end = day_bounds(day)
+            n = self._delete_in_batches(
+                SolarHourlyData.objects.filter(timestamp__gte=start, timestamp__lt=end))
+            self.counts["readings_deleted"] += n
+            self.log(f"readings {day}: deleted {n}")
+
+        for day in self._days(SolarHourlyData, "readings", self.cutoff(self.raw_days)):
+            if not self.archive_month(day):
+                break
+            self.ensure_rollups(day)
+            n = self._collapse_readings(day)
+            self.counts["readings_collapsed"] += n
+            if n:
+                self.log(f"readings {day}: collapsed {n} rows")
+            self._save_cursor("readings", day)
+
+    def _collapse_readings(self, day):
+        start, end = day_bounds(day)
+        groups = list(
+            SolarHourlyData.objects
+            .filter(timestamp__gte=start, timestamp__lt=end)
+            .annotate(hour=TruncHour("timestamp"))
+            .values("device_id", "hour")
+            .annotate(
+                n=Count("id"),
+                avg_voltage=Avg("voltage"),
+                avg_current=Avg("current"),
+                avg_power=Avg("power"),
+                sum_energy=Sum("energy"),
+            )
+            .filter(n__gt=1)
+            .order_by("device_id", "hour")
+        )
+        removed = 0
+        step = max(1, self.batch_size // 24)
+        for i in range(0, len(groups), step):
+            chunk = groups[i:i + step]
+            with transaction.atomic():
+                for g in chunk:
+                    removed += SolarHourlyData.objects.filter(
+                        device_id=g["device_id"],
+                        timestamp__gte=g["hour"],
+                        timestamp__lt=g["hour"] + timedelta(hours=1),
+                    ).delete()[0] - 1
+                SolarHourlyData.objects.bulk_create([
+                    SolarHourlyData(
+                        device_id=g["device_id"],
+                        timestamp=g["hour"],
+                        voltage=g["avg_voltage"],
+                        current=g["avg_current"],
+                        power=g["avg_power"],
+                        energy=g["sum_energy"],
+                    )
+                    for g in chunk
+                ])
+            self._sleep()
+        return removed
+
+    # ----- wash records -----
+
+    def compact_wash(self):
+        start, _end = day_bounds(self.cutoff(self.wash_days))
+        qs = WashRecord.objects.filter(timestamp__lt=start)
+        last = {}  # device_id -> its newest record deleted so far
+        while True:
+            chunk = list(qs.order_by("device_id", "timestamp")[:self.batch_size])
+            if not chunk:
+                break
+            # Pair before the BEFORE halves disappear; a pair may span two chunks
+            cycles = []
+            for record in chunk:
+                prev = last.get(record.device_id)
+                if record.wash_type == "AFTER" and prev is not None and prev.wash_type == "BEFORE":
+                    cycles.append(wash_cycles.build_cycle(prev, record))
+                last[record.device_id] = record
+            wash_cycles.save_cycles(cycles)
+            n = WashRecord.objects.filter(pk__in=[r.pk for r in chunk]).delete()[0]
+            self.counts["wash_deleted"] += n
+            self._sleep()
+
+        # A BEFORE just before the cutoff belongs to an AFTER that is kept
+        cycles = []
+        for before in last.values():
+            if before.wash_type != "BEFORE":
+                continue
+            after = wash_cycles.successor(before)
+            if after is not None and after.wash_type == "AFTER":
+                cycles.append(wash_cycles.build_cycle(before, after))
+        wash_cycles.save_cycles(cycles)
+        self.log(f"wash records: deleted {self.counts['wash_deleted']}")
+
+    # ----- weather logs -----
+
+    def compact_weather(self):
+        start, _end = day_bounds(self.cutoff(self.weather_purge_days))
+        n = self._delete_in_batches(WeatherLog.objects.filter(timestamp__lt=start))
+        self.counts["weather_deleted"] += n
+        self.log(f"weather logs: deleted {n}")
+
+        for day in self._days(WeatherLog, "weather", self.cutoff(self.weather_days)):
+            n = self._collapse_weather(day)
+            self.counts["weather_collapsed"] += n
+            if n:
+                self.log(f"weather {day}: removed {n} rows")
+            self._save_cursor("weather", day)
+
+    def _collapse_weather(self, day):
+        start, end = day_bounds(day)
+        qs = WeatherLog.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        keep = set(
+            qs.annotate(ts_hour=TruncHour("timestamp"))
+            .values("device_id", "kind", "ts_hour")
+            .annotate(keep=Max("id"))
+            .values_list("keep", flat=True)
+        )
+        removed = self._delete_in_batches(qs.exclude(pk__in=keep))
+        stripped = qs.filter(Q(raw_response__isnull=False) | Q(raw_compressed__isnull=False))
+        while True:
+            ids = list(stripped.order_by("pk").values_list("pk", flat=True)[:self.batch_size])
+            if not ids:
+                break
+            WeatherLog.objects.filter(pk__in=ids).update(raw_response=None, raw_compressed=None)
+            self._sleep()
+        return removed
+
+    def run(self, tables=("readings", "wash", "weather")):
+        if "readings" in tables:
+            self.compact_readings()
+        if "wash" in tables:
+            self.compact_wash()
+        if "weather" in tables:
+            self.compact_weather()
+        return self.counts
@@ -0,0 +1,233 @@
+"""
+Current weather for the stats views
+===================================
+
+`/api/solar/stats` shows the current temperature and weather code at the
+device. Fetching them from Open-Meteo inside the request tied the
+response time to a third-party API, so they are now refreshed in the
+background and requests only read what the refresher stored.
+
+`refresh()` snaps every DeviceLocation to its SOLAR_RAIN_GRID cell, looks
+up all cells due for a refresh with one multi-location request per
+SOLAR_RAIN_BATCH_SIZE cells (logged through services/weather_log.py), and
+stores
+
+    {"temperature", "weather_code", "fetched_at"}  (fetched_at: epoch seconds)
+
+per cell in the "solar" cache (and as a "current" WeatherLog row). A cell
+is due when its entry is older than SOLAR_WEATHER_REFRESH_INTERVAL, so several refreshers sharing a cache do
+not repeat each other's calls. Entries are kept for
+SOLAR_WEATHER_CACHE_TTL, much longer than the interval, so an Open-Meteo
+outage shows the last known values (flagged stale) instead of nothing.
+
+On a cache miss (the refresher runs in another process and the cache is
+not shared, or the entry expired) `get_current()` reads the cell's newest
+"current" WeatherLog row and caches it for one refresh interval.
+
+`WeatherRefresher` runs `refresh()` on a thread; run_solar_mqtt starts one
+(in the first worker only), and the refresh_solar_weather command does a
+single pass for cron or a loop of its own.
+
+`describe()` turns an entry into the response fields: temperature,
+weather_code, weather_updated_at and weather_stale (older than
+SOLAR_WEATHER_STALE_AFTER seconds, or missing).
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from solar.models import DeviceLocation, WeatherLog
+from solar.services import weather_log
+from solar.services.weather import RAIN_BATCH_SIZE, RAIN_GRID, fetch_current_many, get_cache, snap_to_grid
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = getattr(settings, 'SOLAR_WEATHER_REFRESH_INTERVAL', 900)  # seconds
+STALE_AFTER = getattr(settings, 'SOLAR_WEATHER_STALE_AFTER', 2 * REFRESH_INTERVAL)  # seconds
+CACHE_TTL = getattr(settings, 'SOLAR_WEATHER_CACHE_TTL', 6 * 3600)  # seconds
+
+
+def current_key(lat, lon, grid=RAIN_GRID):
+    cell_lat, cell_lon = snap_to_grid(lat, lon, grid)
+    return f"solar:current:{grid}:{cell_lat:.4f}:{cell_lon:.4f}"
+
+
+def _from_logs(cells):
+    """{cache key: entry} from the newest "current" WeatherLog row of each (key, (lat, lon)) cell."""
+    labels = {weather_log.cell_label(snap_to_grid(lat, lon)): key for key, (lat, lon) in cells.items()}
+    if not labels:
+        return {}
+    rows = WeatherLog.objects.filter(kind=weather_log.CURRENT, cell__in=labels)
+    match = Q()
+    for row in rows.values("cell").annotate(last=Max("hour")).order_by():
+        match |= Q(cell=row["cell"], hour=row["last"])
+    if not match:
+        return {}
+    entries = {
+        labels[log.cell]: {"temperature": log.temperature, "weather_code": log.weather_code,
+                           "fetched_at": log.timestamp.timestamp()}
+        for log in rows.filter(match)
+    }
+    if entries:
+        try:
+            # Short-lived: a newer row lands every refresh interval
+            get_cache().set_many(entries, REFRESH_INTERVAL)
+        except Exception as e:
+            logger.warning(f"[Weather] cache write failed: {e}")
+    return entries
+
+
+def get_current(lat, lon):
+    """Entry for the cell containing (lat, lon), or None."""
+    if lat is None or lon is None:
+        return None
+    key = current_key(lat, lon)
+    try:
+        entry = get_cache().get(key)
+    except Exception as e:
+        logger.warning(f"[Weather] cache read failed: {e}")
+        entry = None
+    if entry is None:
+        entry = _from_logs({key: (lat, lon)}).get(key)
+    return entry
+
+
+def get_current_many(locations):
+    """{device_id: entry} for DeviceLocations with coordinates and a known entry."""
+    keys = {
+        loc.device_id: current_key(loc.lat, loc.lon)
+        for loc in locations
+        if loc.lat is not None and loc.lon is not None
+    }
+    if not keys:
+        return {}
+    try:
+        found = get_cache().get_many(set(keys.values()))
+    except Exception as e:
+        logger.warning(f"[Weather] cache read failed: {e}")
+        found = {}
+    missing = {
+        keys[loc.device_id]: (loc.lat, loc.lon)
+        for loc in locations
+        if loc.device_id in keys and keys[loc.device_id] not in found
+    }
+    if missing:
+        found.update(_from_logs(missing))
+    return {device_id: found[key] for device_id, key in keys.items() if key in found}
+
+
+def describe(entry, now=None, stale_after=STALE_AFTER):
+    """Response fields for a cached entry (None = never fetched)."""
+    if entry is None:
+        return {"temperature": None, "weather_code": None, "weather_updated_at": None, "weather_stale": True}
+    now = time.time() if now is None else now
+    fetched = datetime.fromtimestamp(entry["fetched_at"], tz=timezone.get_current_timezone())
+    return {
+        "temperature": entry["temperature"],
+        "weather_code": entry["weather_code"],
+        "weather_updated_at": fetched.isoformat(),
+        "weather_stale": now - entry["fetched_at"] > stale_after,
+    }
+
+
+def refresh(interval=REFRESH_INTERVAL, batch_size=RAIN_BATCH_SIZE, force=False):
+    """Fetch current weather for every cell that is due. Returns cells refreshed."""
+    cells = defaultdict(list)
+    for device_id, lat, lon in (
+        DeviceLocation.objects
+        .filter(lat__isnull=False, lon__isnull=False)
+        .values_list("device_id", "lat", "lon")
+    ):
+        cells[current_key(lat, lon)].append((device_id, lat, lon))
+    if not cells:
+        return 0
+
+    cache = get_cache()
+    now = time.time()
+    if not force:
+        entries = cache.get_many(list(cells))
+        cells = {
+            key: devices for key, devices in cells.items()
+            if key not in entries or now - entries[key]["fetched_at"] >= interval
+        }
+
+    refreshed = 0
+    items = list(cells.items())
+    for i in range(0, len(items), batch_size):
+        chunk = items[i:i + batch_size]
+        coords = [snap_to_grid(devices[0][1], devices[0][2]) for _, devices in chunk]
+        try:
+            results = fetch_current_many(coords)
+        except Exception as e:
+            logger.warning(f"[Weather] current weather lookup failed: {e}")
+            results = None
+        if results is None:
+            continue
+
+        fetched_at = time.time()
+        entries = {}
+        logs = []
+        for (key, devices), (current, data) in zip(chunk, results):
+            entries[key] = {**current, "fetched_at": fetched_at}
+            device_id, lat, lon = devices[0]
+            logs.append(weather_log.build(
+                weather_log.CURRENT, snap_to_grid(lat, lon), device_id, lat, lon, data,
+                temperature=current["temperature"],
+                weather_code=current["weather_code"],
+            ))
+        cache.set_many(entries, CACHE_TTL)
+        refreshed += len(entries)
+        try:
+            weather_log.save(logs)
+        except Exception as e:
+            logger.warning(f"[Weather] WeatherLog save failed: {e}")
+    return refreshed
+
+
+class WeatherRefresher:
+    """Calls `refresh()` every `interval` seconds on a daemon thread."""
+
+    def __init__(self, interval=REFRESH_INTERVAL):
+        self.interval = float(interval)
+        self._stopped = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.refreshed = 0
+        self.last_run = None
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="solar-weather-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def stats(self):
+        return {"runs": self.runs, "refreshed": self.refreshed, "last_run": self.last_run}
+
+    def _run(self):
+        # Check well within the interval; refresh() skips cells that are still fresh
+        wait = min(self.interval, 60)
+        while True:
+            try:
+                close_old_connections()
+                self.refreshed += refresh(interval=self.interval)
+                self.runs += 1
+                self.last_run = time.time()
+            except Exception as e:
+                logger.error(f"[Weather] refresh failed: {e}")
+            if self._stopped.wait(wait):
+                return
@@ -0,0 +1,113 @@
+"""
+Duplicate suppression for MQTT readings
+=======================================
+
+Devices resend readings after reconnecting and the broker redelivers QoS1
+messages, so the same reading can arrive more than once. Each reading is
+keyed by device, topic type and the device-supplied timestamp (`ts`) or
+sequence number (`seq`). `RecentKeys` remembers the last
+SOLAR_INGEST_DEDUP_SIZE keys so most repeats never reach the database. The
+unique constraints on SolarHourlyData / WashRecord catch the rest.
+
+Before a bulk insert, `new_rows()` drops rows whose unique key is already
+stored (after a restart, or when shared-subscription workers both got the
+message), so write listeners only see rows that were really inserted.
+Inserts still run with ignore_conflicts for the rare race between two
+writers.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import UniqueConstraint
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+DEDUP_SIZE = getattr(settings, 'SOLAR_INGEST_DEDUP_SIZE', 100000)
+
+# Device clocks that were never set report 1970; ignore anything this old
+MIN_DEVICE_TIME = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def parse_device_time(value):
+    """
+    Parse a device timestamp: epoch seconds/milliseconds or ISO 8601.
+    Returns an aware datetime, or None if missing or implausible.
+    """
+    if value in (None, ""):
+        return None
+    try:
+        if isinstance(value, (int, float)) or str(value).replace(".", "", 1).isdigit():
+            seconds = float(value)
+            if seconds > 1e12:  # milliseconds
+                seconds /= 1000.0
+            dt = datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+        else:
+            dt = parse_datetime(str(value))
+            if dt is None:
+                return None
+            if timezone.is_naive(dt):
+                dt = timezone.make_aware(dt)
+    except (ValueError, OverflowError, OSError):
+        return None
+    if dt < MIN_DEVICE_TIME or dt > timezone.now() + timedelta(days=1):
+        return None
+    return dt
+
+
+def reading_key(device_id, kind, ts=None, seq=None):
+    """Idempotency key for a reading, or None if the device sent neither ts nor seq."""
+    if ts is not None:
+        return (device_id, kind, "ts", ts.timestamp())
+    if seq is not None:
+        return (device_id, kind, "seq", str(seq))
+    return None
+
+
+def unique_fields(model):
+    """Fields of the model's unconditional unique constraint, or None."""
+    for constraint in model._meta.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.fields and constraint.condition is None:
+            return list(constraint.fields)
+    return None
+
+
+def new_rows(model, objs):
+    """`objs` without rows already stored or repeated earlier in `objs`, by the unique key."""
+    fields = unique_fields(model)
+    if not fields or not objs:
+        return objs
+    keys = [tuple(getattr(o, f) for f in fields) for o in objs]
+    lookup = {f"{f}__in": {k[i] for k in keys} for i, f in enumerate(fields)}
+    seen = set(model.objects.filter(**lookup).values_list(*fields))
+    out = []
+    for obj, key in zip(objs, keys):
+        if key not in seen:
+            seen.add(key)
+            out.append(obj)
+    return out
+
+
+class RecentKeys:
+    """Thread-safe bounded LRU set."""
+
+    def __init__(self, capacity=DEDUP_SIZE):
+        self.capacity = max(1, int(capacity))
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def seen(self, key):
+        """Record `key`; returns True if it was already present."""
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return True
+            self._keys[key] = None
+            if len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+            return False
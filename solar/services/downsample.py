@@ -0,0 +1,104 @@
+"""
+Downsampled reading series for charts
+=====================================
+
+`/api/solar/series` returns any time range of one device's readings in at
+most `points` points, picked with Largest-Triangle-Three-Buckets (LTTB):
+the first and last readings are kept, the rest are split into equal
+buckets, and from each bucket the reading forming the largest triangle
+with the previously kept point and the next bucket's average is chosen.
+Peaks and dips survive, so the chart keeps its shape while the payload
+stays the same size however often the device reports.
+
+Readings are loaded with `values_list` straight into NumPy arrays (no
+model instances). Given an `Archive`, months already in the columnar
+archive are read from its memory-mapped files instead of the table, so a
+range compaction has thinned out still charts at full resolution. Triangle areas are computed for a whole bucket at once;
+only the walk over buckets is a Python loop.
+"""
+
+import logging
+from datetime import datetime
+
+import numpy as np
+from django.utils import timezone
+
+from solar.models import SolarHourlyData
+from solar.services.archive import month_bounds
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("power", "voltage", "current", "energy")
+
+
+def lttb(x, y, threshold):
+    """Indices of the `threshold` points LTTB keeps from (x, y), x ascending."""
+    n = len(x)
+    if threshold >= n or n <= 2:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:max(threshold, 0)], dtype=np.int64)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # threshold - 2 buckets between the fixed first and last points
+    every = (n - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    # Averages of every bucket up front; the last bucket's "next" is the last point
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    avg_x = np.append(sums_x / sizes, x[-1])
+    avg_y = np.append(sums_y / sizes, y[-1])
+
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx, by = x[lo:hi], y[lo:hi]
+        cx, cy = avg_x[i + 1], avg_y[i + 1]
+        area = np.abs((x[a] - cx) * (by - y[a]) - (x[a] - bx) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def load_series(device_id, start, end, field="power", archive=None):
+    """(epoch seconds, values) arrays of a device's readings in [start, end)."""
+    qs = SolarHourlyData.objects.filter(device_id=device_id, timestamp__gte=start, timestamp__lt=end)
+    archived = []
+    if archive is not None:
+        for month in archive.months(device_id):
+            month_lo, month_hi = month_bounds(month)
+            if month_lo < end and month_hi > start:
+                archived.append(month)
+                qs = qs.exclude(timestamp__gte=month_lo, timestamp__lt=month_hi)
+
+    rows = list(qs.order_by("timestamp").values_list("timestamp", field))
+    n = len(rows)
+    ts = np.fromiter((r[0].timestamp() for r in rows), dtype=np.float64, count=n)
+    values = np.fromiter((r[1] for r in rows), dtype=np.float64, count=n)
+    if not archived:
+        return ts, values
+
+    cols = archive.load(device_id, start, end)
+    ts = np.concatenate([cols["timestamp"].astype(np.float64), ts])
+    values = np.concatenate([cols[field], values])
+    order = np.argsort(ts, kind="stable")
+    return ts[order], values[order]
+
+
+def downsampled_series(device_id, start, end, field="power", points=500, archive=None):
+    """Chart points [{"timestamp", field}] and the raw reading count."""
+    ts, values = load_series(device_id, start, end, field, archive=archive)
+    keep = lttb(ts, values, points)
+    tz = timezone.get_current_timezone()
+    data = [
+        {"timestamp": datetime.fromtimestamp(t, tz=tz).isoformat(), field: v}
+        for t, v in zip(ts[keep].tolist(), values[keep].tolist())
+    ]
+    return data, len(ts)
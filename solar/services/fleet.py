@@ -0,0 +1,142 @@
+"""
+Stats for many devices at once
+==============================
+
+`/api/solar/stats/fleet` returns the `/api/solar/stats` payload for a list
+of devices. Instead of ~7 queries per device it runs a fixed number of
+grouped queries (`device_id IN (...)`, grouped by device); current
+weather comes from the background-refreshed cache in one get_many.
+
+The per-device numbers are computed exactly like the single-device view.
+Fleet totals are summed from the unrounded values and rounded once.
+"""
+
+import calendar
+import logging
+from collections import defaultdict
+from datetime import date, datetime
+
+from django.utils import timezone
+
+from solar.models import SolarHourlyData, DeviceLocation
+from solar.services import current_weather, rollups, wash_cycles
+from solar.services.live import get_latest_many, get_today_yields
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRICE = 5.0
+DEFAULT_CAPACITY = 5.0
+TOTAL_FIELDS = ("current_power", "period_yield", "today_yield", "money_saved")
+
+
+def _summary(points, hours_per_point):
+    """data/total_yield/avg_power/avg_energy for one device's points."""
+    total = sum(p["power"] for p in points)
+    count = len(points)
+    return {
+        "data": points,
+        "total_yield": total,
+        "avg_power": total / (count * hours_per_point) if count else 0.0,
+        "avg_energy": total / count if count else 0.0,
+    }
+
+
+def _grouped(totals, label):
+    """Chart points from {device_id: {date: total}}."""
+    return {
+        device_id: [{"time": d.strftime(label), "power": round(total, 2)} for d, total in series.items()]
+        for device_id, series in totals.items()
+    }
+
+
+def day_series(device_ids, day):
+    start_time = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    end_time = timezone.make_aware(datetime.combine(day, datetime.max.time()))
+    points = defaultdict(list)
+    rows = (
+        SolarHourlyData.objects
+        .filter(device_id__in=device_ids, timestamp__range=(start_time, end_time))
+        .order_by("device_id", "timestamp")
+        .values_list("device_id", "timestamp", "power")
+    )
+    for device_id, ts, power in rows:
+        points[device_id].append({"time": ts.strftime("%H:%M"), "power": power})
+    return {d: _summary(points.get(d, []), 1) for d in device_ids}
+
+
+def month_series(device_ids, year, month):
+    last_day = calendar.monthrange(year, month)[1]
+    # Rollups, plus raw rows for days that were never backfilled
+    points = _grouped(
+        rollups.daily_totals(device_ids, date(year, month, 1), date(year, month, last_day)), "%d-%b")
+    return {d: _summary(points.get(d, []), 24) for d in device_ids}
+
+
+def year_series(device_ids, year):
+    points = _grouped(rollups.monthly_totals(device_ids, year), "%b")
+    return {d: _summary(points.get(d, []), 30 * 24) for d in device_ids}
+
+
+def period_series(device_ids, period, value):
+    """Series for a normalized (period, value) as built by the stats view."""
+    if period == "day":
+        return day_series(device_ids, datetime.strptime(value, "%Y-%m-%d").date())
+    if period == "month":
+        year, month = map(int, value.split("-"))
+        return month_series(device_ids, year, month)
+    if period == "year":
+        return year_series(device_ids, int(value))
+    return {d: _summary([], 1) for d in device_ids}
+
+
+def fleet_stats(device_ids, period, value, wash_fallback_limit=100):
+    """({device_id: stats payload}, fleet totals) for the normalized period."""
+    locations = {loc.device_id: loc for loc in DeviceLocation.objects.filter(device_id__in=device_ids)}
+    series = period_series(device_ids, period, value)
+    today = get_today_yields(device_ids)
+    latest = get_latest_many(device_ids)
+    cycles = wash_cycles.latest_cycles(device_ids)
+    unpaired = wash_cycles.recent_records(
+        [d for d in device_ids if d not in cycles], wash_fallback_limit)
+    weather = current_weather.get_current_many(locations.values())
+
+    out = {}
+    totals = dict.fromkeys(TOTAL_FIELDS, 0.0)
+    for device_id in device_ids:
+        loc = locations.get(device_id)
+        price = loc.price if loc else DEFAULT_PRICE
+        s = series[device_id]
+
+        if device_id in cycles:
+            wash = wash_cycles.cycle_summary(cycles[device_id])
+        else:
+            wash = wash_cycles.recent_pair_summary(device_id, records=unpaired[device_id])
+
+        location = {"city": "Unknown", "state": "Unknown", "temperature": None, "lat": None, "lon": None,
+                    "price": price, "capacity": DEFAULT_CAPACITY}
+        if loc:
+            location.update(city=loc.city, state=loc.state, lat=loc.lat, lon=loc.lon,
+                            price=loc.price, capacity=loc.capacity)
+            location.update(current_weather.describe(weather.get(device_id)))
+
+        reading = latest.get(device_id)
+        raw = {
+            "current_power": reading["power"] if reading else 0.0,
+            "period_yield": s["total_yield"],
+            "today_yield": today[device_id],
+            "money_saved": (s["total_yield"] / 1000.0) * price,
+        }
+        for key in TOTAL_FIELDS:
+            totals[key] += raw[key]
+        out[device_id] = {
+            "data": s["data"],
+            "wash": wash,
+            "location": location,
+            "current_power": raw["current_power"],
+            "period_yield": round(raw["period_yield"], 2),
+            "avg_power": round(s["avg_power"], 2),
+            "avg_energy": round(s["avg_energy"], 2),
+            "today_yield": round(raw["today_yield"], 2),
+            "money_saved": round(raw["money_saved"], 2),
+        }
+    return out, {key: round(total, 2) for key, total in totals.items()}
@@ -0,0 +1,287 @@
+"""
+Solar MQTT ingestion handler
+============================
+
+`Ingestor` owns everything that happens to an MQTT message once paho hands
+it over: parsing, the write-behind buffer (and spool), the weather
+worker pool / rain batcher, the anomaly detector that turns unusual
+readings into SolarAlert rows, and the current-weather refresher behind
+the stats views. `run_solar_mqtt` wires it to a real paho client;
+`bench_solar_ingest` drives the same handler with synthetic traffic.
+
+Topics:
+    solar/<id>/data/hourly        -> SolarHourlyData
+    solar/<id>/data/before_wash   -> WashRecord BEFORE
+    solar/<id>/data/after_wash    -> WashRecord AFTER
+    solar/<id>/weather/check      -> publishes solar/<id>/weather/response
+"""
+
+import json
+import logging
+import time
+import traceback
+import zlib
+
+from django.conf import settings
+
+from solar.models import SolarHourlyData, WashRecord, SolarErrorLog
+from solar.services import live, metrics, rollups, stats_cache, wash_cycles
+from solar.services.anomaly import AnomalyDetector
+from solar.services.current_weather import WeatherRefresher
+from solar.services.dedup import RecentKeys, parse_device_time, reading_key
+from solar.services.live import LatestTracker
+from solar.services.weather import check_rain, rain_flight, RainBatcher
+from solar.services.worker_pool import WorkerPool
+from solar.services.write_buffer import WriteBuffer
+
+logger = logging.getLogger(__name__)
+
+# Derived tables refreshed after every insert of raw readings (buffer or spool)
+WRITE_LISTENERS = [
+    rollups.after_write,
+    live.after_write,  # reads the rollups refreshed just above
+    wash_cycles.after_write,
+    stats_cache.after_write,
+]
+
+
+def notify_written(model, objs):
+    for fn in WRITE_LISTENERS:
+        try:
+            fn(model, objs)
+        except Exception as e:
+            logger.error(f"[Ingest] {fn.__module__}.{fn.__name__} failed: {e}")
+
+
+class Ingestor:
+    def __init__(self, echo=None,
+                 flush_size=settings.SOLAR_INGEST_FLUSH_SIZE,
+                 flush_interval=settings.SOLAR_INGEST_FLUSH_INTERVAL,
+                 max_buffer=settings.SOLAR_INGEST_MAX_BUFFER,
+                 spool=None,
+                 weather_workers=settings.SOLAR_WEATHER_WORKERS,
+                 weather_queue=settings.SOLAR_WEATHER_QUEUE_SIZE,
+                 weather_overflow=settings.SOLAR_WEATHER_OVERFLOW,
+                 rain_batch_window=settings.SOLAR_RAIN_BATCH_WINDOW,
+                 rain_batch_size=settings.SOLAR_RAIN_BATCH_SIZE,
+                 dedup_size=settings.SOLAR_INGEST_DEDUP_SIZE,
+                 anomaly_silence=settings.SOLAR_ANOMALY_SILENCE,
+                 anomaly_warmup_days=settings.SOLAR_ANOMALY_WARMUP_DAYS,
+                 weather_refresh=settings.SOLAR_WEATHER_REFRESH_INTERVAL,
+                 partitions=1, partition_index=None):
+        # `echo` receives the per-message console lines (None = quiet)
+        self.echo = echo
+        self.spool = spool
+        self.partitions = max(1, partitions)
+        self.partition_index = partition_index
+        self.recent = RecentKeys(dedup_size)
+        self.latest = LatestTracker()
+
+        self.buffer = WriteBuffer(
+            flush_size=flush_size,
+            flush_interval=flush_interval,
+            max_depth=max_buffer,
+            spool=spool,
+        )
+        self.rain_batcher = None
+        if rain_batch_window > 0:
+            self.rain_batcher = RainBatcher(window=rain_batch_window, max_locations=rain_batch_size)
+        self.weather_pool = WorkerPool(
+            self.weather_job,
+            on_reject=self.weather_failsafe,
+            workers=weather_workers,
+            queue_size=weather_queue,
+            overflow=weather_overflow,
+            name="solar-weather",
+        )
+        # Alerts are queued in the write buffer like readings
+        self.anomaly = AnomalyDetector(emit=self.buffer.add, silence=anomaly_silence)
+        self.anomaly_warmup_days = anomaly_warmup_days
+        self.weather_refresher = WeatherRefresher(interval=weather_refresh)
+        for fn in WRITE_LISTENERS:
+            self.buffer.add_listener(fn)
+        metrics.BUFFER_DEPTH.set_function(lambda: self.buffer.depth)
+        metrics.WEATHER_QUEUE_DEPTH.set_function(lambda: self.weather_pool.depth)
+
+    def start(self):
+        self.buffer.start()
+        try:
+            seeded = self.anomaly.warm_up(self.anomaly_warmup_days, owns=self.owns)
+            logger.info(f"[Anomaly] seeded {seeded} device-hour baselines")
+        except Exception as e:
+            logger.error(f"[Anomaly] warm-up failed: {e}")
+        self.anomaly.start()
+        if self.rain_batcher:
+            self.rain_batcher.start()
+        self.weather_pool.start()
+        self.weather_refresher.start()
+        return self
+
+    def stop(self):
+        """Drain the weather pool and flush pending writes. Returns final stats."""
+        self.weather_refresher.stop()
+        self.weather_pool.stop()
+        if self.rain_batcher:
+            self.rain_batcher.stop()
+        self.anomaly.stop()
+        self.buffer.stop()
+        if self.spool:
+            self.spool.close()
+        return self.stats()
+
+    def stats(self):
+        stats = {
+            "buffer_depth": self.buffer.depth,
+            "weather_pool": self.weather_pool.stats(),
+            "rain_lookups": rain_flight.stats(),
+            "anomaly": self.anomaly.stats(),
+            "weather_refresh": self.weather_refresher.stats(),
+        }
+        if self.rain_batcher:
+            stats["rain_batches"] = self.rain_batcher.stats()
+        return stats
+
+    def _echo(self, line):
+        if self.echo:
+            self.echo(line)
+
+    def owns(self, device_id):
+        """With hash partitioning, only handle devices mapped to this worker."""
+        if self.partition_index is None or self.partitions == 1:
+            return True
+        return zlib.crc32(device_id.encode()) % self.partitions == self.partition_index
+
+    # ── Weather ─────────────────────────────────────
+    def weather_job(self, client, device_id, payload_str):
+        try:
+            d = json.loads(payload_str)
+            lat = float(d.get("lat", 0))
+            lon = float(d.get("lon", 0))
+            thr = float(d.get("threshold", 3))
+
+            def reply(skip):
+                resp = json.dumps({"skip_wash": skip})
+                client.publish(f"solar/{device_id}/weather/response", resp, qos=1)
+                self._echo(f"{'SKIP' if skip else 'WASH'} {device_id} lat={lat} lon={lon} "
+                           f"q={self.weather_pool.depth} wait={self.weather_pool.last_wait * 1000:.0f}ms")
+
+            if not (lat or lon):
+                reply(False)
+            elif self.rain_batcher:
+                self.rain_batcher.submit(lat, lon, thr, reply, device_id=device_id)
+            else:
+                reply(check_rain(lat, lon, thr, device_id=device_id))
+        except Exception as e:
+            logger.error(f"[Weather] {device_id}: {e}")
+            try:
+                SolarErrorLog.objects.create(
+                    device_id=device_id,
+                    error_type="WEATHER_PROCESSING",
+                    message=str(e),
+                    traceback=traceback.format_exc()
+                )
+            except:
+                pass
+            self.weather_failsafe(client, device_id, payload_str)
+
+    def weather_failsafe(self, client, device_id, payload_str):
+        try:
+            client.publish(f"solar/{device_id}/weather/response",
+                           json.dumps({"skip_wash": False}), qos=1)
+        except Exception:
+            pass
+
+    # ── MQTT ────────────────────────────────────────
+    @staticmethod
+    def topic_type(topic):
+        if topic.endswith("/weather/check"):
+            return "weather_check"
+        for kind in ("hourly", "before_wash", "after_wash"):
+            if topic.endswith("/" + kind):
+                return kind
+        return "other"
+
+    def on_message(self, client, userdata, msg):
+        started = time.perf_counter()
+        try:
+            self._handle(client, msg)
+        finally:
+            metrics.HANDLE_SECONDS.observe(time.perf_counter() - started)
+
+    def _handle(self, client, msg):
+        try:
+            topic = msg.topic
+            parts = topic.split("/")
+            if len(parts) >= 2 and not self.owns(parts[1]):
+                return  # another worker owns this device
+            metrics.MESSAGES.inc(type=self.topic_type(topic))
+            payload = msg.payload.decode("utf-8")
+
+            if "/weather/check" in topic:
+                if len(parts) >= 3:
+                    self.weather_pool.submit(client, parts[1], payload)
+                return
+
+            data = json.loads(payload)
+            device_id = data.get("device_id")
+            if not device_id:
+                return
+            voltage = float(data.get("voltage", 0))
+            current = float(data.get("current", 0))
+            power   = float(data.get("power", 0))
+
+            kind = self.topic_type(topic)
+            if kind == "other":
+                return
+            # Device time keys the reading; without it we fall back to receipt time
+            ts = parse_device_time(data.get("ts", data.get("timestamp")))
+            key = reading_key(device_id, kind, ts=ts, seq=data.get("seq"))
+            if key is not None and self.recent.seen(key):
+                metrics.DUPLICATES.inc(type=kind)
+                return
+            extra = {"timestamp": ts} if ts is not None else {}
+
+            if kind == "hourly":
+                reading = SolarHourlyData(
+                    device_id=device_id, voltage=voltage,
+                    current=current, power=power, energy=power, **extra)
+                self.buffer.add(reading)
+                self.latest.update(reading)
+                self.anomaly.observe(reading)
+                self._echo(f"✓ Hourly {device_id} ({power}W)")
+            elif kind == "before_wash":
+                self.buffer.add(WashRecord(device_id=device_id, wash_type="BEFORE",
+                    voltage=voltage, current=current, power=power, **extra))
+            elif kind == "after_wash":
+                self.buffer.add(WashRecord(device_id=device_id, wash_type="AFTER",
+                    voltage=voltage, current=current, power=power, **extra))
+        except json.JSONDecodeError:
+            metrics.PARSE_FAILURES.inc()
+            logger.error(f"Invalid JSON: {msg.payload}")
+            try:
+                SolarErrorLog.objects.create(
+                    device_id="unknown",
+                    error_type="MQTT_JSON_PARSE",
+                    message=f"Invalid JSON: {msg.payload.decode('utf-8', errors='ignore')}",
+                    traceback=traceback.format_exc()
+                )
+            except:
+                pass
+        except Exception as e:
+            metrics.PROCESSING_ERRORS.inc()
+            logger.exception(f"MQTT error: {e}")
+            try:
+                # Attempt to extract device_id if we managed to parse the topic/json partially
+                did = None
+                try:
+                    did = json.loads(msg.payload.decode("utf-8")).get("device_id")
+                except:
+                    pass
+                SolarErrorLog.objects.create(
+                    device_id=did or "unknown",
+                    error_type="MQTT_PROCESSING",
+                    message=str(e),
+                    traceback=traceback.format_exc()
+                )
+            except:
+                pass
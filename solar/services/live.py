@@ -0,0 +1,226 @@
+"""
+Live values shared by the MQTT ingestor and the web workers
+===========================================================
+
+The ingestor writes every hourly reading to the "solar" cache under
+`solar:latest:<device_id>`. `/api/solar/latest` and the `current_power`
+part of `/api/solar/stats` read it from there and only query
+SolarHourlyData on a miss, which then fills the cache (read-through).
+
+It also keeps today's yield per device for the current local (TIME_ZONE)
+day under `solar:today:<device_id>:<date>`, so the stats views read
+today_yield without aggregating. `after_write` sets the key from today's
+SolarDailyRollup row after each insert, so only readings that were really
+stored count; a missing key falls back to the rollup, then to the raw
+rows.
+
+The cache backend must be shared (Redis, DB cache) for web workers to see
+the ingestor's writes. With a LocMemCache each web process only ever sees
+what it read from the database itself, so values filled from the database
+are kept for SOLAR_LATEST_FALLBACK_TTL (about one reporting interval), not
+LATEST_TTL, and are at most that old.
+"""
+
+import logging
+
+from django.conf import settings
+
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+
+from solar.models import SolarHourlyData, SolarDailyRollup
+from solar.services.rollups import day_bounds
+from solar.services.weather import get_cache
+
+logger = logging.getLogger(__name__)
+
+LATEST_TTL = getattr(settings, 'SOLAR_LATEST_CACHE_TTL', 7 * 86400)  # seconds
+FALLBACK_TTL = getattr(settings, 'SOLAR_LATEST_FALLBACK_TTL', 3600)  # seconds, for values read from the DB
+TODAY_TTL = 2 * 86400  # one key per local day; outlives the day it counts
+
+
+def latest_key(device_id):
+    return f"solar:latest:{device_id}"
+
+
+def today_key(device_id, day):
+    return f"solar:today:{device_id}:{day.isoformat()}"
+
+
+def reading_dict(reading):
+    return {
+        "timestamp": reading.timestamp.isoformat(),
+        "power": reading.power,
+        "voltage": reading.voltage,
+        "current": reading.current,
+        "energy": reading.energy,
+    }
+
+
+def set_latest(device_id, data, ttl=LATEST_TTL):
+    try:
+        get_cache().set(latest_key(device_id), data, ttl)
+    except Exception as e:
+        logger.warning(f"[Latest] cache write failed for {device_id}: {e}")
+
+
+def get_latest(device_id):
+    """Latest reading as a dict, or None if the device has never reported."""
+    try:
+        data = get_cache().get(latest_key(device_id))
+    except Exception as e:
+        logger.warning(f"[Latest] cache read failed for {device_id}: {e}")
+        data = None
+    if data is not None:
+        return data
+
+    reading = (
+        SolarHourlyData.objects
+        .filter(device_id=device_id)
+        .order_by('-timestamp')
+        .first()
+    )
+    if reading is None:
+        return None
+    data = reading_dict(reading)
+    set_latest(device_id, data, FALLBACK_TTL)
+    return data
+
+
+def get_latest_many(device_ids):
+    """{device_id: latest reading dict or None} with one cache round trip."""
+    keys = {latest_key(d): d for d in device_ids}
+    try:
+        found = get_cache().get_many(list(keys))
+    except Exception as e:
+        logger.warning(f"[Latest] cache read failed: {e}")
+        found = {}
+    out = {keys[k]: v for k, v in found.items()}
+
+    missing = [d for d in device_ids if d not in out]
+    if missing:
+        newest = (
+            SolarHourlyData.objects.filter(device_id__in=missing)
+            .values('device_id')
+            .annotate(last=Max('timestamp'))
+        )
+        match = Q()
+        for row in newest:
+            match |= Q(device_id=row['device_id'], timestamp=row['last'])
+        fresh = {}
+        if match:
+            for reading in SolarHourlyData.objects.filter(match):
+                fresh[reading.device_id] = reading_dict(reading)
+        if fresh:
+            try:
+                get_cache().set_many({latest_key(d): v for d, v in fresh.items()}, FALLBACK_TTL)
+            except Exception as e:
+                logger.warning(f"[Latest] cache write failed: {e}")
+        out.update(fresh)
+    return {d: out.get(d) for d in device_ids}
+
+
+class LatestTracker:
+    """
+    Ingestor side: publishes a reading only if it is newer than the last
+    one this process published, so replays of old readings never move the
+    latest value backwards.
+    """
+
+    def __init__(self):
+        self._published = {}  # device_id -> timestamp
+
+    def update(self, reading):
+        last = self._published.get(reading.device_id)
+        if last is not None and reading.timestamp <= last:
+            return False
+        self._published[reading.device_id] = reading.timestamp
+        set_latest(reading.device_id, reading_dict(reading))
+        return True
+
+
+def get_today_yield(device_id):
+    """Sum of today's (local day) power readings for the device."""
+    today = timezone.localdate()
+    try:
+        milli = get_cache().get(today_key(device_id, today))
+    except Exception as e:
+        logger.warning(f"[Today] cache read failed for {device_id}: {e}")
+        milli = None
+    if milli is not None:
+        return milli / 1000.0
+
+    rollup = (
+        SolarDailyRollup.objects
+        .filter(device_id=device_id, day=today)
+        .values_list('power_sum', flat=True)
+        .first()
+    )
+    if rollup is not None:
+        return rollup
+
+    # Not rolled up yet (e.g. rollups never backfilled): sum the raw day
+    start, end = day_bounds(today)
+    return SolarHourlyData.objects.filter(
+        device_id=device_id, timestamp__gte=start, timestamp__lt=end,
+    ).aggregate(Sum('power'))['power__sum'] or 0.0
+
+
+def get_today_yields(device_ids):
+    """`get_today_yield` for several devices, with grouped fallbacks."""
+    today = timezone.localdate()
+    keys = {today_key(d, today): d for d in device_ids}
+    try:
+        found = get_cache().get_many(list(keys))
+    except Exception as e:
+        logger.warning(f"[Today] cache read failed: {e}")
+        found = {}
+    out = {keys[k]: milli / 1000.0 for k, milli in found.items()}
+
+    missing = [d for d in device_ids if d not in out]
+    if missing:
+        out.update(
+            SolarDailyRollup.objects
+            .filter(device_id__in=missing, day=today)
+            .values_list('device_id', 'power_sum')
+        )
+    missing = [d for d in device_ids if d not in out]
+    if missing:
+        start, end = day_bounds(today)
+        out.update(
+            SolarHourlyData.objects
+            .filter(device_id__in=missing, timestamp__gte=start, timestamp__lt=end)
+            .values('device_id')
+            .annotate(total=Sum('power'))
+            .values_list('device_id', 'total')
+        )
+    return {d: out.get(d) or 0.0 for d in device_ids}
+
+
+def after_write(model, objs):
+    """
+    Write-buffer listener: publish today's totals for the devices in a
+    batch of freshly inserted hourly readings.
+
+    Runs after rollups.after_write, so today's SolarDailyRollup rows already
+    include the batch; the cache takes their power_sum (integer milli-units)
+    rather than adding each reading, so a redelivered reading never counts
+    twice. Readings for earlier days are left to the rollups.
+    """
+    if model is not SolarHourlyData or not objs:
+        return
+    today = timezone.localdate()
+    devices = {o.device_id for o in objs if timezone.localtime(o.timestamp).date() == today}
+    if not devices:
+        return
+    totals = (
+        SolarDailyRollup.objects
+        .filter(device_id__in=devices, day=today)
+        .values_list('device_id', 'power_sum')
+    )
+    try:
+        get_cache().set_many(
+            {today_key(d, today): int(round(total * 1000)) for d, total in totals}, TODAY_TTL,
+        )
+    except Exception as e:
+        logger.warning(f"[Today] cache write failed: {e}")
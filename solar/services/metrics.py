@@ -0,0 +1,278 @@
+"""
+Ingestion metrics for the solar MQTT listener
+=============================================
+
+A small in-process registry of counters, gauges and histograms, exposed in
+Prometheus text format on a local HTTP endpoint:
+
+    GET http://127.0.0.1:<SOLAR_METRICS_PORT>/metrics
+
+`MetricsReporter` also logs a one-line summary every
+SOLAR_METRICS_LOG_INTERVAL seconds. No external client library is needed.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = getattr(settings, 'SOLAR_METRICS_PORT', 0)  # 0 = no HTTP endpoint
+METRICS_LOG_INTERVAL = getattr(settings, 'SOLAR_METRICS_LOG_INTERVAL', 60)  # seconds
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        if labels:
+            return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0)
+        return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items()) or ([((), 0)] if not self.labelnames else [])
+        return [(self.name + _labels(self.labelnames, key), v) for key, v in items]
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._value = 0
+        self._fn = None
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, fn):
+        """Read the gauge from `fn()` at scrape time."""
+        self._fn = fn
+
+    def value(self):
+        if self._fn is not None:
+            try:
+                return self._fn()
+            except Exception:
+                return 0
+        return self._value
+
+    def samples(self):
+        return [(self.name, self.value())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def quantile(self, q):
+        """Approximate quantile: upper bound of the bucket holding it."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for bound, n in zip(self.buckets + (float("inf"),), self._counts):
+                seen += n
+                if seen >= rank:
+                    return bound
+        return float("inf")
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self.sum, self.count
+        out = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            out.append((f'{self.name}_bucket{{le="{bound}"}}', cumulative))
+        out.append((f'{self.name}_bucket{{le="+Inf"}}', count))
+        out.append((f"{self.name}_sum", round(total, 6)))
+        out.append((f"{self.name}_count", count))
+        return out
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, value in m.samples():
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+MESSAGES = REGISTRY.register(Counter(
+    "solar_ingest_messages_total", "MQTT messages received by topic type", ["type"]))
+PARSE_FAILURES = REGISTRY.register(Counter(
+    "solar_ingest_parse_failures_total", "MQTT payloads that were not valid JSON"))
+DUPLICATES = REGISTRY.register(Counter(
+    "solar_ingest_duplicates_total", "Readings dropped as recent duplicates", ["type"]))
+PROCESSING_ERRORS = REGISTRY.register(Counter(
+    "solar_ingest_errors_total", "MQTT messages that failed after parsing"))
+HANDLE_SECONDS = REGISTRY.register(Histogram(
+    "solar_ingest_handle_seconds", "Time spent in on_message", buckets=(
+        0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1, 1)))
+DB_WRITE_SECONDS = REGISTRY.register(Histogram(
+    "solar_ingest_db_write_seconds", "Duration of one bulk insert"))
+DB_ROWS = REGISTRY.register(Counter(
+    "solar_ingest_db_rows_total", "Rows written to the database", ["model"]))
+DB_WRITE_FAILURES = REGISTRY.register(Counter(
+    "solar_ingest_db_write_failures_total", "Bulk inserts that failed", ["model"]))
+SPOOLED_ROWS = REGISTRY.register(Counter(
+    "solar_ingest_spooled_rows_total", "Rows written to the on-disk spool"))
+BUFFER_DEPTH = REGISTRY.register(Gauge(
+    "solar_ingest_buffer_depth", "Rows waiting in the write buffer"))
+WEATHER_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "solar_weather_queue_depth", "weather/check requests waiting for a worker"))
+WEATHER_SECONDS = REGISTRY.register(Histogram(
+    "solar_weather_request_seconds", "Duration of one Open-Meteo request"))
+WEATHER_CACHE = REGISTRY.register(Counter(
+    "solar_weather_cache_total", "Rain lookups by cache result", ["result"]))
+WEATHER_COALESCED = REGISTRY.register(Counter(
+    "solar_weather_coalesced_total", "Rain lookups that waited on another in-flight lookup"))
+ALERTS = REGISTRY.register(Counter(
+    "solar_anomaly_alerts_total", "SolarAlert rows raised by the anomaly detector", ["kind"]))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, addr="127.0.0.1"):
+    server = ThreadingHTTPServer((addr, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="solar-metrics-http", daemon=True).start()
+    return server
+
+
+def summary_line(prev=None, interval=None):
+    hits = WEATHER_CACHE.value(result="hit")
+    misses = WEATHER_CACHE.value(result="miss")
+    total = MESSAGES.value()
+    rate = ""
+    if prev is not None and interval:
+        rate = f" ({(total - prev) / interval:.1f}/s)"
+    ratio = f"{hits / (hits + misses) * 100:.0f}%" if hits + misses else "-"
+    return (
+        f"[Metrics] msgs={total}{rate} parse_fail={PARSE_FAILURES.value()} dup={DUPLICATES.value()} "
+        f"errors={PROCESSING_ERRORS.value()} rows={DB_ROWS.value()} "
+        f"db_p99<={DB_WRITE_SECONDS.quantile(0.99) * 1000:.0f}ms buffer={BUFFER_DEPTH.value()} "
+        f"spooled={SPOOLED_ROWS.value()} weather_q={WEATHER_QUEUE_DEPTH.value()} "
+        f"weather_p99<={WEATHER_SECONDS.quantile(0.99) * 1000:.0f}ms cache_hit={ratio}"
+    )
+
+
+class MetricsReporter:
+    """Serves /metrics (if `port`) and logs a summary line every `interval` seconds."""
+
+    def __init__(self, port=METRICS_PORT, interval=METRICS_LOG_INTERVAL, echo=None):
+        self.port = port
+        self.interval = interval
+        self.echo = echo or logger.info
+        self._server = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.port:
+            self._server = start_http_server(self.port)
+            self.echo(f"Metrics on http://127.0.0.1:{self.port}/metrics")
+        if self.interval:
+            self._thread = threading.Thread(target=self._run, name="solar-metrics-log", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+    def _run(self):
+        prev = MESSAGES.value()
+        while not self._stopped.wait(self.interval):
+            self.echo(summary_line(prev, self.interval))
+            prev = MESSAGES.value()
@@ -0,0 +1,238 @@
+"""
+Monthly partitions for SolarHourlyData (MySQL only)
+===================================================
+
+SolarHourlyData grows by ~24 rows per device per day. On MySQL the table
+can be partitioned by month with `PARTITION BY RANGE (TO_DAYS(timestamp))`:
+range queries on `timestamp` (every stats query) only touch the months
+they cover, and expired months are removed with DROP PARTITION instead of
+a row-by-row DELETE.
+
+Partitioning is opt-in (`rotate_solar_partitions --setup`) and is not
+expressed in Django migrations. MySQL requires every unique key to
+contain the partitioning column, so setup replaces the `id` primary key
+with (id, timestamp); `id` stays AUTO_INCREMENT and unique in practice.
+
+Partitions are named pYYYYMM and hold one UTC month (timestamps are
+stored in UTC). `pmax` (MAXVALUE) catches rows beyond the last month;
+`ensure_future()` splits it so it stays empty.
+
+Expired months can be archived first: the partition is swapped into a
+plain table `<table>_pYYYYMM` with EXCHANGE PARTITION (a metadata
+operation) and the now empty partition is dropped.
+
+Month and year views read the rollups once the raw rows are gone, so
+`ensure_rollups()` builds any missing daily/monthly rollup for a
+partition's readings and reports what is still missing; the
+rotate_solar_partitions command drops nothing unless that is empty.
+Existing rollups are not recomputed (a compacted or half-dropped day would
+come out short).
+"""
+
+import logging
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.db import connection
+from django.db.models.functions import TruncDate
+
+from solar.models import SolarHourlyData, SolarDailyRollup, SolarMonthlyRollup
+from solar.services import rollups
+
+logger = logging.getLogger(__name__)
+
+TABLE = SolarHourlyData._meta.db_table
+MAX_PARTITION = "pmax"
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def month_of(name):
+    return date(int(name[1:5]), int(name[5:7]), 1)
+
+
+def utc_bounds(name):
+    """[start, end) of the UTC month held by partition `name`."""
+    month = month_of(name)
+    upper = add_months(month, 1)
+    return (datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc),
+            datetime(upper.year, upper.month, 1, tzinfo=dt_timezone.utc))
+
+
+def _definition(month):
+    upper = add_months(month, 1)
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN (TO_DAYS('{upper.isoformat()}'))"
+
+
+def check_backend():
+    if connection.vendor != "mysql":
+        raise RuntimeError(f"table partitioning needs MySQL, not {connection.vendor}")
+
+
+def list_partitions():
+    """Partition names of the table in order, empty if it is not partitioned."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+            "AND PARTITION_NAME IS NOT NULL ORDER BY PARTITION_ORDINAL_POSITION",
+            [TABLE],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def monthly_partitions():
+    return [name for name in list_partitions() if name != MAX_PARTITION]
+
+
+def setup(today, ahead=3):
+    """
+    Partition the table by month, from its first reading to `ahead`
+    months past `today`. Rebuilds the table; run it in a quiet window.
+    """
+    check_backend()
+    if list_partitions():
+        raise RuntimeError(f"{TABLE} is already partitioned")
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(timestamp) FROM {TABLE}")
+        first = cursor.fetchone()[0] or today
+    start = date(first.year, first.month, 1)
+    last = add_months(date(today.year, today.month, 1), ahead)
+
+    months = []
+    month = start
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+
+    parts = ",\n  ".join(
+        [_definition(m) for m in months] + [f"PARTITION {MAX_PARTITION} VALUES LESS THAN MAXVALUE"]
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE {TABLE} DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)"
+        )
+        cursor.execute(
+            f"ALTER TABLE {TABLE} PARTITION BY RANGE (TO_DAYS(timestamp)) (\n  {parts}\n)"
+        )
+    logger.info(f"[Partitions] {TABLE}: created {len(months)} monthly partitions")
+    return [partition_name(m) for m in months]
+
+
+def ensure_future(today, ahead=3):
+    """Create partitions up to `ahead` months past `today` by splitting pmax."""
+    check_backend()
+    existing = monthly_partitions()
+    if not existing:
+        raise RuntimeError(f"{TABLE} is not partitioned (run with --setup first)")
+
+    month = add_months(month_of(existing[-1]), 1)
+    last = add_months(date(today.year, today.month, 1), ahead)
+    created = []
+    while month <= last:
+        created.append(month)
+        month = add_months(month, 1)
+    if not created:
+        return []
+
+    parts = ", ".join(
+        [_definition(m) for m in created] + [f"PARTITION {MAX_PARTITION} VALUES LESS THAN MAXVALUE"]
+    )
+    with connection.cursor() as cursor:
+        # pmax is empty while partitions are kept ahead, so this is cheap
+        cursor.execute(
+            f"ALTER TABLE {TABLE} REORGANIZE PARTITION {MAX_PARTITION} INTO ({parts})"
+        )
+    names = [partition_name(m) for m in created]
+    logger.info(f"[Partitions] {TABLE}: added {', '.join(names)}")
+    return names
+
+
+def expired(today, retain_months):
+    """Monthly partitions entirely older than the retained window."""
+    cutoff = add_months(date(today.year, today.month, 1), -retain_months)
+    return [name for name in monthly_partitions() if month_of(name) < cutoff]
+
+
+def _rollup_gaps(days):
+    """(device_id, day) pairs of `days` without a daily rollup, and those without a monthly one."""
+    devices = {d for d, _ in days}
+    first, last = min(day for _, day in days), max(day for _, day in days)
+    daily = set(
+        SolarDailyRollup.objects.filter(device_id__in=devices, day__gte=first, day__lte=last)
+        .values_list('device_id', 'day')
+    )
+    monthly = set(
+        SolarMonthlyRollup.objects.filter(device_id__in=devices, month__gte=first.replace(day=1), month__lte=last)
+        .values_list('device_id', 'month')
+    )
+    return ({p for p in days if p not in daily},
+            {(d, day) for d, day in days if (d, day.replace(day=1)) not in monthly})
+
+
+def ensure_rollups(name):
+    """
+    Build the missing rollups for the readings in partition `name`. Returns
+    the (device_id, local day) pairs that still lack a daily or monthly
+    rollup, empty when the partition is safe to drop.
+    """
+    start, end = utc_bounds(name)
+    days = set(
+        SolarHourlyData.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        .order_by()
+        .annotate(day=TruncDate('timestamp'))
+        .values_list('device_id', 'day')
+        .distinct()
+    )
+    if not days:
+        return []
+    missing_days, missing_months = _rollup_gaps(days)
+    if missing_days:
+        rollups.refresh_days(missing_days)
+    if missing_months:
+        rollups.refresh_months({(d, day.replace(day=1)) for d, day in missing_months})
+    if missing_days or missing_months:
+        missing_days, missing_months = _rollup_gaps(days)
+    return sorted(missing_days | missing_months)
+
+
+def archive(name):
+    """Swap a partition's rows into `<table>_<name>` and return that table."""
+    archive_table = f"{TABLE}_{name}"
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {archive_table} LIKE {TABLE}")
+        cursor.execute(f"ALTER TABLE {archive_table} REMOVE PARTITIONING")
+        cursor.execute(
+            f"ALTER TABLE {TABLE} EXCHANGE PARTITION {name} WITH TABLE {archive_table} WITHOUT VALIDATION"
+        )
+    return archive_table
+
+
+def drop(names):
+    if names:
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {TABLE} DROP PARTITION {', '.join(names)}")
+        logger.info(f"[Partitions] {TABLE}: dropped {', '.join(names)}")
+
+
+def explain(sql, params):
+    """
+    Partitions MySQL will read for a query, from EXPLAIN's `partitions`
+    column. Used to check that stats queries are pruned.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN {sql}", params)
+        columns = [c[0] for c in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    touched = set()
+    for row in rows:
+        if row.get("table") == TABLE and row.get("partitions"):
+            touched.update(row["partitions"].split(","))
+    return sorted(touched)
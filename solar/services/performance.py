@@ -0,0 +1,211 @@
+"""
+Fleet performance ratio and degradation
+=======================================
+
+Compares what each device produced with its rated `DeviceLocation.capacity`
+(kWp) over trailing windows ending yesterday:
+
+* yield_<w>d_kwh - energy over the last `w` days (7, 30, 365), from
+  SolarDailyRollup.power_sum (hourly readings, so W summed = Wh).
+* specific_yield_<w>d - kWh per kWp per reported day. Days without a
+  rollup are left out, so a new or offline device is not averaged down;
+  `days_reported_30d` shows how complete the window is.
+* performance_ratio_<w>d - specific yield / SOLAR_PEAK_SUN_HOURS. There is
+  no irradiance sensor, so a site-wide nominal insolation stands in for
+  the reference yield; good for comparing devices and spotting decline,
+  not an IEC 61724 figure.
+* degradation_percent_per_year - year-over-year change of the mean daily
+  yield of each calendar month (month vs the same month a year earlier,
+  months with at least MIN_MONTH_DAYS reported days), averaged. Comparing
+  like months cancels out the seasons.
+
+`run()` splits the devices into chunks and hands them to a process pool.
+Each worker reads its chunk's daily rollups with one query into NumPy
+arrays, computes every figure with bincount/searchsorted and upserts its
+PerformanceSummary rows itself, so the parent only schedules work.
+"""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+import django
+import numpy as np
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from solar.models import SolarDailyRollup, DeviceLocation, PerformanceSummary
+from solar.services.upsert import upsert
+
+logger = logging.getLogger(__name__)
+
+PEAK_SUN_HOURS = getattr(settings, 'SOLAR_PEAK_SUN_HOURS', 5.0)  # kWh/m2/day at the sites
+DEGRADATION_YEARS = getattr(settings, 'SOLAR_DEGRADATION_YEARS', 3)
+WORKERS = getattr(settings, 'SOLAR_PERFORMANCE_WORKERS', os.cpu_count() or 1)
+CHUNK_SIZE = getattr(settings, 'SOLAR_PERFORMANCE_CHUNK_SIZE', 200)
+DEFAULT_CAPACITY = 5.0
+WINDOWS = (7, 30, 365)
+MIN_MONTH_DAYS = 20
+KEY_SHIFT = np.int64(2 ** 32)
+
+WINDOW_FIELDS = [
+    f"{name}_{w}d{suffix}"
+    for w in WINDOWS
+    for name, suffix in (("yield", "_kwh"), ("specific_yield", ""), ("performance_ratio", ""))
+]
+RESULT_FIELDS = ['window_end', 'capacity', 'days_reported_30d', 'degradation_percent_per_year',
+                 'degradation_months'] + WINDOW_FIELDS
+
+
+def _num(v, digits=3):
+    return None if np.isnan(v) else round(float(v), digits)
+
+
+def load(device_ids, start, end):
+    """Flat arrays of daily yields (kWh) for `device_ids` in [start, end]."""
+    rows = list(
+        SolarDailyRollup.objects
+        .filter(device_id__in=device_ids, day__gte=start, day__lte=end)
+        .order_by()
+        .values_list("device_id", "day", "power_sum")
+    )
+    n = len(rows)
+    code_of = {d: i for i, d in enumerate(device_ids)}
+    return {
+        "devices": list(device_ids),
+        "device": np.fromiter((code_of[r[0]] for r in rows), dtype=np.int64, count=n),
+        "day": np.fromiter((r[1].toordinal() for r in rows), dtype=np.int64, count=n),
+        "month": np.fromiter((r[1].year * 12 + r[1].month - 1 for r in rows), dtype=np.int64, count=n),
+        "kwh": np.fromiter((r[2] / 1000.0 for r in rows), dtype=np.float64, count=n),
+    }
+
+
+def analyze(data, end, capacities=None, peak_sun_hours=PEAK_SUN_HOURS):
+    """Per-device figures from `load()` arrays, as {device_id: dict}."""
+    devices = data["devices"]
+    size = len(devices)
+    if not size:
+        return {}
+    device, day, month, kwh = data["device"], data["day"], data["month"], data["kwh"]
+    capacity = np.array([(capacities or {}).get(d) or DEFAULT_CAPACITY for d in devices], dtype=np.float64)
+    end_ord = end.toordinal()
+
+    out = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for w in WINDOWS:
+            mask = day > end_ord - w
+            total = np.bincount(device[mask], weights=kwh[mask], minlength=size)
+            days = np.bincount(device[mask], minlength=size)
+            specific = np.where(days > 0, total / np.maximum(days, 1) / capacity, np.nan)
+            out[f"yield_{w}d_kwh"] = np.where(days > 0, total, np.nan)
+            out[f"specific_yield_{w}d"] = specific
+            out[f"performance_ratio_{w}d"] = specific / peak_sun_hours
+            out[f"days_{w}d"] = days
+
+        # ----- year-over-year by calendar month -----
+        keys, group = np.unique(device * KEY_SHIFT + month, return_inverse=True)
+        month_days = np.bincount(group, minlength=len(keys))
+        month_mean = np.bincount(group, weights=kwh, minlength=len(keys)) / np.maximum(month_days, 1)
+        full = month_days >= MIN_MONTH_DAYS
+        keys, month_mean = keys[full], month_mean[full]
+        prev = np.searchsorted(keys, keys - 12)
+        found = prev < len(keys)
+        prev = np.where(found, prev, 0)
+        paired = found & (keys[prev] == keys - 12) & (month_mean[prev] > 0)
+        change = np.where(paired, month_mean / np.where(paired, month_mean[prev], 1.0) - 1.0, 0.0)
+        pair_dev = (keys // KEY_SHIFT)[paired]
+        pairs = np.bincount(pair_dev, minlength=size)
+        trend = np.where(pairs > 0, np.bincount(pair_dev, weights=change[paired], minlength=size)
+                         / np.maximum(pairs, 1) * 100.0, np.nan)
+
+    return {
+        device_id: {
+            "window_end": end,
+            "capacity": float(capacity[i]),
+            "days_reported_30d": int(out["days_30d"][i]),
+            "degradation_percent_per_year": _num(trend[i]),
+            "degradation_months": int(pairs[i]),
+            **{field: _num(out[field][i]) for field in WINDOW_FIELDS},
+        }
+        for i, device_id in enumerate(devices)
+    }
+
+
+def compute_chunk(device_ids, end, peak_sun_hours=PEAK_SUN_HOURS, years=DEGRADATION_YEARS, save=True):
+    """Compute and store summaries for one chunk of devices. Runs in a pool worker."""
+    start = end - timedelta(days=max(365 * years, max(WINDOWS)) + 31)
+    data = load(device_ids, start, end)
+    capacities = dict(
+        DeviceLocation.objects.filter(device_id__in=device_ids).values_list("device_id", "capacity")
+    )
+    results = analyze(data, end, capacities=capacities, peak_sun_hours=peak_sun_hours)
+    if save and results:
+        upsert(PerformanceSummary, [PerformanceSummary(device_id=d, **r) for d, r in results.items()],
+               ['device_id'], RESULT_FIELDS + ['computed_at'])
+    return results
+
+
+def fleet_devices(start, end):
+    """Every device with rollups in [start, end]."""
+    return sorted(
+        SolarDailyRollup.objects
+        .filter(day__gte=start, day__lte=end)
+        .order_by()
+        .values_list("device_id", flat=True)
+        .distinct()
+    )
+
+
+def run(device_ids=None, end=None, workers=WORKERS, chunk_size=CHUNK_SIZE,
+        peak_sun_hours=PEAK_SUN_HOURS, years=DEGRADATION_YEARS, log=None):
+    """
+    Recompute PerformanceSummary for `device_ids` (default: the fleet) over
+    windows ending `end` (default: yesterday). Returns the number of devices.
+    """
+    log = log or logger.info
+    end = end or timezone.localdate() - timedelta(days=1)
+    if device_ids is None:
+        device_ids = fleet_devices(end - timedelta(days=max(WINDOWS)), end)
+    chunks = [device_ids[i:i + chunk_size] for i in range(0, len(device_ids), chunk_size)]
+    workers = max(1, min(workers, len(chunks)))
+
+    done = 0
+    if workers == 1:
+        for chunk in chunks:
+            done += len(compute_chunk(chunk, end, peak_sun_hours, years))
+            log(f"[Performance] {done}/{len(device_ids)} devices")
+        return done
+
+    # Workers open their own connections; don't let forked children share ours
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        futures = {pool.submit(compute_chunk, chunk, end, peak_sun_hours, years): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            try:
+                done += len(future.result())
+            except Exception as e:
+                logger.error(f"[Performance] chunk starting {futures[future][0]} failed: {e}")
+                continue
+            log(f"[Performance] {done}/{len(device_ids)} devices")
+    return done
+
+
+def as_dict(summary):
+    return {
+        "window_end": summary.window_end.isoformat(),
+        "capacity": summary.capacity,
+        "days_reported_30d": summary.days_reported_30d,
+        **{
+            f"{w}d": {
+                "yield_kwh": getattr(summary, f"yield_{w}d_kwh"),
+                "specific_yield": getattr(summary, f"specific_yield_{w}d"),
+                "performance_ratio": getattr(summary, f"performance_ratio_{w}d"),
+            }
+            for w in WINDOWS
+        },
+        "degradation_percent_per_year": summary.degradation_percent_per_year,
+        "degradation_months": summary.degradation_months,
+        "computed_at": summary.computed_at.isoformat() if summary.computed_at else None,
+    }
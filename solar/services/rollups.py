@@ -0,0 +1,292 @@
+"""
+Daily and monthly solar rollups
+===============================
+
+`get_solar_stats` month/year views read SolarDailyRollup / SolarMonthlyRollup
+instead of aggregating raw SolarHourlyData on every request.
+
+Rollups are refreshed, not incremented: for every (device, local day) that
+received readings, the day is re-aggregated from its raw rows (about 24 of
+them, found through the device/timestamp unique index), and the month is
+re-aggregated from its daily rows. This keeps them exact under duplicate
+deliveries, out-of-order readings and spool replays. `rebuild()` does the
+same for a whole range and backs the rebuild_solar_rollups command.
+
+`daily_totals()` / `monthly_totals()` are what the month and year views
+read: rollups where they exist. `daily_totals()` sums the raw readings of
+just the days without a daily rollup (history never backfilled);
+`monthly_totals()` repairs missing or stale monthly rollups and rolls up a
+month from raw readings only when it has no rollups at all.
+"""
+
+import calendar
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from solar.models import SolarHourlyData, SolarDailyRollup, SolarMonthlyRollup
+from solar.services.upsert import upsert
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = ['power_sum', 'power_count', 'power_min', 'power_max', 'last_power', 'last_timestamp']
+
+
+def local_day(ts):
+    return timezone.localtime(ts).date()
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    return start, start + timedelta(days=1)
+
+
+def _last_powers(pairs):
+    """Map (device_id, timestamp) -> power for the given last-reading pairs."""
+    out = {}
+    pairs = list(pairs)
+    for i in range(0, len(pairs), 500):
+        chunk = pairs[i:i + 500]
+        qs = SolarHourlyData.objects.filter(
+            device_id__in={d for d, _ in chunk},
+            timestamp__in={t for _, t in chunk},
+        )
+        for device_id, ts, power in qs.values_list('device_id', 'timestamp', 'power'):
+            out[(device_id, ts)] = power
+    return out
+
+
+def _daily_rows(qs):
+    groups = list(
+        qs.order_by()
+        .annotate(day=TruncDate('timestamp'))
+        .values('device_id', 'day')
+        .annotate(
+            power_sum=Sum('power'),
+            power_count=Count('id'),
+            power_min=Min('power'),
+            power_max=Max('power'),
+            last_timestamp=Max('timestamp'),
+        )
+    )
+    lasts = _last_powers({(g['device_id'], g['last_timestamp']) for g in groups})
+    return [
+        SolarDailyRollup(last_power=lasts.get((g['device_id'], g['last_timestamp'])), **g)
+        for g in groups
+    ]
+
+
+def _upsert(model, rows, unique_fields):
+    return upsert(model, rows, unique_fields, ROLLUP_FIELDS + ['updated_at'])
+
+
+def refresh_days(pairs):
+    """Re-aggregate the given (device_id, local date) pairs and their months."""
+    by_day = defaultdict(set)
+    for device_id, day in pairs:
+        by_day[day].add(device_id)
+
+    rows = []
+    for day, devices in by_day.items():
+        start, end = day_bounds(day)
+        rows += _daily_rows(SolarHourlyData.objects.filter(
+            device_id__in=devices, timestamp__gte=start, timestamp__lt=end))
+    _upsert(SolarDailyRollup, rows, ['device_id', 'day'])
+
+    refresh_months({(device_id, day.replace(day=1)) for device_id, day in pairs})
+    return len(rows)
+
+
+def refresh_months(pairs):
+    """Re-aggregate the given (device_id, first-of-month date) pairs from daily rollups."""
+    by_month = defaultdict(set)
+    for device_id, month in pairs:
+        by_month[month].add(device_id)
+
+    rows = []
+    for month, devices in by_month.items():
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        rows += _monthly_rows(SolarDailyRollup.objects.filter(
+            device_id__in=devices, day__gte=month, day__lt=next_month))
+    return _upsert(SolarMonthlyRollup, rows, ['device_id', 'month'])
+
+
+def _monthly_rows(qs):
+    groups = list(
+        qs.order_by()
+        .annotate(month=TruncMonth('day'))
+        .values('device_id', 'month')
+        .annotate(
+            power_sum=Sum('power_sum'),
+            power_count=Sum('power_count'),
+            power_min=Min('power_min'),
+            power_max=Max('power_max'),
+            last_timestamp=Max('last_timestamp'),
+        )
+    )
+    lasts = {}
+    wanted = {(g['device_id'], g['last_timestamp']) for g in groups}
+    if wanted:
+        for device_id, ts, power in qs.filter(
+            device_id__in={d for d, _ in wanted},
+            last_timestamp__in={t for _, t in wanted},
+        ).values_list('device_id', 'last_timestamp', 'last_power'):
+            lasts[(device_id, ts)] = power
+    return [
+        SolarMonthlyRollup(last_power=lasts.get((g['device_id'], g['last_timestamp'])), **g)
+        for g in groups
+    ]
+
+
+def after_write(model, objs):
+    """Write-buffer listener: refresh rollups for freshly inserted hourly readings."""
+    if model is not SolarHourlyData or not objs:
+        return
+    refresh_days({(o.device_id, local_day(o.timestamp)) for o in objs})
+
+
+def rebuild(device_ids=None, start=None, end=None, chunk_days=31, log=None):
+    """
+    Recompute rollups from raw data for `device_ids` (all if None) between
+    local dates `start` and `end` (inclusive). Works in `chunk_days` slices
+    so no single query scans the whole table.
+    """
+    raw = SolarHourlyData.objects.all()
+    if device_ids:
+        raw = raw.filter(device_id__in=device_ids)
+    if start is None or end is None:
+        bounds = raw.order_by().aggregate(first=Min('timestamp'), last=Max('timestamp'))
+        if bounds['first'] is None:
+            return 0, 0
+        start = start or local_day(bounds['first'])
+        end = end or local_day(bounds['last'])
+
+    days = 0
+    months = set()
+    cursor = start
+    while cursor <= end:
+        slice_end = min(cursor + timedelta(days=chunk_days - 1), end)
+        lo, _ = day_bounds(cursor)
+        _, hi = day_bounds(slice_end)
+        rows = _daily_rows(raw.filter(timestamp__gte=lo, timestamp__lt=hi))
+        days += _upsert(SolarDailyRollup, rows, ['device_id', 'day'])
+        months.update((r.device_id, r.day.replace(day=1)) for r in rows)
+        if log:
+            log(f"{cursor} .. {slice_end}: {len(rows)} device-days")
+        cursor = slice_end + timedelta(days=1)
+
+    return days, refresh_months(months)
+
+
+def _missing_runs(days, first, last):
+    """(start, end) runs of consecutive days in [first, last] that are not in `days`."""
+    runs = []
+    day = first
+    while day <= last:
+        if day in days:
+            day += timedelta(days=1)
+            continue
+        start = day
+        while day <= last and day not in days:
+            day += timedelta(days=1)
+        runs.append((start, day - timedelta(days=1)))
+    return runs
+
+
+def daily_totals(device_ids, first, last):
+    """
+    {device_id: {local day: power sum}} for days in [first, last]. Days
+    without a daily rollup are summed from their raw readings in one query.
+    """
+    out = {d: {} for d in device_ids}
+    for device_id, day, total in (
+        SolarDailyRollup.objects
+        .filter(device_id__in=device_ids, day__gte=first, day__lte=last)
+        .values_list('device_id', 'day', 'power_sum')
+    ):
+        out[device_id][day] = total
+
+    match = Q()
+    for device_id, days in out.items():
+        for start, end in _missing_runs(days, first, min(last, timezone.localdate())):
+            match |= Q(device_id=device_id, timestamp__gte=day_bounds(start)[0], timestamp__lt=day_bounds(end)[1])
+    if match:
+        for row in (
+            SolarHourlyData.objects.filter(match)
+            .order_by()
+            .annotate(day=TruncDate('timestamp'))
+            .values('device_id', 'day')
+            .annotate(total=Sum('power'))
+        ):
+            out[row['device_id']][row['day']] = row['total']
+    return {d: dict(sorted(days.items())) for d, days in out.items()}
+
+
+def _monthly_sums(device_ids, year):
+    """{(device_id, month): (power sum, reading count, updated_at)} from the monthly rollups of a year."""
+    return {
+        (device_id, month): (total, count, updated)
+        for device_id, month, total, count, updated in (
+            SolarMonthlyRollup.objects
+            .filter(device_id__in=device_ids, month__year=year)
+            .values_list('device_id', 'month', 'power_sum', 'power_count', 'updated_at')
+        )
+    }
+
+
+def monthly_totals(device_ids, year):
+    """
+    {device_id: {first of month: power sum}} for a calendar year, from
+    monthly rollups. A month whose rollup is missing or older than its
+    daily rollups is re-aggregated from them. Rollups follow every stored
+    reading, so a day without one had no readings and counts as zero; only
+    a month with no rollups at all (history never backfilled) is rolled up
+    from its raw readings, once. A month that turns out to have no readings
+    gets an empty rollup so it is not scanned again, and is left out.
+    """
+    monthly = _monthly_sums(device_ids, year)
+    daily = {
+        (row['device_id'], row['month']): row['updated']
+        for row in (
+            SolarDailyRollup.objects
+            .filter(device_id__in=device_ids, day__year=year)
+            .order_by()
+            .annotate(month=TruncMonth('day'))
+            .values('device_id', 'month')
+            .annotate(updated=Max('updated_at'))
+        )
+    }
+    stale = {key for key, updated in daily.items() if key not in monthly or monthly[key][2] < updated}
+    if stale:
+        refresh_months(stale)
+    repaired = bool(stale)
+
+    today = timezone.localdate()
+    for m in range(1, 13):
+        month = date(year, m, 1)
+        if month > today:
+            break
+        missing = [d for d in device_ids if (d, month) not in monthly and (d, month) not in daily]
+        if missing:
+            last = month.replace(day=calendar.monthrange(year, m)[1])
+            rebuild(missing, month, min(last, today))
+            found = set(
+                SolarMonthlyRollup.objects.filter(device_id__in=missing, month=month)
+                .values_list('device_id', flat=True)
+            )
+            _upsert(SolarMonthlyRollup, [
+                SolarMonthlyRollup(device_id=d, month=month) for d in missing if d not in found
+            ], ['device_id', 'month'])
+            repaired = True
+
+    if repaired:
+        monthly = _monthly_sums(device_ids, year)
+    out = {d: {} for d in device_ids}
+    for (device_id, month), (total, count, _updated) in monthly.items():
+        if count:
+            out[device_id][month] = total
+    return {d: dict(sorted(months.items())) for d, months in out.items()}
@@ -0,0 +1,74 @@
+"""
+Single-flight call coalescing
+=============================
+
+When several threads ask for the same key at the same time, only the first
+one (the leader) runs the call; the others wait for the leader and share its
+result or exception. Used by `check_rain` so a burst of devices in one grid
+cell makes a single Open-Meteo request and a single WeatherLog row.
+"""
+
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, timeout=None):
+        """
+        Run `fn()` once per concurrent `key`.
+
+        Returns (result, leader) where `leader` is True for the caller that
+        actually ran `fn`. Waiters re-raise the leader's exception.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"single-flight wait for {key} timed out")
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "inflight": len(self._calls),
+                "waiting": sum(c.waiters for c in self._calls.values()),
+            }
@@ -0,0 +1,236 @@
+"""
+Soiling loss and wash efficacy
+==============================
+
+Estimates, per device, how fast panels lose output to dust and how much a
+wash gets back. Everything is computed for the whole fleet at once on flat
+NumPy arrays; the only per-row Python work is loading the query results.
+
+Inputs, over the last `window_days` local days:
+
+* daily peak power (SolarDailyRollup.power_max, the daily max of the
+  device's SolarHourlyData). The peak tracks panel condition more closely
+  than the daily sum, which mostly follows the weather.
+* wash cycles (WashCycle, the paired before/after WashRecords).
+
+Per device:
+
+* wash_gain_percent - mean (after - before) / before of the wash readings.
+* recovery_percent - mean change in daily peak between the `recovery_days`
+  before and after each wash day, which is less sensitive to the time of day
+  the wash ran.
+* soiling_rate_percent - how fast the peak falls between washes, in % of
+  the starting level per day. A line is fitted to each gap between washes
+  with at least MIN_SEGMENT_DAYS days (from sums built with bincount), and
+  the slopes are averaged, weighted by days.
+* optimal_interval_days - wash interval that minimises wash cost plus the
+  value of energy lost to soiling. With linear soiling at rate r (per day),
+  daily yield E (kWh) and tariff p, the loss over T days is E*p*r*T^2/2, so
+  the cost per day is C/T + E*p*r*T/2, which is lowest at
+  T = sqrt(2C / (E*p*r)). C is SOLAR_WASH_COST.
+
+Days and washes are keyed as device_code * 2**32 + date ordinal, so one
+sorted array covers the fleet and searchsorted/cumsum answer every
+"days around this wash" window in a single pass.
+"""
+
+import logging
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from solar.models import SolarDailyRollup, WashCycle, DeviceLocation, SoilingEstimate
+from solar.services.upsert import upsert
+
+logger = logging.getLogger(__name__)
+
+WINDOW_DAYS = getattr(settings, 'SOLAR_SOILING_WINDOW_DAYS', 180)
+RECOVERY_DAYS = getattr(settings, 'SOLAR_SOILING_RECOVERY_DAYS', 3)
+WASH_COST = getattr(settings, 'SOLAR_WASH_COST', 10.0)  # same currency as DeviceLocation.price
+DEFAULT_PRICE = 5.0
+MIN_SEGMENT_DAYS = 5
+MAX_INTERVAL_DAYS = 365
+KEY_SHIFT = np.int64(2 ** 32)
+
+RESULT_FIELDS = [
+    'window_start', 'window_end', 'days_analyzed', 'washes', 'wash_gain_percent',
+    'recovery_percent', 'soiling_rate_percent', 'daily_yield_kwh', 'optimal_interval_days',
+]
+
+
+def _group_mean(groups, values, size, mask=None):
+    """Mean of `values` per group id (NaN for empty groups)."""
+    if mask is not None:
+        groups, values = groups[mask], values[mask]
+    counts = np.bincount(groups, minlength=size)
+    sums = np.bincount(groups, weights=values, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan), counts
+
+
+def load(device_ids, start, end):
+    """Flat arrays of daily peaks/yields and wash cycles in [start, end]."""
+    days = SolarDailyRollup.objects.filter(day__gte=start, day__lte=end, power_max__isnull=False)
+    washes = (
+        WashCycle.objects
+        .filter(after_timestamp__date__gte=start, after_timestamp__date__lte=end)
+        .annotate(day=TruncDate("after_timestamp"))
+    )
+    if device_ids:
+        days = days.filter(device_id__in=device_ids)
+        washes = washes.filter(device_id__in=device_ids)
+
+    day_rows = list(days.order_by().values_list("device_id", "day", "power_max", "power_sum"))
+    wash_rows = list(washes.order_by().values_list("device_id", "day", "before_power", "after_power"))
+
+    names, codes = np.unique(
+        np.array([r[0] for r in day_rows] + [r[0] for r in wash_rows], dtype=object).astype(str),
+        return_inverse=True,
+    )
+    n_days = len(day_rows)
+    return {
+        "devices": names.tolist(),
+        "day_device": codes[:n_days].astype(np.int64),
+        "day": np.fromiter((r[1].toordinal() for r in day_rows), dtype=np.int64, count=n_days),
+        "peak": np.fromiter((r[2] for r in day_rows), dtype=np.float64, count=n_days),
+        "yield": np.fromiter((r[3] for r in day_rows), dtype=np.float64, count=n_days),
+        "wash_device": codes[n_days:].astype(np.int64),
+        "wash_day": np.fromiter((r[1].toordinal() for r in wash_rows), dtype=np.int64, count=len(wash_rows)),
+        "before": np.fromiter((r[2] for r in wash_rows), dtype=np.float64, count=len(wash_rows)),
+        "after": np.fromiter((r[3] for r in wash_rows), dtype=np.float64, count=len(wash_rows)),
+    }
+
+
+def analyze(data, prices=None, wash_cost=WASH_COST, recovery_days=RECOVERY_DAYS):
+    """Per-device estimates from `load()` arrays, as {device_id: dict}."""
+    devices = data["devices"]
+    size = len(devices)
+    if not size:
+        return {}
+
+    # Days sorted by (device, day); washes likewise
+    day_key = data["day_device"] * KEY_SHIFT + data["day"]
+    order = np.argsort(day_key, kind="stable")
+    day_key, peak = day_key[order], data["peak"][order]
+    day_dev, day_ord = data["day_device"][order], data["day"][order]
+    daily_yield = data["yield"][order]
+
+    wash_key = data["wash_device"] * KEY_SHIFT + data["wash_day"]
+    w_order = np.argsort(wash_key, kind="stable")
+    wash_key, wash_dev = wash_key[w_order], data["wash_device"][w_order]
+    before, after = data["before"][w_order], data["after"][w_order]
+
+    # ----- instant gain of each wash -----
+    valid = before > 0
+    gain = np.zeros_like(before)
+    gain[valid] = (after[valid] - before[valid]) / before[valid]
+    wash_gain, _ = _group_mean(wash_dev, gain, size, mask=valid)
+    washes = np.bincount(wash_dev, minlength=size)
+
+    # ----- daily peak before vs after each wash -----
+    cum = np.concatenate([[0.0], np.cumsum(peak)])
+    pre_lo = np.searchsorted(day_key, wash_key - recovery_days, side="left")
+    pre_hi = np.searchsorted(day_key, wash_key, side="left")
+    post_lo = np.searchsorted(day_key, wash_key + 1, side="left")
+    post_hi = np.searchsorted(day_key, wash_key + recovery_days + 1, side="left")
+    pre_n, post_n = pre_hi - pre_lo, post_hi - post_lo
+    ok = (pre_n > 0) & (post_n > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pre_mean = (cum[pre_hi] - cum[pre_lo]) / pre_n
+        post_mean = (cum[post_hi] - cum[post_lo]) / post_n
+        ok &= pre_mean > 0
+        recovery = np.where(ok, post_mean / pre_mean - 1.0, 0.0)
+    recovery_mean, _ = _group_mean(wash_dev, recovery, size, mask=ok)
+
+    # ----- soiling slope between washes -----
+    # Washes on or before each day; paired with the device it names a gap
+    seg_raw = np.searchsorted(wash_key, day_key, side="right")
+    seg_ids, seg = np.unique(day_dev * (len(wash_key) + 1) + seg_raw, return_inverse=True)
+    n_seg = len(seg_ids)
+    seg_dev = seg_ids // (len(wash_key) + 1)
+
+    seg_start = np.full(n_seg, np.iinfo(np.int64).max)
+    np.minimum.at(seg_start, seg, day_ord)
+    x = (day_ord - seg_start[seg]).astype(np.float64)
+    n = np.bincount(seg, minlength=n_seg).astype(np.float64)
+    sx = np.bincount(seg, weights=x, minlength=n_seg)
+    sy = np.bincount(seg, weights=peak, minlength=n_seg)
+    sxy = np.bincount(seg, weights=x * peak, minlength=n_seg)
+    sxx = np.bincount(seg, weights=x * x, minlength=n_seg)
+    denom = n * sxx - sx * sx
+    fit = (n >= MIN_SEGMENT_DAYS) & (denom > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = np.where(fit, (n * sxy - sx * sy) / denom, 0.0)
+        intercept = np.where(fit, (sy - slope * sx) / n, 0.0)
+        fit &= intercept > 0
+        rate = np.where(fit, -slope / intercept, 0.0)
+    rate_sum = np.bincount(seg_dev[fit], weights=(rate * n)[fit], minlength=size)
+    rate_days = np.bincount(seg_dev[fit], weights=n[fit], minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        soiling = np.where(rate_days > 0, rate_sum / np.maximum(rate_days, 1), np.nan)
+
+    # ----- optimal wash interval -----
+    yield_kwh, days_analyzed = _group_mean(day_dev, daily_yield / 1000.0, size)
+    price = np.array([(prices or {}).get(d, DEFAULT_PRICE) for d in devices], dtype=np.float64)
+    loss_per_day2 = yield_kwh * price * soiling
+    with np.errstate(invalid="ignore", divide="ignore"):
+        interval = np.where(
+            loss_per_day2 > 0,
+            np.minimum(np.sqrt(2.0 * wash_cost / loss_per_day2), MAX_INTERVAL_DAYS),
+            np.nan,
+        )
+
+    def _pct(v):
+        return None if np.isnan(v) else round(float(v) * 100.0, 3)
+
+    def _num(v, digits=2):
+        return None if np.isnan(v) else round(float(v), digits)
+
+    return {
+        device_id: {
+            "days_analyzed": int(days_analyzed[i]),
+            "washes": int(washes[i]),
+            "wash_gain_percent": _pct(wash_gain[i]),
+            "recovery_percent": _pct(recovery_mean[i]),
+            "soiling_rate_percent": _pct(soiling[i]),
+            "daily_yield_kwh": _num(yield_kwh[i], 3),
+            "optimal_interval_days": _num(interval[i], 1),
+        }
+        for i, device_id in enumerate(devices)
+    }
+
+
+def compute(device_ids=None, window_days=WINDOW_DAYS, wash_cost=WASH_COST, save=True):
+    """Estimate soiling for `device_ids` (default: every device with rollups)."""
+    end = timezone.localdate()
+    start = end - timedelta(days=window_days)
+    data = load(device_ids, start, end)
+    prices = dict(
+        DeviceLocation.objects.filter(device_id__in=data["devices"]).values_list("device_id", "price")
+    )
+    results = analyze(data, prices=prices, wash_cost=wash_cost)
+    for result in results.values():
+        result["window_start"] = start
+        result["window_end"] = end
+    if save and results:
+        upsert(SoilingEstimate, [SoilingEstimate(device_id=d, **r) for d, r in results.items()],
+               ['device_id'], RESULT_FIELDS + ['computed_at'])
+    return results
+
+
+def as_dict(estimate):
+    return {
+        "window_start": estimate.window_start.isoformat(),
+        "window_end": estimate.window_end.isoformat(),
+        "days_analyzed": estimate.days_analyzed,
+        "washes": estimate.washes,
+        "wash_gain_percent": estimate.wash_gain_percent,
+        "recovery_percent": estimate.recovery_percent,
+        "soiling_rate_percent": estimate.soiling_rate_percent,
+        "daily_yield_kwh": estimate.daily_yield_kwh,
+        "optimal_interval_days": estimate.optimal_interval_days,
+        "computed_at": estimate.computed_at.isoformat() if estimate.computed_at else None,
+    }
@@ -0,0 +1,213 @@
+"""
+Durable on-disk spool for MQTT readings
+=======================================
+
+When the database is down or the write buffer is full, readings are
+appended to a local spool instead of being lost. The spool is a directory
+of append-only JSON-lines segments:
+
+    000000001.jsonl, 000000002.jsonl, ...
+
+Each append is fsync'd. The active segment rotates after
+SOLAR_SPOOL_SEGMENT_BYTES. `replay()` closes the active segment and
+re-inserts the closed ones oldest-first with `bulk_create`, deleting each
+segment once all of its rows are in the database.
+
+The writer holds an exclusive flock on its active segment, and replay
+only claims segments it can lock, so a replay running in another process
+(the `replay_solar_spool` command) never takes a segment that is still
+being written. Without fcntl, replay leaves the newest segment it did not
+write alone. Rows already present
+(same model, device_id and timestamp) are skipped, so a replay interrupted
+between insert and delete never duplicates data.
+"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections
+
+from solar.services.dedup import new_rows
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DIR = getattr(settings, 'SOLAR_SPOOL_DIR', os.path.join(settings.BASE_DIR, 'solar_spool'))
+SEGMENT_BYTES = getattr(settings, 'SOLAR_SPOOL_SEGMENT_BYTES', 8 * 1024 * 1024)
+
+SEGMENT_SUFFIX = ".jsonl"
+CLAIMED_SUFFIX = ".replaying"
+
+
+def serialize(obj):
+    fields = {}
+    for field in obj._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        value = field.value_from_object(obj)
+        fields[field.attname] = value.isoformat() if hasattr(value, "isoformat") else value
+    return {"model": obj._meta.label, "fields": fields}
+
+
+def deserialize(record):
+    model = apps.get_model(record["model"])
+    values = {}
+    for field in model._meta.concrete_fields:
+        if field.attname in record["fields"]:
+            values[field.attname] = field.to_python(record["fields"][field.attname])
+    return model(**values)
+
+
+class Spool:
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SEGMENT_BYTES):
+        self.directory = Path(directory)
+        self.segment_bytes = int(segment_bytes)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._seq = max((self._number(p) for p in self._segments()), default=0)
+
+        self.spooled = 0
+        self.replayed = 0
+
+    @staticmethod
+    def _number(path):
+        return int(path.name.split(".")[0])
+
+    def _segments(self):
+        paths = [p for p in self.directory.iterdir()
+                 if p.name.endswith(SEGMENT_SUFFIX) or p.name.endswith(CLAIMED_SUFFIX)]
+        return sorted(paths, key=self._number)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._size = 0
+
+    def append(self, objs):
+        """Append unsaved model instances. Returns the number of rows spooled."""
+        if not objs:
+            return 0
+        data = "".join(json.dumps(serialize(o)) + "\n" for o in objs).encode("utf-8")
+        with self._lock:
+            if self._file is None or self._size >= self.segment_bytes:
+                self._rotate()
+                self._seq += 1
+                path = self.directory / f"{self._seq:09d}{SEGMENT_SUFFIX}"
+                self._file = open(path, "ab")
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._size += len(data)
+            self.spooled += len(objs)
+        return len(objs)
+
+    @property
+    def pending(self):
+        """Number of segment files waiting to be replayed."""
+        return len(self._segments())
+
+    def close(self):
+        with self._lock:
+            self._rotate()
+
+    def replay(self, batch_size=500, max_segments=None, on_written=None):
+        """
+        Re-insert spooled rows oldest-first. Stops at the first failed
+        segment so ordering is kept. `on_written(model, objs)` is called
+        after each insert. Returns the number of rows inserted.
+        """
+        if not self._replay_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._lock:
+                self._rotate()
+                own_seq = self._seq
+            segments = self._segments()
+            if fcntl is None and segments and segments[-1].name.endswith(SEGMENT_SUFFIX) \
+                    and self._number(segments[-1]) != own_seq:
+                segments.pop()  # possibly another process's active segment
+            inserted = 0
+            for n, path in enumerate(segments):
+                if max_segments is not None and n >= max_segments:
+                    break
+                if path.name.endswith(SEGMENT_SUFFIX):
+                    claimed = self._claim(path)
+                    if claimed is None:
+                        break  # still being written; newer segments are too
+                    if claimed is False:
+                        continue  # claimed by another process
+                    path = claimed
+                try:
+                    inserted += self._replay_segment(path, batch_size, on_written)
+                except Exception as e:
+                    logger.warning(f"[Spool] replay of {path.name} failed, will retry: {e}")
+                    break
+                path.unlink()
+            self.replayed += inserted
+            return inserted
+        finally:
+            self._replay_lock.release()
+
+    def _claim(self, path):
+        """
+        Rename a closed segment to .replaying. Returns the new path, None if
+        a writer still holds the segment, or False if it has gone.
+        """
+        claimed = path.with_name(f"{self._number(path):09d}{CLAIMED_SUFFIX}")
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return False
+        with f:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                return False
+        return claimed
+
+    def _replay_segment(self, path, batch_size, on_written=None):
+        close_old_connections()
+        by_model = {}
+        with open(path, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    obj = deserialize(json.loads(line))
+                except Exception as e:
+                    # A torn last line after a crash; nothing to recover from it.
+                    logger.warning(f"[Spool] skipping bad record in {path.name}: {e}")
+                    continue
+                by_model.setdefault(type(obj), []).append(obj)
+
+        inserted = 0
+        for model, objs in by_model.items():
+            objs = new_rows(model, objs)
+            model.objects.bulk_create(objs, batch_size=batch_size, ignore_conflicts=True)
+            inserted += len(objs)
+            if on_written and objs:
+                on_written(model, objs)
+        return inserted
+
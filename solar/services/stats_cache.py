@@ -0,0 +1,150 @@
+"""
+Response cache for /api/solar/stats
+===================================
+
+Clients poll the same device_id/period/date many times an hour. Rendered
+responses are kept in the "solar" cache under a key built from the
+normalized query plus two version counters:
+
+* `solar:ver:<device_id>` — bumped by the ingestor (write-buffer listener)
+  whenever readings or wash records for the device are stored. Every
+  response key includes it, so new data invalidates it immediately.
+  Responses also expire after SOLAR_STATS_CACHE_TTL seconds since they
+  carry the live temperature.
+* `solar:hist:<device_id>` — bumped only when a reading lands on an
+  already closed local day (spool replays, late uploads). The series of
+  a closed day/month/year is cached under this version without expiry on
+  a shared cache. On a per-process cache (LocMem) the ingestor's bumps
+  never reach the web workers, so it expires after SOLAR_STATS_SERIES_TTL.
+
+Rebuilding rollups or purging data calls `invalidate()`; with no device
+ids it bumps a global generation that is part of every key.
+
+Each cached response carries an ETag (hash of the body), so a client
+sending If-None-Match gets a 304 with no body while nothing changed.
+
+Counters start at a time-based value, so a counter evicted from the cache
+never comes back at a number that older entries were stored under.
+"""
+
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from solar.models import SolarHourlyData, WashRecord
+from solar.services.rollups import local_day
+from solar.services.weather import cache_is_shared, get_cache
+
+logger = logging.getLogger(__name__)
+
+STATS_CACHE_TTL = getattr(settings, 'SOLAR_STATS_CACHE_TTL', 300)  # seconds
+SERIES_TTL = getattr(settings, 'SOLAR_STATS_SERIES_TTL', 3600)  # seconds, closed periods on a private cache
+GENERATION_KEY = "solar:stats:gen"
+
+
+def version_key(device_id):
+    return f"solar:ver:{device_id}"
+
+
+def history_key(device_id):
+    return f"solar:hist:{device_id}"
+
+
+def _read(cache, key):
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, time.time_ns(), None)
+        value = cache.get(key)
+    return value
+
+
+def _bump(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+
+def versions(device_id):
+    """(generation, data version, history version), or None without a cache."""
+    try:
+        cache = get_cache()
+        vers = (
+            _read(cache, GENERATION_KEY),
+            _read(cache, version_key(device_id)),
+            _read(cache, history_key(device_id)),
+        )
+    except Exception as e:
+        logger.warning(f"[Stats] cache unavailable: {e}")
+        return None
+    return None if None in vers else vers
+
+
+def invalidate(device_ids=None, history=True):
+    """Drop cached stats for `device_ids`, or for every device if None."""
+    try:
+        cache = get_cache()
+        if device_ids is None:
+            _bump(cache, GENERATION_KEY)
+            return
+        for device_id in set(device_ids):
+            _bump(cache, version_key(device_id))
+            if history:
+                _bump(cache, history_key(device_id))
+    except Exception as e:
+        logger.warning(f"[Stats] cache invalidation failed: {e}")
+
+
+def after_write(model, objs):
+    """Write-buffer listener: new data makes the device's cached stats stale."""
+    if model is SolarHourlyData:
+        today = timezone.localdate()
+        devices = {o.device_id for o in objs}
+        late = {o.device_id for o in objs if local_day(o.timestamp) < today}
+        invalidate(devices - late, history=False)
+        invalidate(late)
+    elif model is WashRecord:
+        invalidate({o.device_id for o in objs}, history=False)
+
+
+def response_key(query, vers):
+    gen, ver, _hist = vers
+    return "solar:stats:resp:{}:{}:{}".format(gen, ver, ":".join(str(q) for q in query))
+
+
+def series_key(query, vers):
+    gen, _ver, hist = vers
+    return "solar:stats:series:{}:{}:{}".format(gen, hist, ":".join(str(q) for q in query))
+
+
+def series_timeout():
+    """Timeout for the series of a closed period: none if invalidation reaches every process."""
+    return None if cache_is_shared() else SERIES_TTL
+
+
+def make_etag(body):
+    return '"{}"'.format(hashlib.md5(body).hexdigest())
+
+
+def etag_matches(request, etag):
+    header = request.META.get("HTTP_IF_NONE_MATCH", "")
+    tags = [t.strip() for t in header.split(",")]
+    return etag in tags or "*" in tags or f"W/{etag}" in tags
+
+
+def cache_get(key):
+    try:
+        return get_cache().get(key)
+    except Exception as e:
+        logger.warning(f"[Stats] cache read failed: {e}")
+        return None
+
+
+def cache_set(key, value, timeout=STATS_CACHE_TTL):
+    try:
+        get_cache().set(key, value, timeout)
+    except Exception as e:
+        logger.warning(f"[Stats] cache write failed: {e}")
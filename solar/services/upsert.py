@@ -0,0 +1,25 @@
+"""
+Bulk insert-or-update that works on every backend
+=================================================
+
+`bulk_create(update_conflicts=True, unique_fields=...)` is what the
+rollup, wash-cycle and summary tables use to upsert, but MySQL (the
+production backend) cannot name the conflict target: Django raises
+NotSupportedError as soon as `unique_fields` is passed. There the statement
+becomes INSERT ... ON DUPLICATE KEY UPDATE, which fires on any unique key,
+so the target is left out. Every table upserted here has exactly one
+unique key besides the primary key, so both forms do the same thing.
+"""
+
+from django.db import connections
+
+
+def upsert(model, rows, unique_fields, update_fields, batch_size=500):
+    """Insert `rows`, updating `update_fields` of rows that clash on `unique_fields`."""
+    if not rows:
+        return 0
+    options = {"update_conflicts": True, "update_fields": update_fields}
+    if connections[model.objects.db].features.supports_update_conflicts_with_target:
+        options["unique_fields"] = unique_fields
+    model.objects.bulk_create(rows, batch_size=batch_size, **options)
+    return len(rows)
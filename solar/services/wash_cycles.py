@@ -0,0 +1,181 @@
+"""
+Wash cycle pairing
+==================
+
+A wash is reported as a `before_wash` reading followed by an `after_wash`
+reading. When an AFTER record is written, its predecessor for the same
+device (the latest WashRecord before it) is looked up; if that is a BEFORE
+record the pair is stored as a WashCycle with its gain metrics. Messages
+can arrive out of order, so a BEFORE record is paired the same way with
+its successor when that is an AFTER.
+`get_solar_stats` then reads a single row instead of walking the device's
+whole wash history.
+
+Pairing runs after the insert (as a write-buffer listener), so it also
+works for rows replayed from the spool. Cycles are upserted on
+(device_id, after_timestamp), so pairing the same record twice is harmless.
+"""
+
+import logging
+
+from django.db.models import F, Max, Q, Window
+from django.db.models.functions import RowNumber
+
+from solar.models import WashRecord, WashCycle
+from solar.services.upsert import upsert
+
+logger = logging.getLogger(__name__)
+
+CYCLE_FIELDS = [
+    'before_timestamp', 'before_voltage', 'before_current', 'before_power',
+    'after_voltage', 'after_current', 'after_power',
+    'power_gain', 'gain_percent', 'duration_seconds',
+]
+
+
+def build_cycle(before, after):
+    gain = after.power - before.power
+    return WashCycle(
+        device_id=after.device_id,
+        before_timestamp=before.timestamp,
+        before_voltage=before.voltage,
+        before_current=before.current,
+        before_power=before.power,
+        after_timestamp=after.timestamp,
+        after_voltage=after.voltage,
+        after_current=after.current,
+        after_power=after.power,
+        power_gain=gain,
+        gain_percent=(gain / before.power * 100.0) if before.power else None,
+        duration_seconds=(after.timestamp - before.timestamp).total_seconds(),
+    )
+
+
+def predecessor(record):
+    return (
+        WashRecord.objects
+        .filter(device_id=record.device_id, timestamp__lt=record.timestamp)
+        .order_by('-timestamp')
+        .first()
+    )
+
+
+def successor(record):
+    return (
+        WashRecord.objects
+        .filter(device_id=record.device_id, timestamp__gt=record.timestamp)
+        .order_by('timestamp')
+        .first()
+    )
+
+
+def save_cycles(cycles):
+    return upsert(WashCycle, cycles, ['device_id', 'after_timestamp'], CYCLE_FIELDS)
+
+
+def after_write(model, objs):
+    """Write-buffer listener: pair freshly inserted records with their neighbour."""
+    if model is not WashRecord:
+        return
+    cycles = {}
+    for record in objs:
+        if record.wash_type == 'AFTER':
+            before, after = predecessor(record), record
+        elif record.wash_type == 'BEFORE':
+            before, after = record, successor(record)
+        else:
+            continue
+        if before is not None and after is not None and before.wash_type == 'BEFORE' \
+                and after.wash_type == 'AFTER':
+            cycles[(after.device_id, after.timestamp)] = build_cycle(before, after)
+    save_cycles(list(cycles.values()))
+
+
+def reading_summary(voltage, current, power, timestamp):
+    return {
+        "voltage": voltage,
+        "current": current,
+        "power": power,
+        "timestamp": timestamp.isoformat()
+    }
+
+
+def cycle_summary(cycle):
+    """The `wash` block of the stats response for a WashCycle."""
+    return {
+        "before": reading_summary(cycle.before_voltage, cycle.before_current,
+                                  cycle.before_power, cycle.before_timestamp),
+        "after": reading_summary(cycle.after_voltage, cycle.after_current,
+                                 cycle.after_power, cycle.after_timestamp),
+        "power_gain": round(cycle.power_gain, 2),
+        "gain_percent": round(cycle.gain_percent, 2) if cycle.gain_percent is not None else None,
+    }
+
+
+def recent_pair_summary(device_id, limit=100, records=None):
+    """
+    Fallback for devices without WashCycle rows yet: pair the newest
+    AFTER record among the last `limit` records with a BEFORE just before it.
+    `records` (newest first) skips the query.
+    """
+    wash_data = {'before': None, 'after': None}
+    if records is None:
+        records = list(WashRecord.objects.filter(device_id=device_id).order_by('-timestamp')[:limit])
+    for i, record in enumerate(records):
+        if record.wash_type == 'AFTER' and i + 1 < len(records):
+            prev_record = records[i + 1]
+            if prev_record.wash_type == 'BEFORE':
+                wash_data['after'] = reading_summary(record.voltage, record.current,
+                                                     record.power, record.timestamp)
+                wash_data['before'] = reading_summary(prev_record.voltage, prev_record.current,
+                                                      prev_record.power, prev_record.timestamp)
+                break
+    return wash_data
+
+
+def recent_records(device_ids, limit=100):
+    """{device_id: its last `limit` WashRecords, newest first} in one query."""
+    ranked = (
+        WashRecord.objects.filter(device_id__in=device_ids)
+        .annotate(rank=Window(RowNumber(), partition_by=F('device_id'), order_by=F('timestamp').desc()))
+        .filter(rank__lte=limit)
+        .order_by('device_id', '-timestamp')
+    )
+    out = {d: [] for d in device_ids}
+    for record in ranked:
+        out[record.device_id].append(record)
+    return out
+
+
+def latest_cycles(device_ids):
+    """{device_id: newest WashCycle} in two queries."""
+    newest = (
+        WashCycle.objects.filter(device_id__in=device_ids)
+        .values('device_id')
+        .annotate(last=Max('after_timestamp'))
+    )
+    match = Q()
+    for row in newest:
+        match |= Q(device_id=row['device_id'], after_timestamp=row['last'])
+    if not match:
+        return {}
+    return {c.device_id: c for c in WashCycle.objects.filter(match)}
+
+
+def rebuild(device_ids=None, log=None):
+    """Pair every stored wash record (per device, in time order)."""
+    devices = device_ids or (
+        WashRecord.objects.order_by().values_list('device_id', flat=True).distinct()
+    )
+    total = 0
+    for device_id in devices:
+        cycles = []
+        prev = None
+        for record in WashRecord.objects.filter(device_id=device_id).order_by('timestamp').iterator():
+            if record.wash_type == 'AFTER' and prev is not None and prev.wash_type == 'BEFORE':
+                cycles.append(build_cycle(prev, record))
+            prev = record
+        total += save_cycles(cycles)
+        if log:
+            log(f"{device_id}: {len(cycles)} cycles")
+    return total
@@ -0,0 +1,380 @@
+"""
+Weather lookups for solar wash decisions
+========================================
+
+`check_rain` answers the device's `weather/check` question: did it rain
+enough in the last 24h to skip the wash?
+
+Neighbouring devices get the same precipitation answer, so lookups are
+cached per grid cell. Coordinates are snapped to SOLAR_RAIN_GRID degrees
+and the 24h max rain for the cell is kept for SOLAR_RAIN_CACHE_TTL seconds
+in the "solar" cache. With a shared cache backend every ingestor process
+reuses one Open-Meteo call per cell. Only the max rain is cached; each
+device's own threshold is applied on read.
+
+Concurrent misses for the same cell are coalesced: one thread fetches and
+the rest wait for its answer (see `rain_flight.stats()`).
+
+For fleet-wide bursts the ingestor uses `RainBatcher` instead: misses are
+collected for SOLAR_RAIN_BATCH_WINDOW seconds and looked up with one
+multi-location Open-Meteo request per SOLAR_RAIN_BATCH_SIZE cells.
+"""
+
+import logging
+import threading
+import time
+import traceback
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+
+from solar.models import SolarErrorLog
+from solar.services import metrics, weather_log
+from solar.services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+RAIN_GRID = getattr(settings, 'SOLAR_RAIN_GRID', 0.05)  # degrees
+RAIN_CACHE_TTL = getattr(settings, 'SOLAR_RAIN_CACHE_TTL', 3600)  # seconds
+RAIN_BATCH_WINDOW = getattr(settings, 'SOLAR_RAIN_BATCH_WINDOW', 0.3)  # seconds
+RAIN_BATCH_SIZE = getattr(settings, 'SOLAR_RAIN_BATCH_SIZE', 100)  # locations per request
+CACHE_ALIAS = "solar"
+LOCAL_CACHES = ("LocMemCache", "DummyCache")  # backends private to one process
+
+rain_flight = SingleFlight()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def cache_is_shared():
+    """False if every process has its own "solar" cache (LocMem, Dummy)."""
+    return type(get_cache()).__name__ not in LOCAL_CACHES
+
+
+def snap_to_grid(lat, lon, grid=RAIN_GRID):
+    """Return the centre of the grid cell containing (lat, lon)."""
+    if not grid:
+        return round(lat, 4), round(lon, 4)
+    return round(round(lat / grid) * grid, 4), round(round(lon / grid) * grid, 4)
+
+
+def rain_cache_key(lat, lon, grid=RAIN_GRID):
+    cell_lat, cell_lon = snap_to_grid(lat, lon, grid)
+    return f"solar:rain:{grid}:{cell_lat:.4f}:{cell_lon:.4f}"
+
+
+def parse_max_rain(data):
+    """Max hourly precipitation over the last 24h of an Open-Meteo forecast."""
+    precipitation = data.get("hourly", {}).get("precipitation", [])
+
+    # Last 24 hrs only
+    last_24h = precipitation[:24]
+
+    # Find max rain event
+    return max((float(v) for v in last_24h if v is not None), default=0)
+
+
+def fetch_max_rain_many(coords):
+    """
+    Query Open-Meteo for several (lat, lon) pairs in one request.
+
+    Returns a list of (max_rain, data) in the same order as `coords`, or
+    None if the request failed.
+    """
+    lats = ",".join(str(lat) for lat, _ in coords)
+    lons = ",".join(str(lon) for _, lon in coords)
+    url = (
+        f"https://api.open-meteo.com/v1/forecast"
+        f"?latitude={lats}&longitude={lons}"
+        f"&hourly=precipitation&past_days=1&forecast_days=1"
+    )
+    with metrics.WEATHER_SECONDS.time():
+        r = requests.get(url, timeout=10)
+    if r.status_code != 200:
+        logger.warning(f"[Rain] API request failed with status {r.status_code}")
+        weather_log.record_failure(weather_log.RAIN, coords, r.status_code, r.text)
+        return None
+
+    data = r.json()
+    # A single location comes back as an object, several as a list
+    results = data if isinstance(data, list) else [data]
+    if len(results) != len(coords):
+        logger.warning(f"[Rain] expected {len(coords)} locations, got {len(results)}")
+        weather_log.record_failure(weather_log.RAIN, coords, r.status_code, data)
+        return None
+    return [(parse_max_rain(item), item) for item in results]
+
+
+def fetch_max_rain(lat, lon):
+    """Query Open-Meteo for the 24h max hourly precipitation. Returns (None, None) on error."""
+    results = fetch_max_rain_many([(lat, lon)])
+    if results is None:
+        return None, None
+    return results[0]
+
+
+def fetch_current_many(coords):
+    """
+    Current temperature and weather code for several (lat, lon) pairs in
+    one request. Returns a list of (current, data) in the order of
+    `coords`, where current is {"temperature", "weather_code"}, or None if
+    the request failed.
+    """
+    lats = ",".join(str(lat) for lat, _ in coords)
+    lons = ",".join(str(lon) for _, lon in coords)
+    url = (
+        f"https://api.open-meteo.com/v1/forecast"
+        f"?latitude={lats}&longitude={lons}"
+        f"&current=temperature_2m,weather_code"
+    )
+    with metrics.WEATHER_SECONDS.time():
+        r = requests.get(url, timeout=5)
+    if r.status_code != 200:
+        logger.warning(f"[Weather] API request failed with status {r.status_code}")
+        weather_log.record_failure(weather_log.CURRENT, coords, r.status_code, r.text)
+        return None
+
+    data = r.json()
+    results = data if isinstance(data, list) else [data]
+    if len(results) != len(coords):
+        logger.warning(f"[Weather] expected {len(coords)} locations, got {len(results)}")
+        weather_log.record_failure(weather_log.CURRENT, coords, r.status_code, data)
+        return None
+    out = []
+    for item in results:
+        current = item.get("current", {})
+        out.append(({
+            "temperature": current.get("temperature_2m"),
+            "weather_code": current.get("weather_code"),
+        }, item))
+    return out
+
+
+def check_rain(lat, lon, threshold, device_id=None):
+    """Query Open-Meteo for precipitation. Returns True=skip wash. Fail-safe: False on error."""
+    try:
+        cache = get_cache()
+        key = rain_cache_key(lat, lon)
+        max_rain = cache.get(key)
+        metrics.WEATHER_CACHE.inc(result="miss" if max_rain is None else "hit")
+        if max_rain is not None:
+            skip = max_rain >= threshold
+            logger.info(f"[Rain] cached max={max_rain}mm threshold={threshold}mm")
+            return skip
+
+        def _fetch():
+            cell_lat, cell_lon = snap_to_grid(lat, lon)
+            max_rain, data = fetch_max_rain(cell_lat, cell_lon)
+            if max_rain is not None:
+                cache.set(key, max_rain, RAIN_CACHE_TTL)
+            return max_rain, data
+
+        (max_rain, data), leader = rain_flight.do(key, _fetch, timeout=15)
+        if max_rain is None:
+            return False
+
+        logger.info(f"[Rain] max={max_rain}mm threshold={threshold}mm")
+        skip = max_rain >= threshold
+        if not leader:
+            metrics.WEATHER_COALESCED.inc()
+            return skip
+
+        # One WeatherLog row per cell and hour, raw payload sampled
+        try:
+            weather_log.save([weather_log.build(
+                weather_log.RAIN, snap_to_grid(lat, lon), device_id, lat, lon, data,
+                max_rain=max_rain,
+                skip_wash=skip,
+            )])
+        except Exception as log_err:
+            logger.warning(f"[Rain] WeatherLog save failed: {log_err}")
+
+        return skip
+    except Exception as e:
+        logger.warning(f"[Rain] API error (fail-safe wash allowed): {e}")
+        try:
+            SolarErrorLog.objects.create(
+                device_id=device_id or "unknown",
+                error_type="WEATHER_API",
+                message=str(e),
+                traceback=traceback.format_exc()
+            )
+        except:
+            pass
+        return False
+
+
+class RainBatcher:
+    """
+    Aggregates rain checks from many grid cells into multi-location requests.
+
+    `submit()` answers from the cache when it can. Misses are grouped per
+    cell; a checker already pending or in flight for the same cell just
+    joins it. Every `window` seconds the pending cells are fetched in
+    chunks of `max_locations` and each waiter's callback receives its
+    skip_wash decision (False on any error).
+    """
+
+    def __init__(self, window=RAIN_BATCH_WINDOW, max_locations=RAIN_BATCH_SIZE):
+        self.window = float(window)
+        self.max_locations = max(1, int(max_locations))
+        self._pending = {}      # cache key -> cell dict
+        self._inflight = {}     # cache key -> cell dict being fetched
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+        self.checks = 0
+        self.cache_hits = 0
+        self.requests = 0
+        self.locations = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="solar-rain-batcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=15):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def submit(self, lat, lon, threshold, callback, device_id=None):
+        """Queue a rain check; `callback(skip)` is called exactly once."""
+        key = rain_cache_key(lat, lon)
+        waiter = (device_id, lat, lon, threshold, callback)
+        with self._cond:
+            self.checks += 1
+
+        try:
+            max_rain = get_cache().get(key)
+        except Exception as e:
+            logger.warning(f"[Rain] cache read failed: {e}")
+            max_rain = None
+        metrics.WEATHER_CACHE.inc(result="miss" if max_rain is None else "hit")
+        if max_rain is not None:
+            with self._cond:
+                self.cache_hits += 1
+            self._answer(waiter, max_rain)
+            return
+
+        with self._cond:
+            cell = self._inflight.get(key) or self._pending.get(key)
+            if cell is not None:
+                metrics.WEATHER_COALESCED.inc()
+            else:
+                cell_lat, cell_lon = snap_to_grid(lat, lon)
+                cell = self._pending[key] = {"lat": cell_lat, "lon": cell_lon, "waiters": []}
+                self._cond.notify()
+            answered = "max_rain" in cell
+            if not answered:
+                cell["waiters"].append(waiter)
+        if answered:
+            self._answer(waiter, cell["max_rain"])
+
+    def stats(self):
+        with self._cond:
+            return {
+                "checks": self.checks,
+                "cache_hits": self.cache_hits,
+                "requests": self.requests,
+                "locations": self.locations,
+                "pending": len(self._pending),
+                "inflight": len(self._inflight),
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped and not self._pending:
+                    return
+            if not self._stopped:
+                time.sleep(self.window)
+            with self._cond:
+                cells, self._pending = self._pending, {}
+                self._inflight.update(cells)
+            try:
+                self._flush(cells)
+            except Exception as e:
+                logger.exception(f"[Rain] batch flush failed: {e}")
+            finally:
+                # Cells whose lookup failed still owe their waiters the
+                # fail-safe reply.
+                leftovers = []
+                with self._cond:
+                    for key, cell in cells.items():
+                        self._inflight.pop(key, None)
+                        leftovers += [(w, cell.get("max_rain")) for w in cell["waiters"]]
+                        cell["waiters"] = []
+                for waiter, max_rain in leftovers:
+                    self._answer(waiter, max_rain)
+
+    def _flush(self, cells):
+        items = list(cells.items())
+        for i in range(0, len(items), self.max_locations):
+            chunk = items[i:i + self.max_locations]
+            coords = [(cell["lat"], cell["lon"]) for _, cell in chunk]
+            try:
+                results = fetch_max_rain_many(coords)
+            except Exception as e:
+                logger.warning(f"[Rain] batch API error (fail-safe wash allowed): {e}")
+                self._log_error(chunk, e)
+                results = None
+            with self._cond:
+                self.requests += 1
+                self.locations += len(chunk)
+            if results is None:
+                continue
+
+            cache = get_cache()
+            logs = []
+            for (key, cell), (max_rain, data) in zip(chunk, results):
+                try:
+                    cache.set(key, max_rain, RAIN_CACHE_TTL)
+                except Exception as e:
+                    logger.warning(f"[Rain] cache write failed: {e}")
+                with self._cond:
+                    cell["max_rain"] = max_rain
+                    waiters, cell["waiters"] = cell["waiters"], []
+                first = waiters[0]
+                logs.append(weather_log.build(
+                    weather_log.RAIN, (cell["lat"], cell["lon"]), first[0], first[1], first[2], data,
+                    max_rain=max_rain,
+                    skip_wash=max_rain >= first[3],
+                ))
+                for waiter in waiters:
+                    self._answer(waiter, max_rain)
+            try:
+                weather_log.save(logs)
+            except Exception as log_err:
+                logger.warning(f"[Rain] WeatherLog save failed: {log_err}")
+
+    @staticmethod
+    def _answer(waiter, max_rain):
+        device_id, _lat, _lon, threshold, callback = waiter
+        skip = max_rain is not None and max_rain >= threshold
+        try:
+            callback(skip)
+        except Exception as e:
+            logger.error(f"[Rain] {device_id}: reply failed: {e}")
+
+    @staticmethod
+    def _log_error(chunk, exc):
+        try:
+            SolarErrorLog.objects.create(
+                device_id="unknown",
+                error_type="WEATHER_API",
+                message=f"batch of {len(chunk)} locations: {exc}",
+                traceback=traceback.format_exc()
+            )
+        except Exception:
+            pass
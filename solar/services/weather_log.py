@@ -0,0 +1,116 @@
+"""
+Compact WeatherLog rows
+=======================
+
+WeatherLog used to store the full Open-Meteo JSON for every lookup and was
+the fastest-growing table. Rows are now written through `build()` and
+`save()`:
+
+* Only the extracted columns (temperature, weather_code, max_rain,
+  skip_wash) are stored by default. The raw payload is kept for a random
+  SOLAR_WEATHER_RAW_SAMPLE_RATE share of lookups, and always for failed
+  ones.
+* Rows are keyed by (kind, grid cell, local hour). Repeated lookups of a
+  cell within the hour update its row instead of adding one, so the table
+  grows with cells x hours, not with traffic. Failed requests use their
+  own kind ("rain_failed", "current_failed") so they never overwrite a good
+  row, and are capped at one per cell and hour as well.
+* With SOLAR_WEATHER_RAW_COMPRESS a kept payload goes to `raw_compressed`
+  (zlib-compressed JSON) instead of `raw_response`; `payload()` reads
+  either.
+
+Rows written before this change have no cell/hour and are left alone;
+compaction and purge_weather_logs age them out.
+"""
+
+import json
+import logging
+import random
+import zlib
+
+from django.conf import settings
+from django.utils import timezone
+
+from solar.models import WeatherLog
+from solar.services.upsert import upsert
+
+logger = logging.getLogger(__name__)
+
+RAW_SAMPLE_RATE = getattr(settings, 'SOLAR_WEATHER_RAW_SAMPLE_RATE', 0.01)
+RAW_COMPRESS = getattr(settings, 'SOLAR_WEATHER_RAW_COMPRESS', True)
+MAX_FAILURE_BODY = 4000  # characters of an error response kept
+
+RAIN = "rain"
+CURRENT = "current"
+
+UNIQUE_FIELDS = ['kind', 'cell', 'hour']
+VALUE_FIELDS = ['device_id', 'timestamp', 'lat', 'lon', 'temperature', 'weather_code', 'max_rain', 'skip_wash']
+RAW_FIELDS = ['raw_response', 'raw_compressed']
+
+
+def cell_label(cell):
+    lat, lon = cell
+    return f"{lat:.4f},{lon:.4f}"
+
+
+def hour_of(ts):
+    return timezone.localtime(ts).replace(minute=0, second=0, microsecond=0)
+
+
+def keep_raw(failed=False, rate=RAW_SAMPLE_RATE):
+    return failed or (rate > 0 and random.random() < rate)
+
+
+def encode(data, compress=RAW_COMPRESS):
+    """Model field values holding `data`."""
+    if compress:
+        blob = zlib.compress(json.dumps(data, separators=(",", ":")).encode(), 6)
+        return {"raw_response": None, "raw_compressed": blob}
+    return {"raw_response": data, "raw_compressed": None}
+
+
+def payload(log):
+    """The raw payload kept on a WeatherLog row, or None."""
+    if log.raw_compressed is not None:
+        return json.loads(zlib.decompress(bytes(log.raw_compressed)))
+    return log.raw_response
+
+
+def build(kind, cell, device_id, lat, lon, data=None, failed=False, **values):
+    """Unsaved WeatherLog for a lookup of grid `cell` (the snapped (lat, lon))."""
+    now = timezone.now()
+    raw = encode(data) if data is not None and keep_raw(failed) else {}
+    return WeatherLog(
+        kind=f"{kind}_failed" if failed else kind,
+        cell=cell_label(cell),
+        hour=hour_of(now),
+        timestamp=now,
+        device_id=device_id or "unknown",
+        lat=lat,
+        lon=lon,
+        **values,
+        **raw,
+    )
+
+
+def save(logs):
+    """Insert or update rows by (kind, cell, hour). A row without raw keeps any it already has."""
+    latest = {}
+    for log in logs:
+        latest[(log.kind, log.cell, log.hour)] = log
+    with_raw = [l for l in latest.values() if l.raw_response is not None or l.raw_compressed is not None]
+    without_raw = [l for l in latest.values() if l.raw_response is None and l.raw_compressed is None]
+    upsert(WeatherLog, without_raw, UNIQUE_FIELDS, VALUE_FIELDS)
+    upsert(WeatherLog, with_raw, UNIQUE_FIELDS, VALUE_FIELDS + RAW_FIELDS)
+
+
+def record_failure(kind, coords, status, body):
+    """Keep the response of a failed multi-location request, one row per first cell and hour."""
+    if isinstance(body, str):
+        body = body[:MAX_FAILURE_BODY]
+    try:
+        lat, lon = coords[0]
+        save([build(kind, (lat, lon), None, lat, lon,
+                    data={"status": status, "locations": len(coords), "body": body}, failed=True)])
+    except Exception as e:
+        logger.warning(f"[Weather] WeatherLog save failed: {e}")
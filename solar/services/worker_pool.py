@@ -0,0 +1,154 @@
+"""
+Bounded worker pool for the solar MQTT ingestor
+===============================================
+
+`weather/check` messages used to start one thread each, so a morning burst
+of wash checks opened hundreds of threads, DB connections and Open-Meteo
+requests at once. Jobs now go through a fixed number of worker threads fed
+by a bounded queue.
+
+When the queue is full the overflow policy decides what happens:
+
+    failsafe     the new job is rejected right away
+    drop_oldest  the oldest queued job is rejected to make room
+
+Rejected jobs are handed to `on_reject`, which for weather checks publishes
+the fail-safe `{"skip_wash": false}` reply so the device never waits.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+WORKERS = getattr(settings, 'SOLAR_WEATHER_WORKERS', 8)
+QUEUE_SIZE = getattr(settings, 'SOLAR_WEATHER_QUEUE_SIZE', 200)
+OVERFLOW = getattr(settings, 'SOLAR_WEATHER_OVERFLOW', 'failsafe')
+
+OVERFLOW_POLICIES = ('failsafe', 'drop_oldest')
+
+
+class WorkerPool:
+    """Fixed-size thread pool with a bounded FIFO queue."""
+
+    def __init__(self, handler, on_reject=None, workers=WORKERS, queue_size=QUEUE_SIZE,
+                 overflow=OVERFLOW, name="solar-worker"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.handler = handler
+        self.on_reject = on_reject
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.overflow = overflow
+        self.name = name
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+
+        # Observability counters, read through stats()
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy = 0
+        self.max_depth = 0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self._total_wait = 0.0
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=timeout)
+        self._threads = []
+
+    def submit(self, *args):
+        """Queue a job. Returns False if the job itself was rejected."""
+        dropped = None
+        accepted = True
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                if self.overflow == 'drop_oldest':
+                    dropped = self._queue.popleft()[1]
+                else:
+                    accepted = False
+            if accepted:
+                self._queue.append((time.monotonic(), args))
+                self.submitted += 1
+                self.max_depth = max(self.max_depth, len(self._queue))
+                self._cond.notify()
+
+        if dropped is not None:
+            self._reject(dropped, "dropped oldest")
+        if not accepted:
+            self._reject(args, "queue full")
+        return accepted
+
+    def stats(self):
+        with self._cond:
+            done = self.completed or 1
+            return {
+                "depth": len(self._queue),
+                "max_depth": self.max_depth,
+                "busy": self.busy,
+                "workers": self.workers,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "last_wait_ms": round(self.last_wait * 1000, 1),
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+                "avg_wait_ms": round(self._total_wait / done * 1000, 1),
+            }
+
+    def _reject(self, args, reason):
+        with self._cond:
+            self.rejected += 1
+        logger.warning(f"[{self.name}] job rejected ({reason}), depth={self.depth}")
+        if self.on_reject:
+            try:
+                self.on_reject(*args)
+            except Exception as e:
+                logger.error(f"[{self.name}] reject handler failed: {e}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if self._stopped and not self._queue:
+                    return
+                queued_at, args = self._queue.popleft()
+                wait = time.monotonic() - queued_at
+                self.last_wait = wait
+                self.max_wait = max(self.max_wait, wait)
+                self._total_wait += wait
+                self.busy += 1
+            try:
+                self.handler(*args)
+            except Exception as e:
+                logger.exception(f"[{self.name}] job failed: {e}")
+            finally:
+                # Each worker keeps at most one DB connection; drop it if stale.
+                close_old_connections()
+                with self._cond:
+                    self.busy -= 1
+                    self.completed += 1
@@ -0,0 +1,216 @@
+"""
+Write-behind buffer for the solar MQTT ingestor
+===============================================
+
+`on_message` used to run one INSERT per reading on the paho network thread.
+Readings are now appended to an in-memory buffer and written with
+`bulk_create` from a background flusher thread once the buffer reaches
+`flush_size` rows or the oldest row is `flush_interval` seconds old.
+
+The buffer is bounded by `max_depth` rows. When it is full, `add()` flushes
+inline on the caller's thread, so a slow database applies back-pressure to
+the MQTT loop instead of growing memory without limit.
+
+Listeners added with `add_listener(fn)` are called as `fn(model, objs)`
+after every successful insert, including spool replays; the ingestor uses
+them to keep derived tables (rollups, caches) in step with raw readings.
+
+With a `Spool` attached, a full buffer and any failed bulk insert go to the
+on-disk spool instead, and the flusher thread replays the spool once
+inserts succeed again. The MQTT loop then never waits on the database.
+Rows that overflow a full buffer are spooled in batches of `flush_size`
+(or on the flusher's next tick), so back-pressure costs one fsync per
+batch rather than one per message.
+"""
+
+import logging
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from solar.services import metrics
+from solar.services.dedup import new_rows
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SIZE = getattr(settings, 'SOLAR_INGEST_FLUSH_SIZE', 200)
+FLUSH_INTERVAL = getattr(settings, 'SOLAR_INGEST_FLUSH_INTERVAL', 2.0)  # seconds
+MAX_DEPTH = getattr(settings, 'SOLAR_INGEST_MAX_BUFFER', 10000)
+REPLAY_BACKOFF = 30  # seconds between spool replays after a failure
+
+
+class WriteBuffer:
+    """Groups model instances per model class and bulk-inserts them."""
+
+    def __init__(self, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, max_depth=MAX_DEPTH, spool=None):
+        self.flush_size = max(1, int(flush_size))
+        self.flush_interval = float(flush_interval)
+        self.max_depth = max(self.flush_size, int(max_depth))
+        self.spool = spool
+        self.listeners = []
+        self._next_replay = 0.0
+
+        self._pending = {}          # model class -> [instances]
+        self._overflow = []         # rows waiting to be spooled while the buffer is full
+        self._depth = 0
+        self._oldest = None         # monotonic time of the oldest pending row
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def depth(self):
+        return self._depth
+
+    def add_listener(self, fn):
+        self.listeners.append(fn)
+
+    def _notify(self, model, objs):
+        for fn in self.listeners:
+            try:
+                fn(model, objs)
+            except Exception as e:
+                logger.error(f"[Buffer] listener {getattr(fn, '__name__', fn)} failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="solar-write-buffer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the flusher thread and write whatever is still pending."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(self.flush_interval * 2, 5))
+            self._thread = None
+        self.spool_overflow()
+        self.flush()
+
+    def add(self, obj):
+        """Queue an unsaved model instance for insertion."""
+        with self._lock:
+            full = self._depth >= self.max_depth
+            if not full:
+                self._pending.setdefault(type(obj), []).append(obj)
+                self._depth += 1
+                if self._oldest is None:
+                    self._oldest = time.monotonic()
+                if self._depth >= self.flush_size:
+                    self._wakeup.set()
+
+        if full:
+            if self.spool is not None:
+                with self._lock:
+                    self._overflow.append(obj)
+                    batch_full = len(self._overflow) >= self.flush_size
+                if batch_full:
+                    self.spool_overflow()
+                return
+            # Back-pressure: write synchronously, then queue the new row.
+            logger.warning(f"[Buffer] full at {self.max_depth} rows, flushing inline")
+            self.flush()
+            self.add(obj)
+
+    def spool_overflow(self):
+        """Spool the rows that overflowed the buffer, with one append. Returns the number of rows."""
+        with self._lock:
+            batch, self._overflow = self._overflow, []
+        if batch:
+            self.spool.append(batch)
+            metrics.SPOOLED_ROWS.inc(len(batch))
+        return len(batch)
+
+    def flush(self):
+        """Write every pending row. Returns the number of rows inserted."""
+        with self._flush_lock:
+            with self._lock:
+                batches, self._pending = self._pending, {}
+                self._depth = 0
+                self._oldest = None
+                self._wakeup.clear()
+
+            written = 0
+            if not batches:
+                return written
+
+            close_old_connections()
+            for model, objs in batches.items():
+                try:
+                    with metrics.DB_WRITE_SECONDS.time():
+                        # Redelivered readings that got past the LRU; listeners only see new rows
+                        fresh = new_rows(model, objs)
+                        model.objects.bulk_create(fresh, batch_size=self.flush_size, ignore_conflicts=True)
+                    if len(fresh) < len(objs):
+                        metrics.DUPLICATES.inc(len(objs) - len(fresh), type="stored")
+                    written += len(fresh)
+                    metrics.DB_ROWS.inc(len(fresh), model=model.__name__)
+                    if fresh:
+                        self._notify(model, fresh)
+                except Exception as e:
+                    logger.error(f"[Buffer] bulk insert of {len(objs)} {model.__name__} rows failed: {e}")
+                    metrics.DB_WRITE_FAILURES.inc(model=model.__name__)
+                    if self.spool is not None:
+                        self.spool.append(objs)
+                        metrics.SPOOLED_ROWS.inc(len(objs))
+                        self._next_replay = time.monotonic() + REPLAY_BACKOFF
+                    else:
+                        self._log_error(model, objs, e)
+            return written
+
+    def replay_spool(self):
+        """Drain one spool segment back into the database if it is healthy."""
+        if self.spool is None or time.monotonic() < self._next_replay or not self.spool.pending:
+            return 0
+        with self._flush_lock:
+            try:
+                n = self.spool.replay(batch_size=self.flush_size, max_segments=1, on_written=self._notify)
+            except Exception as e:
+                logger.warning(f"[Buffer] spool replay failed: {e}")
+                n = 0
+            if self.spool.pending and not n:
+                self._next_replay = time.monotonic() + REPLAY_BACKOFF
+        if n:
+            logger.info(f"[Buffer] replayed {n} spooled rows")
+        return n
+
+    def _due(self):
+        with self._lock:
+            if self._depth >= self.flush_size:
+                return True
+            return self._oldest is not None and time.monotonic() - self._oldest >= self.flush_interval
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(timeout=min(self.flush_interval, 1.0))
+            if self._stopped.is_set():
+                break
+            if self._due():
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.exception(f"[Buffer] flush error: {e}")
+            else:
+                self._wakeup.clear()
+            if self._overflow:
+                self.spool_overflow()
+            self.replay_spool()
+
+    @staticmethod
+    def _log_error(model, objs, exc):
+        try:
+            from solar.models import SolarErrorLog
+            SolarErrorLog.objects.create(
+                device_id=getattr(objs[0], "device_id", None) or "unknown",
+                error_type="DB_BULK_WRITE",
+                message=f"{model.__name__} x{len(objs)}: {exc}",
+                traceback=traceback.format_exc()
+            )
+        except Exception:
+            pass
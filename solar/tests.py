@@ -1,3 +1,957 @@
-from django.test import TestCase
+import io
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import (
+    SolarHourlyData, SolarDailyRollup, SolarMonthlyRollup, WashCycle, WashRecord, DeviceLocation, WeatherLog,
+    SoilingEstimate, PerformanceSummary,
+)
+from . import views
+from .services import (
+    current_weather, downsample, fleet, live, metrics, partitions, performance, rollups, soiling, stats_cache,
+    wash_cycles, weather, weather_log,
+)
+from .management.commands.run_solar_mqtt import subscription_topics
+from .services.anomaly import AnomalyDetector
+from .services.archive import Archive
+from .services.compaction import Compactor
+from .services.dedup import RecentKeys, parse_device_time, reading_key
+from .services.ingestor import Ingestor
+from .services.single_flight import SingleFlight
+from .services.spool import Spool
+from .services.upsert import upsert
+from .services.weather import get_cache
+from .services.worker_pool import WorkerPool
+from .services.write_buffer import WriteBuffer
+
+
+def reading(device_id, ts, power):
+    return SolarHourlyData(device_id=device_id, timestamp=ts, voltage=12, current=1, power=power, energy=power)
+
+
+def local_dt(*args):
+    return timezone.make_aware(datetime(*args))
+
+
+class RollupUpsertTests(TestCase):
+    def _reading(self, hour, power):
+        return SolarHourlyData(device_id="D1", timestamp=local_dt(2025, 3, 4, hour),
+                               voltage=12, current=1, power=power, energy=power)
+
+    def test_refresh_updates_existing_rollups(self):
+        SolarHourlyData.objects.bulk_create([self._reading(10, 100), self._reading(11, 200)])
+        rollups.refresh_days({("D1", datetime(2025, 3, 4).date())})
+        self._reading(12, 50).save()
+        rollups.refresh_days({("D1", datetime(2025, 3, 4).date())})
+
+        day = SolarDailyRollup.objects.get(device_id="D1")
+        self.assertEqual((day.power_sum, day.power_count, day.last_power), (350, 3, 50))
+        self.assertEqual(SolarMonthlyRollup.objects.get(device_id="D1").power_sum, 350)
+
+    def test_no_conflict_target_without_backend_support(self):
+        # MySQL: ON DUPLICATE KEY UPDATE cannot name the unique key
+        rows = [SolarDailyRollup(device_id="D1", day=datetime(2025, 3, 4).date())]
+        with mock.patch.object(connection.features, "supports_update_conflicts_with_target", False), \
+                mock.patch.object(SolarDailyRollup.objects, "bulk_create") as bulk_create:
+            self.assertEqual(upsert(SolarDailyRollup, rows, ["device_id", "day"], ["power_sum"]), 1)
+        kwargs = bulk_create.call_args.kwargs
+        self.assertNotIn("unique_fields", kwargs)
+        self.assertTrue(kwargs["update_conflicts"])
+        self.assertEqual(kwargs["update_fields"], ["power_sum"])
+
+    def test_conflict_target_when_supported(self):
+        rows = [SolarDailyRollup(device_id="D1", day=datetime(2025, 3, 4).date())]
+        with mock.patch.object(SolarDailyRollup.objects, "bulk_create") as bulk_create:
+            upsert(SolarDailyRollup, rows, ["device_id", "day"], ["power_sum"])
+        self.assertEqual(bulk_create.call_args.kwargs["unique_fields"], ["device_id", "day"])
+
+
+class WriteBufferDedupTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.buffer = WriteBuffer(flush_size=10)
+        self.seen = []
+        self.buffer.add_listener(lambda model, objs: self.seen.append(len(objs)))
+        self.buffer.add_listener(rollups.after_write)
+        self.buffer.add_listener(live.after_write)
+        self.hour = timezone.localtime().replace(minute=0, second=0, microsecond=0)
+
+    def test_redelivered_reading_counted_once(self):
+        self.buffer.add(reading("D1", self.hour, 100))
+        self.assertEqual(self.buffer.flush(), 1)
+        # The same reading again (restart, shared subscription) plus a repeat within the batch
+        self.buffer.add(reading("D1", self.hour, 100))
+        self.buffer.add(reading("D2", self.hour, 40))
+        self.buffer.add(reading("D2", self.hour, 40))
+        self.assertEqual(self.buffer.flush(), 1)
+
+        self.assertEqual(self.seen, [1, 1])
+        self.assertEqual(SolarHourlyData.objects.count(), 2)
+        self.assertEqual(live.get_today_yields(["D1", "D2"]), {"D1": 100, "D2": 40})
+        self.assertEqual(get_cache().get(live.today_key("D1", timezone.localdate())), 100000)
+
+
+class WriteBufferFlushTests(TestCase):
+    def _readings(self, n):
+        return [reading("D1", local_dt(2025, 3, 4, 0) + timedelta(minutes=m), m) for m in range(n)]
+
+    def _wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return condition()
+
+    def test_flushes_on_size(self):
+        buffer = WriteBuffer(flush_size=3, flush_interval=60)
+        with mock.patch.object(buffer, "flush") as flush:
+            buffer.start()
+            for obj in self._readings(2):
+                buffer.add(obj)
+            self.assertFalse(buffer._due())
+            buffer.add(self._readings(3)[-1])
+            self.assertTrue(self._wait_for(lambda: flush.called))
+            buffer.stop()
+
+    def test_flushes_on_interval(self):
+        buffer = WriteBuffer(flush_size=100, flush_interval=60)
+        buffer.add(self._readings(1)[0])
+        self.assertFalse(buffer._due())
+        later = time.monotonic() + 61
+        with mock.patch("solar.services.write_buffer.time.monotonic", return_value=later):
+            self.assertTrue(buffer._due())
+
+    def test_full_buffer_flushes_inline(self):
+        buffer = WriteBuffer(flush_size=2, max_depth=2)
+        readings = self._readings(3)
+        buffer.add(readings[0])
+        buffer.add(readings[1])
+        with self.assertLogs("solar.services.write_buffer", "WARNING"):
+            buffer.add(readings[2])
+        self.assertEqual(SolarHourlyData.objects.count(), 2)
+        self.assertEqual(buffer.depth, 1)
+        self.assertEqual(buffer.flush(), 1)
+
+
+class LiveTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.hour = timezone.localtime().replace(minute=0, second=0, microsecond=0)
+
+    def test_latest_many_reads_through(self):
+        live.set_latest("D1", {"power": 1})
+        SolarHourlyData.objects.bulk_create([
+            reading("D2", self.hour - timedelta(hours=1), 20),
+            reading("D2", self.hour, 30),
+        ])
+        cache = get_cache()
+        with mock.patch.object(cache, "set_many", wraps=cache.set_many) as set_many:
+            latest = live.get_latest_many(["D1", "D2", "D3"])
+        self.assertEqual(latest["D1"], {"power": 1})
+        self.assertEqual(latest["D2"]["power"], 30)
+        self.assertIsNone(latest["D3"])
+        # Values read from the database are cached for the short fallback TTL only
+        set_many.assert_called_once_with({live.latest_key("D2"): latest["D2"]}, live.FALLBACK_TTL)
+        with self.assertNumQueries(0):
+            self.assertEqual(live.get_latest("D2"), latest["D2"])
+
+    def test_latest_fallback_ttl(self):
+        SolarHourlyData.objects.bulk_create([reading("D1", self.hour, 30)])
+        cache = get_cache()
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            self.assertEqual(live.get_latest("D1")["power"], 30)
+        cache_set.assert_called_once_with(live.latest_key("D1"), mock.ANY, live.FALLBACK_TTL)
+
+    def test_today_yield_cache_then_rollup_then_raw(self):
+        today = timezone.localdate()
+        SolarHourlyData.objects.bulk_create([reading("D1", self.hour, 30), reading("D2", self.hour, 40)])
+        SolarDailyRollup.objects.create(device_id="D1", day=today, power_sum=25, power_count=1)
+        get_cache().set(live.today_key("D1", today), 10000)
+
+        self.assertEqual(live.get_today_yield("D1"), 10)
+        self.assertEqual(live.get_today_yields(["D1", "D2", "D3"]), {"D1": 10, "D2": 40, "D3": 0})
+        get_cache().delete(live.today_key("D1", today))
+        self.assertEqual(live.get_today_yield("D1"), 25)  # the rollup, not the raw 30
+        self.assertEqual(live.get_today_yield("D2"), 40)
+        self.assertEqual(live.get_today_yields(["D1", "D2"]), {"D1": 25, "D2": 40})
+
+
+class CompactionTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.compactor = Compactor(raw_days=10, wash_days=10, batch_size=1, pause=0, log=lambda msg: None)
+        self.old = local_dt(*self.compactor.cutoff(20).timetuple()[:3], 9)
+
+    def _wash(self, device_id, wash_type, minutes, power):
+        return WashRecord.objects.create(device_id=device_id, wash_type=wash_type, voltage=12, current=1,
+                                         power=power, timestamp=self.old + timedelta(minutes=minutes))
+
+    def test_collapse_keeps_energy_sum(self):
+        SolarHourlyData.objects.bulk_create([
+            reading("D1", self.old + timedelta(minutes=m), power) for m, power in ((0, 100), (20, 200), (40, 300))
+        ])
+        self.compactor.compact_readings()
+        row = SolarHourlyData.objects.get(device_id="D1")
+        self.assertEqual((row.power, row.energy), (200, 600))
+        # The rollup was built from the raw readings before collapsing
+        self.assertEqual(SolarDailyRollup.objects.get(device_id="D1").power_sum, 600)
+
+    def test_wash_pairs_across_batches(self):
+        self._wash("D1", "BEFORE", 0, 50)
+        self._wash("D2", "BEFORE", 1, 40)
+        self._wash("D1", "AFTER", 30, 80)
+        # D2's AFTER lands past the cutoff and is kept
+        WashRecord.objects.create(device_id="D2", wash_type="AFTER", voltage=12, current=1, power=60,
+                                  timestamp=timezone.now())
+        self.compactor.compact_wash()
+
+        self.assertEqual(WashRecord.objects.count(), 1)
+        gains = dict(WashCycle.objects.values_list("device_id", "power_gain"))
+        self.assertEqual(gains, {"D1": 30, "D2": 20})
+
+
+class WashPairingTests(TestCase):
+    def _write(self, *records):
+        objs = [WashRecord(device_id="D1", wash_type=wash_type, voltage=12, current=1, power=power,
+                           timestamp=local_dt(2025, 3, 4, 10, minute)) for wash_type, minute, power in records]
+        WashRecord.objects.bulk_create(objs)
+        wash_cycles.after_write(WashRecord, objs)
+
+    def test_after_pairs_with_preceding_before(self):
+        self._write(("BEFORE", 0, 50))
+        self.assertFalse(WashCycle.objects.exists())
+        self._write(("AFTER", 30, 80))
+        cycle = WashCycle.objects.get()
+        self.assertEqual((cycle.power_gain, cycle.gain_percent, cycle.duration_seconds), (30, 60, 1800))
+
+    def test_before_arriving_after_its_after(self):
+        self._write(("AFTER", 30, 80))
+        self.assertFalse(WashCycle.objects.exists())
+        self._write(("BEFORE", 0, 50))
+        self.assertEqual(WashCycle.objects.get().before_timestamp, local_dt(2025, 3, 4, 10, 0))
+
+    def test_pair_in_one_batch_stored_once(self):
+        self._write(("BEFORE", 0, 50), ("AFTER", 30, 80))
+        self.assertEqual(WashCycle.objects.count(), 1)
+
+    def test_unpaired_records(self):
+        self._write(("AFTER", 0, 80), ("AFTER", 30, 90), ("BEFORE", 40, 50))
+        self.assertFalse(WashCycle.objects.exists())
+
+
+class PartitionRollupTests(TestCase):
+    def setUp(self):
+        SolarHourlyData.objects.bulk_create([
+            reading("D1", local_dt(2025, 3, 4, 10), 100),
+            reading("D1", local_dt(2025, 3, 5, 10), 200),
+        ])
+
+    def test_missing_rollups_are_built(self):
+        self.assertEqual(partitions.ensure_rollups("p202503"), [])
+        self.assertEqual(SolarDailyRollup.objects.filter(device_id="D1").count(), 2)
+        self.assertEqual(SolarMonthlyRollup.objects.get(device_id="D1").power_sum, 300)
+
+    def test_reports_days_still_missing(self):
+        with mock.patch.object(rollups, "refresh_days"), mock.patch.object(rollups, "refresh_months"):
+            missing = partitions.ensure_rollups("p202503")
+        self.assertEqual([day.day for _, day in missing], [4, 5])
+
+
+class RollupFallbackTests(TestCase):
+    def setUp(self):
+        SolarHourlyData.objects.bulk_create([
+            reading("D1", local_dt(2025, 3, 4, 10), 100),
+            reading("D1", local_dt(2025, 3, 4, 11), 50),
+        ])
+        rollups.refresh_days({("D1", datetime(2025, 3, 4).date())})
+        # Older history that was never rolled up
+        SolarHourlyData.objects.bulk_create([
+            reading("D1", local_dt(2025, 3, 2, 10), 70),
+            reading("D1", local_dt(2025, 2, 10, 10), 30),
+        ])
+
+    def test_days_without_rollup_read_raw(self):
+        days = rollups.daily_totals(["D1", "D2"], datetime(2025, 3, 1).date(), datetime(2025, 3, 31).date())
+        self.assertEqual(days["D1"], {datetime(2025, 3, 2).date(): 70, datetime(2025, 3, 4).date(): 150})
+        self.assertEqual(days["D2"], {})
+
+    def test_months_without_rollups_are_rolled_up_once(self):
+        months = rollups.monthly_totals(["D1"], 2025)["D1"]
+        # March has rollups, so its other days count as zero; February had none at all
+        self.assertEqual(months, {datetime(2025, 2, 1).date(): 30, datetime(2025, 3, 1).date(): 150})
+        self.assertEqual(SolarDailyRollup.objects.get(day=datetime(2025, 2, 10).date()).power_sum, 30)
+        # Empty months are stored as known zeros, so nothing is scanned again
+        with mock.patch.object(rollups, "rebuild") as rebuild, self.assertNumQueries(2):
+            self.assertEqual(rollups.monthly_totals(["D1"], 2025)["D1"], months)
+        rebuild.assert_not_called()
+
+    def test_stale_month_is_reaggregated_from_daily_rollups(self):
+        rollups.monthly_totals(["D1"], 2025)
+        SolarDailyRollup.objects.create(device_id="D1", day=datetime(2025, 3, 2).date(), power_sum=70, power_count=1)
+        SolarMonthlyRollup.objects.filter(month=datetime(2025, 3, 1).date()).update(
+            updated_at=timezone.now() - timedelta(minutes=1))
+        with CaptureQueriesContext(connection) as queries:
+            months = rollups.monthly_totals(["D1"], 2025)["D1"]
+        self.assertEqual(months[datetime(2025, 3, 1).date()], 220)
+        raw_table = SolarHourlyData._meta.db_table
+        self.assertFalse([q["sql"] for q in queries.captured_queries if raw_table in q["sql"]])
+
+
+class FleetTotalsTests(TestCase):
+    def test_totals_rounded_once(self):
+        get_cache().clear()
+        SolarHourlyData.objects.bulk_create([
+            reading("D1", local_dt(2025, 3, 4, 10), 1.004),
+            reading("D2", local_dt(2025, 3, 4, 10), 1.004),
+        ])
+        devices, totals = fleet.fleet_stats(["D1", "D2"], "day", "2025-03-04")
+        self.assertEqual(devices["D1"]["period_yield"], 1.0)
+        self.assertEqual(totals["period_yield"], 2.01)
+
+
+class RainBatcherTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.answers = []
+        self.fetch = mock.patch.object(weather, "fetch_max_rain_many",
+                                       side_effect=lambda coords: [(5.0, {}) for _ in coords])
+
+    def _submit(self, batcher, lat, lon, threshold):
+        batcher.submit(lat, lon, threshold, lambda skip: self.answers.append((lat, lon, threshold, skip)))
+
+    def _flush(self, batcher):
+        # One pass of the batcher thread, without the thread
+        cells, batcher._pending = batcher._pending, {}
+        batcher._flush(cells)
+
+    def test_same_cell_checks_share_one_lookup(self):
+        batcher = weather.RainBatcher(window=0, max_locations=10)
+        with self.fetch as fetch:
+            self._submit(batcher, 20.001, 75.001, 3)
+            self._submit(batcher, 20.002, 75.002, 10)
+            self._submit(batcher, 21.0, 76.0, 3)
+            self._flush(batcher)
+        fetch.assert_called_once()
+        self.assertEqual(len(fetch.call_args.args[0]), 2)
+        self.assertEqual(sorted(skip for *_, skip in self.answers), [False, True, True])
+
+        # Answered from the cache from now on
+        self._submit(batcher, 20.003, 75.003, 3)
+        self.assertEqual(batcher.stats()["cache_hits"], 1)
+        self.assertTrue(self.answers[-1][-1])
+
+    def test_cells_split_into_requests_of_max_locations(self):
+        batcher = weather.RainBatcher(window=0, max_locations=1)
+        with self.fetch as fetch:
+            self._submit(batcher, 20.0, 75.0, 3)
+            self._submit(batcher, 21.0, 76.0, 3)
+            self._flush(batcher)
+        self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(batcher.stats()["requests"], 2)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def _run_concurrently(self, flight, fn, callers=4):
+        release = threading.Event()
+        results = []
+
+        def call():
+            try:
+                results.append(flight.do("cell", fn(release), timeout=5))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        while flight.stats()["waiting"] < callers - 1:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        calls = []
+
+        def fetch(release):
+            def run():
+                calls.append(1)
+                release.wait(5)
+                return 42
+            return run
+
+        results = self._run_concurrently(flight, fetch)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [(42, False)] * 3 + [(42, True)])
+        self.assertEqual((flight.leaders, flight.coalesced), (1, 3))
+        self.assertEqual(flight.stats()["inflight"], 0)
+
+    def test_error_reaches_every_waiter(self):
+        flight = SingleFlight()
+
+        def fail(release):
+            def run():
+                release.wait(5)
+                raise ConnectionError("open-meteo down")
+            return run
+
+        results = self._run_concurrently(flight, fail, callers=3)
+        self.assertEqual([type(r) for r in results], [ConnectionError] * 3)
+        self.assertEqual(flight.coalesced, 2)
+        # The next call starts a fresh flight
+        self.assertEqual(flight.do("cell", lambda: 1), (1, True))
+
+
+class CheckRainTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+
+    def test_coordinates_snap_to_cell_centre(self):
+        self.assertEqual(weather.snap_to_grid(20.026, 75.074, 0.05), (20.05, 75.05))
+        self.assertEqual(weather.rain_cache_key(20.001, 75.001, 0.05), weather.rain_cache_key(20.02, 74.98, 0.05))
+        self.assertNotEqual(weather.rain_cache_key(20.001, 75.001, 0.05), weather.rain_cache_key(20.03, 75.0, 0.05))
+
+    def test_cell_answered_from_cache_within_ttl(self):
+        with mock.patch.object(weather, "fetch_max_rain", return_value=(5.0, {})) as fetch:
+            self.assertTrue(weather.check_rain(20.001, 75.001, 3, "D1"))
+            self.assertFalse(weather.check_rain(20.002, 75.002, 10, "D2"))
+        fetch.assert_called_once_with(*weather.snap_to_grid(20.001, 75.001))
+        self.assertEqual(WeatherLog.objects.filter(kind=weather_log.RAIN).count(), 1)
+
+    def test_expired_cell_is_fetched_again(self):
+        with mock.patch.object(weather, "RAIN_CACHE_TTL", 0), \
+                mock.patch.object(weather, "fetch_max_rain", return_value=(5.0, {})) as fetch:
+            weather.check_rain(20.001, 75.001, 3, "D1")
+            weather.check_rain(20.002, 75.002, 3, "D2")
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_nearby_devices_share_one_fetch(self):
+        release = threading.Event()
+
+        def slow_fetch(lat, lon):
+            release.wait(5)
+            return 5.0, {}
+
+        answers = []
+        with mock.patch.object(weather, "fetch_max_rain", side_effect=slow_fetch) as fetch, \
+                mock.patch.object(weather_log, "save"):
+            threads = [threading.Thread(target=lambda lat, lon: answers.append(weather.check_rain(lat, lon, 3)),
+                                        args=coords) for coords in ((20.001, 75.001), (20.004, 74.996))]
+            for thread in threads:
+                thread.start()
+                while thread is threads[0] and not weather.rain_flight.stats()["inflight"]:
+                    time.sleep(0.001)
+            while weather.rain_flight.stats()["waiting"] < 1:
+                time.sleep(0.001)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        fetch.assert_called_once()
+        self.assertEqual(answers, [True, True])
+
+
+class PartitionTests(SimpleTestCase):
+    def test_owns_splits_devices_by_crc32(self):
+        devices = [f"D{i}" for i in range(200)]
+        workers = [Ingestor(partitions=3, partition_index=i) for i in range(3)]
+        owners = [[w.owns(d) for w in workers].count(True) for d in devices]
+        self.assertEqual(set(owners), {1})
+        self.assertEqual(workers[zlib.crc32(b"D7") % 3].owns("D7"), True)
+        # Every worker gets a share
+        self.assertTrue(all(any(w.owns(d) for d in devices) for w in workers))
+
+    def test_owns_everything_without_partitioning(self):
+        self.assertTrue(Ingestor().owns("D1"))
+        self.assertTrue(Ingestor(partitions=1, partition_index=0).owns("D1"))
+
+    def test_shared_subscription_topics(self):
+        self.assertEqual(subscription_topics(), ["solar/+/data/#", "solar/+/weather/check"])
+        self.assertEqual(subscription_topics("ingest"),
+                         ["$share/ingest/solar/+/data/#", "$share/ingest/solar/+/weather/check"])
+
+
+class WorkerPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.handled = []
+        self.rejected = []
+
+    def _pool(self, overflow):
+        # Not started: jobs stay queued until start()
+        return WorkerPool(self.handled.append, on_reject=self.rejected.append,
+                          workers=1, queue_size=2, overflow=overflow)
+
+    def test_failsafe_rejects_the_new_job(self):
+        pool = self._pool("failsafe")
+        with self.assertLogs("solar.services.worker_pool", "WARNING"):
+            self.assertEqual([pool.submit(i) for i in range(3)], [True, True, False])
+        self.assertEqual(self.rejected, [2])
+        pool.start()
+        pool.stop()
+        self.assertEqual(self.handled, [0, 1])
+        self.assertEqual(pool.stats()["rejected"], 1)
+
+    def test_drop_oldest_keeps_the_newest_jobs(self):
+        pool = self._pool("drop_oldest")
+        with self.assertLogs("solar.services.worker_pool", "WARNING"):
+            self.assertTrue(all(pool.submit(i) for i in range(3)))
+        self.assertEqual(self.rejected, [0])
+        pool.start()
+        pool.stop()
+        self.assertEqual(self.handled, [1, 2])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self._pool("block")
+
+
+class SpoolTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.spool = Spool(tmp.name, segment_bytes=200)
+        self.written = []
+
+    def _readings(self, *hours):
+        return [reading("D1", local_dt(2025, 3, 4, h), 10 * h) for h in hours]
+
+    def test_replay_inserts_oldest_first_and_removes_segments(self):
+        self.spool.append(self._readings(1, 2))
+        self.spool.append(self._readings(3))
+        self.assertEqual(self.spool.pending, 2)  # rotated past segment_bytes
+
+        n = self.spool.replay(on_written=lambda model, objs: self.written.append([o.power for o in objs]))
+        self.assertEqual(n, 3)
+        self.assertEqual(self.written, [[10, 20], [30]])
+        self.assertEqual(self.spool.pending, 0)
+        self.assertEqual(SolarHourlyData.objects.count(), 3)
+
+    def test_replay_skips_stored_rows_and_torn_lines(self):
+        SolarHourlyData.objects.bulk_create(self._readings(1))
+        self.spool.append(self._readings(1, 2))
+        path = self.spool._segments()[0]
+        with open(path, "ab") as f:
+            f.write(b'{"model": "solar.SolarHourlyData", "fie')  # crash mid-write
+
+        with self.assertLogs("solar.services.spool", "WARNING"):
+            self.assertEqual(self.spool.replay(), 1)
+        self.assertEqual(sorted(SolarHourlyData.objects.values_list("power", flat=True)), [10, 20])
+        self.assertFalse(path.exists())
+
+    def test_replay_leaves_another_writers_active_segment(self):
+        writer = Spool(self.spool.directory, segment_bytes=10 ** 6)
+        self.addCleanup(writer.close)
+        writer.append(self._readings(1))
+
+        other = Spool(self.spool.directory)
+        self.assertEqual(other.replay(), 0)
+        self.assertEqual(other.pending, 1)
+        writer.append(self._readings(2))  # still appending to the same segment
+        writer.close()
+        self.assertEqual(other.replay(), 2)
+
+    def test_replay_command_walks_worker_directories(self):
+        Spool(self.spool.directory / "worker-0").append(self._readings(1))
+        Spool(self.spool.directory / "worker-1").append(self._readings(2))
+        self.spool.append(self._readings(3))
+        self.spool.close()
+
+        call_command("replay_solar_spool", spool_dir=str(self.spool.directory), stdout=io.StringIO())
+        self.assertEqual(SolarHourlyData.objects.count(), 3)
+
+    def test_full_buffer_spools_overflow_in_batches(self):
+        buffer = WriteBuffer(flush_size=2, max_depth=2, spool=self.spool)
+        readings = self._readings(1, 2, 3, 4, 5)
+        with mock.patch.object(self.spool, "append", wraps=self.spool.append) as append:
+            for obj in readings:
+                buffer.add(obj)
+            self.assertEqual([len(c.args[0]) for c in append.call_args_list], [2])
+            buffer.stop()
+        self.assertEqual([len(c.args[0]) for c in append.call_args_list], [2, 1])
+        self.assertEqual(SolarHourlyData.objects.count(), 2)
+        self.assertEqual(self.spool.replay(), 3)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.archive = Archive(tmp.name)
+        self.month = datetime(2025, 3, 1).date()
+        SolarHourlyData.objects.bulk_create([
+            reading("D1", local_dt(2025, 3, day, 12), 10 * day) for day in (1, 15, 31)
+        ] + [reading("D1", local_dt(2025, 4, 1, 0), 500)])
+
+    def test_write_then_load_roundtrip(self):
+        self.assertEqual(self.archive.write_month("D1", self.month), 3)
+        self.assertIsNone(self.archive.write_month("D1", self.month))  # already archived
+        cols = self.archive.load("D1")
+        self.assertEqual(cols["power"].tolist(), [10, 150, 310])
+        self.assertEqual(cols["timestamp"].tolist(),
+                         [int(local_dt(2025, 3, day, 12).timestamp()) for day in (1, 15, 31)])
+        self.assertEqual(self.archive.open_month("D1", self.month)["power"].tolist(), [10, 150, 310])
+
+    def test_load_clips_to_partial_month(self):
+        self.archive.write_range("D1", self.month, datetime(2025, 4, 1).date())
+        cols = self.archive.load("D1", local_dt(2025, 3, 15, 12), local_dt(2025, 4, 1, 0))
+        self.assertEqual(cols["power"].tolist(), [150, 310])
+
+    def test_missing_month(self):
+        self.assertIsNone(self.archive.open_month("D1", self.month))
+        self.assertEqual(len(self.archive.load("D1")["timestamp"]), 0)
+        self.assertEqual(self.archive.write_month("D2", self.month), 0)
+
+    def test_series_reads_archived_month(self):
+        self.archive.write_month("D1", self.month)
+        SolarHourlyData.objects.filter(timestamp__lt=local_dt(2025, 3, 31)).delete()  # compacted away
+        ts, values = downsample.load_series("D1", local_dt(2025, 3, 1), local_dt(2025, 4, 2), archive=self.archive)
+        self.assertEqual(values.tolist(), [10, 150, 310, 500])
+        self.assertTrue((ts[1:] > ts[:-1]).all())
+
+
+class BenchCommandTests(SimpleTestCase):
+    def test_refuses_configured_database_without_debug(self):
+        with self.settings(DEBUG=False), self.assertRaisesMessage(CommandError, "--yes"):
+            call_command("bench_solar_ingest", messages=1, devices=1, stdout=io.StringIO())
+
+
+class MetricsTests(SimpleTestCase):
+    def test_counter_labels(self):
+        counter = metrics.Counter("t_total", "test", ["type"])
+        counter.inc(type="a")
+        counter.inc(2, type="b")
+        self.assertEqual((counter.value(type="b"), counter.value()), (2, 3))
+        self.assertIn(('t_total{type="a"}', 1), counter.samples())
+
+    def test_histogram_buckets_and_quantile(self):
+        hist = metrics.Histogram("t_seconds", "test", buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            hist.observe(value)
+        samples = dict(hist.samples())
+        self.assertEqual(samples['t_seconds_bucket{le="0.1"}'], 1)
+        self.assertEqual(samples['t_seconds_bucket{le="1"}'], 3)
+        self.assertEqual(samples['t_seconds_bucket{le="+Inf"}'], 4)
+        self.assertEqual(hist.quantile(0.5), 1)
+        self.assertEqual(hist.quantile(0.99), float("inf"))
+
+    def test_registry_renders_prometheus_text(self):
+        registry = metrics.Registry()
+        gauge = registry.register(metrics.Gauge("t_depth", "queue depth"))
+        gauge.set_function(lambda: 7)
+        self.assertEqual(registry.render(), "# HELP t_depth queue depth\n# TYPE t_depth gauge\nt_depth 7\n")
+
+
+class DedupTests(SimpleTestCase):
+    def test_recent_keys_evicts_least_recently_seen(self):
+        keys = RecentKeys(capacity=2)
+        self.assertFalse(keys.seen("a"))
+        self.assertFalse(keys.seen("b"))
+        self.assertTrue(keys.seen("a"))  # refreshes "a"
+        self.assertFalse(keys.seen("c"))  # evicts "b"
+        self.assertEqual(len(keys), 2)
+        self.assertTrue(keys.seen("a"))
+        self.assertFalse(keys.seen("b"))
+
+    def test_reading_key(self):
+        ts = parse_device_time(1741080000)
+        self.assertEqual(reading_key("D1", "hourly", ts, seq=5), ("D1", "hourly", "ts", ts.timestamp()))
+        self.assertEqual(reading_key("D1", "hourly", seq=5), ("D1", "hourly", "seq", "5"))
+        self.assertIsNone(reading_key("D1", "hourly"))
+        # Same instant in milliseconds and ISO form gives the same key
+        self.assertEqual(reading_key("D1", "hourly", parse_device_time("1741080000000")),
+                         reading_key("D1", "hourly", parse_device_time("2025-03-04T09:20:00Z")))
+
+    def test_implausible_device_time(self):
+        self.assertIsNone(parse_device_time(0))
+        self.assertIsNone(parse_device_time("not a time"))
+        self.assertIsNone(parse_device_time(timezone.now().timestamp() + 3 * 86400))
+
+
+class LttbTests(TestCase):
+    def test_short_series_kept_whole(self):
+        self.assertEqual(downsample.lttb([1, 2, 3], [5, 6, 7], 10).tolist(), [0, 1, 2])
+        self.assertEqual(downsample.lttb(list(range(10)), [0] * 10, 2).tolist(), [0, 9])
+
+    def test_keeps_endpoints_and_peaks(self):
+        x = list(range(1000))
+        y = [100.0] * 1000
+        y[417], y[700] = 900.0, -500.0
+        keep = downsample.lttb(x, y, 50)
+        self.assertEqual(len(keep), 50)
+        self.assertEqual((keep[0], keep[-1]), (0, 999))
+        self.assertTrue((keep[1:] > keep[:-1]).all())
+        self.assertIn(417, keep)
+        self.assertIn(700, keep)
+
+    def test_series_endpoint_downsamples(self):
+        start = local_dt(2025, 3, 4)
+        SolarHourlyData.objects.bulk_create([
+            reading("D1", start + timedelta(minutes=m), float(m % 7)) for m in range(300)
+        ])
+        data, total = downsample.downsampled_series("D1", start, start + timedelta(days=1), points=20)
+        self.assertEqual((len(data), total), (20, 300))
+        self.assertEqual(data[0]["timestamp"], start.isoformat())
+
+
+class AnomalyTests(SimpleTestCase):
+    def setUp(self):
+        self.alerts = []
+        self.detector = AnomalyDetector(self.alerts.append, alpha=0.1, drop=0.5, z=3.0, min_samples=5,
+                                        min_power=20.0, cooldown=3600, silence=0)
+
+    def _observe(self, day, power, hour=12):
+        self.detector.observe(reading("D1", local_dt(2025, 3, day, hour), power))
+
+    def _titles(self):
+        return [a.title for a in self.alerts]
+
+    def _train(self, powers, hour=12):
+        for day, power in enumerate(powers, start=1):
+            self._observe(day, power, hour)
+
+    def test_low_output_needs_drop_and_deviation(self):
+        self._train([100, 104, 96, 102, 98])
+        self._observe(10, 70)  # below the z-score band but above half the expected output
+        self.assertEqual(self.alerts, [])
+        self._observe(11, 30)
+        self.assertEqual(self._titles(), ["Low output"])
+        self.assertEqual(self.alerts[0].alert_type, "warning")
+
+    def test_warm_up_period_and_night_are_ignored(self):
+        self._train([100, 100, 100, 100])
+        self._observe(10, 0)  # only 4 samples so far
+        self._train([5, 6, 5, 6, 5, 6], hour=2)
+        self._observe(20, 0, hour=2)  # expected output below min_power
+        self.assertEqual(self.alerts, [])
+
+    def test_cooldown_suppresses_repeats(self):
+        self._train([100, 100, 100, 100, 100])
+        self._observe(10, 10)
+        self._observe(11, 10)
+        self.assertEqual(self._titles(), ["Low output"])
+
+    def test_silence_and_recovery(self):
+        self._observe(1, 100)
+        self.assertEqual(self.detector.check_silence(), 1)
+        self.assertEqual(self.detector.check_silence(), 0)  # already offline
+        self._observe(2, 100)
+        self.assertEqual(self._titles(), ["Device offline", "Device back online"])
+
+
+class StatsViewTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+        self.now = timezone.localtime().replace(minute=0, second=0, microsecond=0)
+
+    def _get(self, day, **headers):
+        return self.client.get("/api/solar/stats", {"device_id": "D1", "period": "day", "date": day.isoformat()},
+                               **headers)
+
+    def _write(self, objs):
+        SolarHourlyData.objects.bulk_create(objs)
+        stats_cache.after_write(SolarHourlyData, objs)
+
+    def test_if_none_match_returns_304(self):
+        first = self._get(self.today)
+        self.assertEqual(first.status_code, 200)
+        again = self._get(self.today, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b"")
+        self.assertEqual(again["ETag"], first["ETag"])
+
+    def test_new_reading_or_wash_bumps_version(self):
+        gen, ver, hist = stats_cache.versions("D1")
+        other = stats_cache.versions("D2")
+        etag = self._get(self.today)["ETag"]
+
+        self._write([reading("D1", self.now, 100)])
+        self.assertEqual(stats_cache.versions("D1"), (gen, ver + 1, hist))
+        self.assertEqual(self._get(self.today, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        wash = WashRecord(device_id="D1", wash_type="BEFORE", voltage=12, current=1, power=10, timestamp=self.now)
+        stats_cache.after_write(WashRecord, [wash])
+        self.assertEqual(stats_cache.versions("D1"), (gen, ver + 2, hist))
+        self.assertEqual(stats_cache.versions("D2"), other)
+
+    def test_closed_day_series_survives_a_write_to_today(self):
+        self._write([reading("D1", local_dt(*self.yesterday.timetuple()[:3], 12), 100)])
+        with mock.patch.object(views, "_period_series", wraps=views._period_series) as series:
+            self.assertEqual(self._get(self.yesterday).json()["period_yield"], 100)
+            self._write([reading("D1", self.now, 50)])
+            self.assertEqual(self._get(self.yesterday).json()["period_yield"], 100)
+            self.assertEqual(series.call_count, 1)
+
+            # A late reading for yesterday does invalidate it
+            self._write([reading("D1", local_dt(*self.yesterday.timetuple()[:3], 13), 30)])
+            self.assertEqual(self._get(self.yesterday).json()["period_yield"], 130)
+            self.assertEqual(series.call_count, 2)
+
+
+class SoilingTests(TestCase):
+    def setUp(self):
+        # 20 days losing 1% of the starting peak a day, washed back to 1000 W on day 10
+        self.start = timezone.localdate() - timedelta(days=25)
+        SolarDailyRollup.objects.bulk_create([
+            SolarDailyRollup(device_id="D1", day=self.start + timedelta(days=d),
+                             power_max=1000 - 10 * (d % 10), power_sum=5000, power_count=1)
+            for d in range(20)
+        ])
+        wash_day = self.start + timedelta(days=10)
+        before = WashRecord(device_id="D1", wash_type="BEFORE", voltage=12, current=1, power=800,
+                            timestamp=local_dt(*wash_day.timetuple()[:3], 11))
+        after = WashRecord(device_id="D1", wash_type="AFTER", voltage=12, current=1, power=1000,
+                           timestamp=local_dt(*wash_day.timetuple()[:3], 12))
+        wash_cycles.save_cycles([wash_cycles.build_cycle(before, after)])
+
+    def test_analyze_decay_and_wash(self):
+        data = soiling.load(["D1"], self.start, timezone.localdate())
+        result = soiling.analyze(data, prices={"D1": 5.0}, wash_cost=10.0, recovery_days=3)["D1"]
+        self.assertEqual(result["soiling_rate_percent"], 1.0)
+        self.assertEqual(result["wash_gain_percent"], 25.0)
+        self.assertEqual(result["recovery_percent"], round((980 / 920 - 1) * 100, 3))
+        self.assertEqual((result["days_analyzed"], result["washes"], result["daily_yield_kwh"]), (20, 1, 5.0))
+        # sqrt(2 * 10 / (5 kWh * 5/kWh * 1%))
+        self.assertEqual(result["optimal_interval_days"], 8.9)
+
+    def test_analyze_without_data(self):
+        self.assertEqual(soiling.analyze(soiling.load(["D9"], self.start, timezone.localdate())), {})
+
+    def test_compute_upserts_estimate(self):
+        soiling.compute(["D1"], window_days=30)
+        SolarDailyRollup.objects.filter(day__gte=self.start + timedelta(days=10)).delete()
+        soiling.compute(["D1"], window_days=30)
+        estimate = SoilingEstimate.objects.get()
+        self.assertEqual((estimate.washes, estimate.days_analyzed), (1, 10))
+        self.assertEqual(estimate.soiling_rate_percent, 1.0)
+        self.assertEqual(estimate.window_end, timezone.localdate())
+
+
+class PerformanceTests(TestCase):
+    def setUp(self):
+        self.end = datetime(2025, 6, 30).date()
+        DeviceLocation.objects.create(device_id="D1", lat=26.9, lon=75.8, capacity=2.0)
+
+    def _days(self, device_id, first, count, wh):
+        SolarDailyRollup.objects.bulk_create([
+            SolarDailyRollup(device_id=device_id, day=first + timedelta(days=d), power_sum=wh, power_count=1)
+            for d in range(count)
+        ])
+
+    def test_ratios_over_windows(self):
+        self._days("D1", self.end - timedelta(days=29), 30, 8000)
+        result = performance.run(["D1"], end=self.end, workers=1, peak_sun_hours=5.0, log=lambda msg: None)
+        self.assertEqual(result, 1)
+        summary = PerformanceSummary.objects.get(device_id="D1")
+        self.assertEqual((summary.yield_7d_kwh, summary.yield_30d_kwh), (56, 240))
+        self.assertEqual((summary.specific_yield_30d, summary.performance_ratio_30d), (4, 0.8))
+        self.assertEqual((summary.capacity, summary.days_reported_30d), (2.0, 30))
+
+    def test_missing_days_are_left_out(self):
+        # Three reported days in the last week, default capacity
+        self._days("D2", self.end - timedelta(days=2), 3, 10000)
+        data = performance.load(["D2", "D9"], self.end - timedelta(days=400), self.end)
+        results = performance.analyze(data, self.end, peak_sun_hours=5.0)
+        self.assertEqual(results["D2"]["yield_7d_kwh"], 30)
+        self.assertEqual(results["D2"]["specific_yield_7d"], 2)
+        self.assertEqual(results["D2"]["days_reported_30d"], 3)
+        self.assertIsNone(results["D2"]["degradation_percent_per_year"])
+        self.assertIsNone(results["D9"]["performance_ratio_30d"])
+
+    def test_degradation_compares_like_months(self):
+        self._days("D1", datetime(2024, 6, 1).date(), 30, 10000)
+        self._days("D1", datetime(2025, 6, 1).date(), 30, 9000)
+        performance.run(["D1"], end=self.end, workers=1, log=lambda msg: None)
+        summary = PerformanceSummary.objects.get(device_id="D1")
+        self.assertEqual((summary.degradation_percent_per_year, summary.degradation_months), (-10, 1))
+
+        # Recomputing updates the same row
+        SolarDailyRollup.objects.filter(day__year=2024).update(power_sum=9000)
+        performance.run(["D1"], end=self.end, workers=1, log=lambda msg: None)
+        self.assertEqual(PerformanceSummary.objects.get().degradation_percent_per_year, 0)
+
+
+class WeatherLogTests(TestCase):
+    cell = (26.9, 75.8)
+
+    def _build(self, kind=weather_log.RAIN, data=None, **values):
+        return weather_log.build(kind, self.cell, "D1", 26.91, 75.79, data, **values)
+
+    def test_lookups_in_one_hour_share_a_row(self):
+        with mock.patch.object(weather_log, "keep_raw", return_value=False):
+            weather_log.save([self._build(max_rain=1.0)])
+            weather_log.save([self._build(max_rain=4.0), self._build(max_rain=2.0)])
+            weather_log.save([self._build(weather_log.CURRENT, temperature=30)])
+        self.assertEqual(WeatherLog.objects.count(), 2)
+        self.assertEqual(WeatherLog.objects.get(kind=weather_log.RAIN).max_rain, 2.0)
+
+        next_hour = self._build(max_rain=5.0)
+        next_hour.hour += timedelta(hours=1)
+        weather_log.save([next_hour])
+        self.assertEqual(WeatherLog.objects.filter(kind=weather_log.RAIN).count(), 2)
+
+    def test_raw_payload_sampled_and_compressed(self):
+        with mock.patch.object(weather_log.random, "random", return_value=0.3):
+            self.assertEqual([weather_log.keep_raw(rate=r) for r in (0, 0.2, 0.5)], [False, False, True])
+            self.assertTrue(weather_log.keep_raw(failed=True, rate=0))
+
+        data = {"hourly": {"precipitation": [0.5, 1.5]}}
+        self.assertEqual(weather_log.encode(data, compress=False), {"raw_response": data, "raw_compressed": None})
+        encode = weather_log.encode
+        with mock.patch.object(weather_log, "encode", side_effect=lambda d: encode(d, compress=True)):
+            with mock.patch.object(weather_log, "keep_raw", return_value=True):
+                weather_log.save([self._build(data=data, max_rain=1.5)])
+            log = WeatherLog.objects.get()
+            self.assertIsNone(log.raw_response)
+            self.assertEqual(weather_log.payload(log), data)
+
+            # A later lookup without a sample keeps the stored payload
+            with mock.patch.object(weather_log, "keep_raw", return_value=False):
+                weather_log.save([self._build(data=data, max_rain=3.0)])
+        log.refresh_from_db()
+        self.assertEqual((log.max_rain, weather_log.payload(log)), (3.0, data))
+
+    def test_record_failure(self):
+        weather_log.record_failure(weather_log.RAIN, [(26.91, 75.79), (20.0, 70.0)], 429, "x" * 5000)
+        weather_log.record_failure(weather_log.RAIN, [(26.91, 75.79)], 500, "error")
+        log = WeatherLog.objects.get()
+        self.assertEqual(log.kind, "rain_failed")
+        self.assertEqual(weather_log.payload(log), {"status": 500, "locations": 1, "body": "error"})
+
+        weather_log.record_failure(weather_log.RAIN, [(20.0, 70.0)], 429, "x" * 5000)
+        body = weather_log.payload(WeatherLog.objects.get(cell=weather_log.cell_label((20.0, 70.0))))["body"]
+        self.assertEqual(len(body), weather_log.MAX_FAILURE_BODY)
+
+
+class CurrentWeatherTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        DeviceLocation.objects.create(device_id="D1", lat=26.91, lon=75.79)
+        weather_log.save([weather_log.build(weather_log.CURRENT, weather.snap_to_grid(26.91, 75.79), "D1",
+                                            26.91, 75.79, temperature=31.5, weather_code=2)])
+
+    def test_stats_fall_back_to_logged_weather(self):
+        response = self.client.get("/api/solar/stats", {"device_id": "D1", "period": "day"})
+        location = response.json()["location"]
+        self.assertEqual((location["temperature"], location["weather_code"]), (31.5, 2))
+        self.assertFalse(location["weather_stale"])
+        # Re-primed for the next request
+        self.assertEqual(get_cache().get(current_weather.current_key(26.91, 75.79))["temperature"], 31.5)
+
+    def test_fleet_uses_the_newest_row(self):
+        WeatherLog.objects.update(hour=timezone.now() - timedelta(hours=2))
+        weather_log.save([weather_log.build(weather_log.CURRENT, weather.snap_to_grid(26.91, 75.79), "D1",
+                                            26.91, 75.79, temperature=29.0, weather_code=3)])
+        entries = current_weather.get_current_many(DeviceLocation.objects.all())
+        self.assertEqual(entries["D1"]["temperature"], 29.0)
@@ -3,6 +3,10 @@ from . import views
 
 urlpatterns = [
     path('stats', views.get_solar_stats, name='solar_stats'),
+    path('stats/fleet', views.get_fleet_stats, name='solar_fleet_stats'),
+    path('series', views.get_solar_series, name='solar_series'),
+    path('soiling', views.get_soiling, name='solar_soiling'),
+    path('performance', views.get_performance, name='solar_performance'),
     path('latest', views.get_latest_solar_data, name='solar_latest'),
     # path('ping', views.ping_location, name='solar_ping'),
     # path('device/complete-setup', views.complete_setup, name='complete_setup'),
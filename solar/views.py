@@ -1,18 +1,25 @@
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified
 from django.views.decorators.csrf import csrf_exempt
-from django.db import models
-from django.db.models import Avg, Sum
-from django.db.models.functions import TruncDay, TruncMonth
+from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views.decorators.http import require_http_methods
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import calendar
 import json
 import requests
 
 # pyrefly: ignore [missing-import]
-from .models import SolarHourlyData, WashRecord, DeviceLocation, WeatherLog
+from .models import SolarHourlyData, DeviceLocation, WashCycle, SoilingEstimate, PerformanceSummary
+from .services import current_weather, downsample, fleet, performance, rollups, soiling, stats_cache, wash_cycles
+from .services.archive import Archive
+from .services.live import get_latest, get_today_yield
 
+WASH_FALLBACK_LIMIT = 100  # wash records scanned when a device has no WashCycle yet
+FLEET_MAX_DEVICES = getattr(settings, 'SOLAR_FLEET_MAX_DEVICES', 200)
+SERIES_DEFAULT_POINTS = 500
+SERIES_MAX_POINTS = getattr(settings, 'SOLAR_SERIES_MAX_POINTS', 5000)
+SERIES_MAX_DAYS = getattr(settings, 'SOLAR_SERIES_MAX_DAYS', 366)
 
 def json_response(status: bool, message: str, status_code: int = 200, **extra):
     payload = {"status": status, "message": message}
@@ -32,21 +39,11 @@ def get_latest_solar_data(request):
     if not device_id:
         return json_response(False, "Missing device_id", status_code=400)
 
-    latest = (
-        SolarHourlyData.objects
-        .filter(device_id=device_id)
-        .order_by('-timestamp')
-        .first()
-    )
+    # Written by the MQTT ingestor; falls back to the DB on a cache miss
+    latest = get_latest(device_id)
 
     if latest:
-        data = {
-            "timestamp": latest.timestamp.isoformat(),
-            "power": latest.power,
-            "voltage": latest.voltage,
-            "current": latest.current,
-            "energy": latest.energy
-        }
+        data = latest
     else:
         # No data → return zero values
         now = timezone.now()
@@ -60,43 +57,52 @@ def get_latest_solar_data(request):
 
     return json_response(True, "Success", data=data)
 
-@csrf_exempt
-def get_solar_stats(request):
-    device_id = request.GET.get('device_id')
-    period = request.GET.get('period')  # day | month | year
+def _stats_query(device_id, period, params):
+    """Normalize the stats query so equivalent requests share a cache entry."""
+    if period == "day":
+        date_str = params.get("date")  # YYYY-MM-DD
+        if not date_str:
+            # Default to today if not provided
+            date_str = timezone.now().strftime("%Y-%m-%d")
+        return (device_id, period, datetime.strptime(date_str, "%Y-%m-%d").date().isoformat())
+    if period == "month":
+        month_str = params.get("month")  # YYYY-MM
+        if not month_str:
+            month_str = timezone.now().strftime("%Y-%m")
+        year, month = map(int, month_str.split("-"))
+        return (device_id, period, f"{year:04d}-{month:02d}")
+    if period == "year":
+        year_str = params.get("year")  # YYYY
+        if not year_str:
+            year_str = timezone.now().strftime("%Y")
+        return (device_id, period, f"{int(year_str):04d}")
+    return (device_id, period)
+
+
+def _period_closed(query):
+    """True once the requested day/month/year is over (local time)."""
+    if len(query) < 3:
+        return False
+    period, value = query[1], query[2]
+    today = timezone.localdate()
+    if period == "day":
+        return value < today.isoformat()
+    if period == "month":
+        return value < today.strftime("%Y-%m")
+    return value < today.strftime("%Y")
 
-    if not device_id or not period:
-        return json_response(False, "device_id and period are required", status_code=400)
 
+def _period_series(query):
+    """Chart points and totals for the requested period."""
+    device_id, period = query[0], query[1]
     data_points = []
     total_yield = 0.0
     avg_power = 0.0
     avg_energy = 0.0
-    today_yield = 0.0
-
-    # Fetch Location, Price and Capacity
-    location_obj = DeviceLocation.objects.filter(device_id=device_id).first()
-    price_per_unit = 5.0
-    if location_obj:
-        price_per_unit = location_obj.price
-
-    # Real Today yield (Independent of period)
-    now = timezone.now()
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-    today_yield = SolarHourlyData.objects.filter(
-        device_id=device_id, 
-        timestamp__range=(today_start, today_end)
-    ).aggregate(models.Sum('power'))['power__sum'] or 0.0
 
     # ===================== DAY =====================
     if period == "day":
-        date_str = request.GET.get("date")  # YYYY-MM-DD
-        if not date_str:
-            # Default to today if not provided
-            date_str = timezone.now().strftime("%Y-%m-%d")
-
-        selected_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+        selected_date = datetime.strptime(query[2], "%Y-%m-%d").date()
 
         start_time = timezone.make_aware(
             datetime.combine(selected_date, datetime.min.time())
@@ -126,33 +132,20 @@ def get_solar_stats(request):
 
     # ===================== MONTH =====================
     elif period == "month":
-        month_str = request.GET.get("month")  # YYYY-MM
-        if not month_str:
-            month_str = timezone.now().strftime("%Y-%m")
-
-        year, month = map(int, month_str.split("-"))
-
-        start_time = timezone.make_aware(datetime(year, month, 1))
+        year, month = map(int, query[2].split("-"))
         last_day = calendar.monthrange(year, month)[1]
-        end_time = timezone.make_aware(datetime(year, month, last_day, 23, 59, 59))
-
-        qs = (
-            SolarHourlyData.objects
-            .filter(device_id=device_id, timestamp__range=(start_time, end_time))
-            .annotate(day=TruncDay("timestamp"))
-            .values("day")
-            .annotate(daily_sum=Sum("power"))
-            .order_by("day")
-        )
+
+        # Pre-aggregated by the MQTT ingestor; raw rows only for days not backfilled yet
+        daily = rollups.daily_totals([device_id], date(year, month, 1), date(year, month, last_day))[device_id]
 
         total_p = 0
         count = 0
-        for item in qs:
+        for day, daily_sum in daily.items():
             data_points.append({
-                "time": item["day"].strftime("%d-%b"),
-                "power": round(item["daily_sum"], 2)
+                "time": day.strftime("%d-%b"),
+                "power": round(daily_sum, 2)
             })
-            total_p += item["daily_sum"]
+            total_p += daily_sum
             count += 1
         
         if count > 0:
@@ -162,32 +155,18 @@ def get_solar_stats(request):
 
     # ===================== YEAR =====================
     elif period == "year":
-        year_str = request.GET.get("year")  # YYYY
-        if not year_str:
-            year_str = timezone.now().strftime("%Y")
+        year = int(query[2])
 
-        year = int(year_str)
-
-        start_time = timezone.make_aware(datetime(year, 1, 1))
-        end_time = timezone.make_aware(datetime(year, 12, 31, 23, 59, 59))
-
-        qs = (
-            SolarHourlyData.objects
-            .filter(device_id=device_id, timestamp__range=(start_time, end_time))
-            .annotate(month=TruncMonth("timestamp"))
-            .values("month")
-            .annotate(monthly_sum=Sum("power"))
-            .order_by("month")
-        )
+        monthly = rollups.monthly_totals([device_id], year)[device_id]
 
         total_p = 0
         count = 0
-        for item in qs:
+        for month, monthly_sum in monthly.items():
             data_points.append({
-                "time": item["month"].strftime("%b"),
-                "power": round(item["monthly_sum"], 2)
+                "time": month.strftime("%b"),
+                "power": round(monthly_sum, 2)
             })
-            total_p += item["monthly_sum"]
+            total_p += monthly_sum
             count += 1
         
         if count > 0:
@@ -195,31 +174,213 @@ def get_solar_stats(request):
             avg_power = total_p / (count * 30 * 24)
             avg_energy = total_p / count # Average per month
 
+    return {
+        "data": data_points,
+        "total_yield": total_yield,
+        "avg_power": avg_power,
+        "avg_energy": avg_energy,
+    }
+
+
+@csrf_exempt
+def get_solar_stats(request):
+    device_id = request.GET.get('device_id')
+    period = request.GET.get('period')  # day | month | year
+
+    if not device_id or not period:
+        return json_response(False, "device_id and period are required", status_code=400)
+
+    query = _stats_query(device_id, period, request.GET)
+
+    # Cached per query and device data version, see services/stats_cache.py
+    versions = stats_cache.versions(device_id)
+
+    cached = None
+    if versions is not None:
+        key = stats_cache.response_key(query, versions)
+        cached = stats_cache.cache_get(key)
+    if cached is None:
+        body = _render_stats(query, versions).content
+        cached = {"body": body, "etag": stats_cache.make_etag(body)}
+        if versions is not None:
+            stats_cache.cache_set(key, cached)
+
+    if stats_cache.etag_matches(request, cached["etag"]):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(cached["body"], content_type="application/json")
+    response["ETag"] = cached["etag"]
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@csrf_exempt
+def get_fleet_stats(request):
+    """
+    GET /api/solar/stats/fleet?device_ids=a,b,c&period=day|month|year[&date|month|year=...]
+    The /stats payload for each device, computed with grouped queries.
+    """
+    raw_ids = request.GET.getlist('device_id') + request.GET.get('device_ids', '').split(',')
+    device_ids = list(dict.fromkeys(d.strip() for d in raw_ids if d.strip()))
+    period = request.GET.get('period')  # day | month | year
+
+    if not device_ids or not period:
+        return json_response(False, "device_ids and period are required", status_code=400)
+    if len(device_ids) > FLEET_MAX_DEVICES:
+        return json_response(False, f"at most {FLEET_MAX_DEVICES} devices per request", status_code=400)
+
+    query = _stats_query(None, period, request.GET)
+    value = query[2] if len(query) > 2 else None
+    devices, totals = fleet.fleet_stats(device_ids, period, value, wash_fallback_limit=WASH_FALLBACK_LIMIT)
+    body = json_response(True, "Fleet stats fetched", devices=devices, totals=totals).content
+    etag = stats_cache.make_etag(body)
+    if stats_cache.etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def _parse_bound(value, end=False):
+    """ISO datetime or YYYY-MM-DD (a date `end` includes that whole day)."""
+    day = parse_date(value)
+    if day is not None:
+        dt = datetime.combine(day + timedelta(days=1) if end else day, datetime.min.time())
+    else:
+        dt = parse_datetime(value)
+        if dt is None:
+            raise ValueError(f"invalid date: {value}")
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+@csrf_exempt
+def get_solar_series(request):
+    """
+    GET /api/solar/series?device_id=...&start=...&end=...&points=500&field=power
+    Readings in [start, end) downsampled with LTTB to at most `points` points.
+    Archived months are read from the columnar archive. Defaults to the last 24 hours.
+    """
+    device_id = request.GET.get('device_id')
+    field = request.GET.get('field', 'power')
+    if not device_id:
+        return json_response(False, "device_id is required", status_code=400)
+    if field not in downsample.FIELDS:
+        return json_response(False, f"field must be one of {', '.join(downsample.FIELDS)}", status_code=400)
+
+    try:
+        end = _parse_bound(request.GET['end'], end=True) if request.GET.get('end') else timezone.now()
+        start = _parse_bound(request.GET['start']) if request.GET.get('start') else end - timedelta(days=1)
+        points = int(request.GET.get('points', SERIES_DEFAULT_POINTS))
+    except ValueError as e:
+        return json_response(False, str(e), status_code=400)
+    if start >= end:
+        return json_response(False, "start must be before end", status_code=400)
+    if end - start > timedelta(days=SERIES_MAX_DAYS):
+        return json_response(False, f"range is limited to {SERIES_MAX_DAYS} days", status_code=400)
+    points = max(2, min(points, SERIES_MAX_POINTS))
+
+    data, raw_points = downsample.downsampled_series(device_id, start, end, field=field, points=points,
+                                                      archive=Archive())
+    body = json_response(
+        True, "Series fetched",
+        device_id=device_id,
+        field=field,
+        start=start.isoformat(),
+        end=end.isoformat(),
+        raw_points=raw_points,
+        data=data,
+    ).content
+    etag = stats_cache.make_etag(body)
+    if stats_cache.etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@csrf_exempt
+def get_soiling(request):
+    """
+    GET /api/solar/soiling?device_id=...[&refresh=1]
+    Soiling rate, wash gain and suggested wash interval for a device, as
+    last computed by compute_soiling (computed on the spot if missing).
+    """
+    device_id = request.GET.get('device_id')
+    if not device_id:
+        return json_response(False, "device_id is required", status_code=400)
+
+    estimate = SoilingEstimate.objects.filter(device_id=device_id).first()
+    if estimate is None or request.GET.get('refresh') == '1':
+        soiling.compute([device_id])
+        estimate = SoilingEstimate.objects.filter(device_id=device_id).first()
+    if estimate is None:
+        return json_response(True, "Not enough data", device_id=device_id, data=None)
+
+    return json_response(True, "Soiling fetched", device_id=device_id, data=soiling.as_dict(estimate))
+
+
+@csrf_exempt
+def get_performance(request):
+    """
+    GET /api/solar/performance?device_id=...
+    Performance ratio, specific yield and degradation trend for a device, as
+    last computed by the nightly compute_performance run.
+    """
+    device_id = request.GET.get('device_id')
+    if not device_id:
+        return json_response(False, "device_id is required", status_code=400)
+
+    summary = PerformanceSummary.objects.filter(device_id=device_id).first()
+    if summary is None:
+        return json_response(True, "Not computed yet", device_id=device_id, data=None)
+
+    return json_response(True, "Performance fetched", device_id=device_id, data=performance.as_dict(summary))
+
+
+def _render_stats(query, versions):
+    device_id = query[0]
+
+    # Fetch Location, Price and Capacity
+    location_obj = DeviceLocation.objects.filter(device_id=device_id).first()
+    price_per_unit = 5.0
+    if location_obj:
+        price_per_unit = location_obj.price
+
+    # Real Today yield (Independent of period), kept running by the MQTT ingestor
+    today_yield = get_today_yield(device_id)
+
+    # A finished period only changes with late data: keep its series until then
+    series = None
+    if versions is not None and _period_closed(query):
+        series_key = stats_cache.series_key(query, versions)
+        series = stats_cache.cache_get(series_key)
+        if series is None:
+            series = _period_series(query)
+            stats_cache.cache_set(series_key, series, timeout=stats_cache.series_timeout())
+    if series is None:
+        series = _period_series(query)
+
+    data_points = series["data"]
+    total_yield = series["total_yield"]
+    avg_power = series["avg_power"]
+    avg_energy = series["avg_energy"]
+
     money_saved = (total_yield / 1000.0) * price_per_unit
 
-    wash_records = WashRecord.objects.filter(device_id=device_id).order_by('-timestamp')
-    
-    wash_data = {'before': None, 'after': None}
-    
-    for i, record in enumerate(wash_records):
-        if record.wash_type == 'AFTER':
-            if i + 1 < len(wash_records):
-                prev_record = wash_records[i+1]
-                if prev_record.wash_type == 'BEFORE':
-                    wash_data['after'] = {
-                        "voltage": record.voltage,
-                        "current": record.current,
-                        "power": record.power,
-                        "timestamp": record.timestamp.isoformat()
-                    }
-                    wash_data['before'] = {
-                        "voltage": prev_record.voltage,
-                        "current": prev_record.current,
-                        "power": prev_record.power,
-                        "timestamp": prev_record.timestamp.isoformat()
-                    }
-                    break
-            
+    # Paired by the MQTT ingestor as the after_wash reading arrives
+    cycle = WashCycle.objects.filter(device_id=device_id).order_by('-after_timestamp').first()
+    if cycle:
+        wash_data = wash_cycles.cycle_summary(cycle)
+    else:
+        # Not paired yet (cycles never backfilled): look at recent records only
+        wash_data = wash_cycles.recent_pair_summary(device_id, WASH_FALLBACK_LIMIT)
+
     location_data = {"city": "Unknown", "state": "Unknown", "temperature": None, "lat": None, "lon": None, "price": price_per_unit, "capacity": 5.0}
     if location_obj:
         location_data["city"] = location_obj.city
@@ -228,34 +389,15 @@ def get_solar_stats(request):
         location_data["lon"] = location_obj.lon
         location_data["price"] = location_obj.price
         location_data["capacity"] = location_obj.capacity
-        
-        try:
-            weather_url = f"https://api.open-meteo.com/v1/forecast?latitude={location_obj.lat}&longitude={location_obj.lon}&current=temperature_2m,weather_code"
-            weather_response = requests.get(weather_url, timeout=3)
-            if weather_response.status_code == 200:
-                weather_data = weather_response.json()
-                if 'current' in weather_data:
-                    if 'temperature_2m' in weather_data['current']:
-                        location_data["temperature"] = weather_data['current']['temperature_2m']
-                    if 'weather_code' in weather_data['current']:
-                        location_data["weather_code"] = weather_data['current']['weather_code']
-
-                # Save every weather API response to WeatherLog
-                WeatherLog.objects.create(
-                    device_id=device_id,
-                    lat=location_obj.lat,
-                    lon=location_obj.lon,
-                    temperature=location_data.get("temperature"),
-                    weather_code=location_data.get("weather_code"),
-                    raw_response=weather_data,
-                )
-        except Exception as e:
-            print(f"Weather API error: {e}")
+
+        # Kept fresh in the background, see services/current_weather.py
+        location_data.update(current_weather.describe(
+            current_weather.get_current(location_obj.lat, location_obj.lon)))
     
     current_power = 0.0
-    latest_reading = SolarHourlyData.objects.filter(device_id=device_id).order_by('-timestamp').first()
+    latest_reading = get_latest(device_id)
     if latest_reading:
-        current_power = latest_reading.power
+        current_power = latest_reading["power"]
 
     return json_response(
         True, "Stats fetched",
@@ -556,6 +698,7 @@ def save_device_location(request):
                 "last_updated": timezone.now()
             }
         )
+        stats_cache.invalidate([device_id], history=False)
 
         return JsonResponse({
             "status": True,